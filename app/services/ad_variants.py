@@ -0,0 +1,60 @@
+import re
+import json
+from typing import List
+
+from app.services.llm_client import llm_client
+
+# Limits for one variant request (N texts x M seeds images)
+VARIANT_MAX_TEXTS = 8
+VARIANT_MAX_SEEDS = 4
+
+
+def build_variants_prompt(product_name: str, description: str, n: int) -> str:
+    """Ask for n distinct one-line ads as a JSON array (cf. generate_posts in open_ai.py)"""
+    return f"""You are a professional advertising copywriter.
+Write {n} different catchy, one line marketing ads for the same product.
+Vary the angle of each one (benefit, emotion, urgency, humor, ...).
+
+Product: {product_name}
+Product details: {description}
+
+Return ONLY a JSON array of {n} strings like:
+["...", "...", "..."]"""
+
+
+def parse_variants(text: str, n: int) -> List[str]:
+    """Pull up to n unique ad lines out of the model's reply
+
+    Accepts a JSON array of strings or of objects with an "ad"/"text"/
+    "caption" field; falls back to one ad per non-empty line when the reply
+    isn't valid JSON.
+    """
+    items = []
+    match = re.search(r"\[.*\]", text, re.S)
+    if match:
+        try:
+            parsed = json.loads(match.group(0))
+            for item in parsed if isinstance(parsed, list) else []:
+                if isinstance(item, dict):
+                    item = item.get("ad") or item.get("text") or item.get("caption") or ""
+                items.append(str(item))
+        except ValueError:
+            pass
+    if not items:
+        items = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line) for line in text.splitlines()]
+
+    variants = []
+    for item in items:
+        item = item.strip().strip('"').strip()
+        if item and item not in variants:
+            variants.append(item)
+    return variants[:n]
+
+
+async def generate_ad_variants(product_name: str, description: str, n: int, use_cache: bool = True) -> List[str]:
+    """n ad texts from a single LLM round"""
+    reply = await llm_client.generate(build_variants_prompt(product_name, description, n), use_cache=use_cache)
+    variants = parse_variants(reply, n)
+    if not variants:
+        raise ValueError("LLM returned no ad variants")
+    return variants
@@ -0,0 +1,221 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from urllib.parse import unquote
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Generated-asset metadata index (defaults to the Instagram storage database)
+ASSET_INDEX_DB = os.getenv("ASSET_INDEX_DB", os.getenv("INSTAGRAM_STORAGE_DB", "instagram.sqlite3"))
+# last_accessed is written at most this often per file
+ASSET_TOUCH_INTERVAL = float(os.getenv("ASSET_TOUCH_INTERVAL", "300"))
+
+# File names of generated assets: 32 hex chars (content or request hash) + extension
+ASSET_NAME = re.compile(r"[0-9a-f]{32}\.(?:png|jpg|webp)")
+# Files from before hash naming (<product>_<ts>.png, product_enhanced_<ts>.jpg); they stay flat
+LEGACY_NAME = re.compile(r"[^/\\\x00.][^/\\\x00]*\.(?:png|jpe?g|webp)", re.IGNORECASE)
+_URL_NAME = re.compile(r"/(?:generated_ads|media)/([^/?#\"\s]+)")
+
+
+def referenced_names(text: str) -> Set[str]:
+    """Asset file names in `text` (a post's JSON): hash names anywhere, any name in a media URL"""
+    names = set(ASSET_NAME.findall(text))
+    names.update(unquote(name) for name in _URL_NAME.findall(text))
+    return names
+
+
+# An asset is protected if it, or a rendition made from it, is referenced by a post
+_UNPROTECTED = """
+    a.posted = 0 AND a.scheduled = 0 AND NOT EXISTS (
+        SELECT 1 FROM assets c WHERE c.parent = a.name AND (c.posted = 1 OR c.scheduled = 1)
+    )
+"""
+
+
+class AssetIndex:
+    """SQLite index of generated files: size, owner, parent, created/accessed, post references
+
+    Lets the storage manager pick deletion candidates and report usage
+    with indexed queries instead of walking the directory tree.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS assets (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        owner TEXT,
+        parent TEXT,
+        created_at REAL NOT NULL,
+        last_accessed REAL NOT NULL,
+        posted INTEGER NOT NULL DEFAULT 0,
+        posted_at REAL,
+        scheduled INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_assets_access ON assets (last_accessed);
+    CREATE INDEX IF NOT EXISTS idx_assets_parent ON assets (parent);
+    CREATE INDEX IF NOT EXISTS idx_assets_owner ON assets (owner);
+    """
+
+    def __init__(self, db_path: str = ASSET_INDEX_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._touched: Dict[str, float] = {}
+        self._total: Optional[int] = None
+        self._total_lock = threading.Lock()
+        # Set by the storage manager; called (from any thread) when writes pass the quota
+        self.quota_bytes: Optional[int] = None
+        self.on_over_quota: Optional[Callable[[], None]] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(self.SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    # -- writes from the image cache --
+
+    def record(self, name: str, size: int, parent: Optional[str] = None,
+               created_at: Optional[float] = None, accessed_at: Optional[float] = None):
+        """A file was written (or rewritten) under `name`"""
+        now = time.time()
+        conn = self._conn()
+        old = conn.execute("SELECT size FROM assets WHERE name = ?", (name,)).fetchone()
+        conn.execute(
+            "INSERT INTO assets (name, size, parent, created_at, last_accessed) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_accessed = excluded.last_accessed",
+            (name, size, parent, created_at or now, accessed_at or now),
+        )
+        self._touched[name] = now
+        self._add_to_total(size - (old[0] if old else 0))
+
+    def touch(self, name: str):
+        """Note an access; throttled to one write per ASSET_TOUCH_INTERVAL per file"""
+        now = time.time()
+        if now - self._touched.get(name, 0) < ASSET_TOUCH_INTERVAL:
+            return
+        if len(self._touched) > 10000:
+            self._touched.clear()
+        self._touched[name] = now
+        self._conn().execute("UPDATE assets SET last_accessed = ? WHERE name = ?", (now, name))
+
+    def set_owner(self, name: str, owner: str):
+        """Owner of an asset and the renditions made from it (the first owner is kept)"""
+        self._conn().execute(
+            "UPDATE assets SET owner = COALESCE(owner, ?) WHERE name = ? OR parent = ?", (owner, name, name)
+        )
+
+    def delete(self, names: List[str]):
+        conn = self._conn()
+        freed = 0
+        with conn:
+            conn.execute("BEGIN")
+            for name in names:
+                row = conn.execute("SELECT size FROM assets WHERE name = ?", (name,)).fetchone()
+                if row:
+                    freed += row[0]
+                    conn.execute("DELETE FROM assets WHERE name = ?", (name,))
+        for name in names:
+            self._touched.pop(name, None)
+        self._add_to_total(-freed)
+
+    def _add_to_total(self, delta: int):
+        with self._total_lock:
+            if self._total is None:
+                self._total = self.total_bytes()
+            else:
+                self._total += delta
+            over = self.quota_bytes is not None and self._total > self.quota_bytes
+        if over and delta > 0 and self.on_over_quota:
+            self.on_over_quota()
+
+    # -- post references --
+
+    def mark_posted(self, names: Iterable[str], posted_at: Optional[float] = None) -> int:
+        names = list(names)
+        if not names:
+            return 0
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            return sum(
+                conn.execute(
+                    "UPDATE assets SET posted = 1, posted_at = COALESCE(posted_at, ?) WHERE name = ? AND posted = 0",
+                    (posted_at or time.time(), name),
+                ).rowcount
+                for name in names
+            )
+
+    def set_scheduled(self, names: Iterable[str]):
+        """Exactly `names` are referenced by pending scheduled posts"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("UPDATE assets SET scheduled = 0 WHERE scheduled = 1")
+            conn.executemany("UPDATE assets SET scheduled = 1 WHERE name = ?", [(n,) for n in set(names)])
+
+    # -- queries for the sweeper and usage report --
+
+    def untracked(self, names: Iterable[str]) -> List[str]:
+        conn = self._conn()
+        return [name for name in names
+                if conn.execute("SELECT 1 FROM assets WHERE name = ?", (name,)).fetchone() is None]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM assets").fetchone()[0]
+
+    def expired(self, accessed_before: float, limit: int = 500) -> List[Tuple[str, int]]:
+        """Unprotected assets not accessed since `accessed_before`"""
+        return self._conn().execute(
+            f"SELECT name, size FROM assets a WHERE a.last_accessed < ? AND {_UNPROTECTED} "
+            "ORDER BY a.last_accessed LIMIT ?",
+            (accessed_before, limit),
+        ).fetchall()
+
+    def least_recently_used(self, limit: int = 500) -> List[Tuple[str, int]]:
+        """Unprotected assets, least recently accessed first"""
+        return self._conn().execute(
+            f"SELECT name, size FROM assets a WHERE {_UNPROTECTED} ORDER BY a.last_accessed LIMIT ?", (limit,)
+        ).fetchall()
+
+    def usage(self, top_owners: int = 20) -> Dict:
+        conn = self._conn()
+
+        def totals(where: str = "1"):
+            files, size = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets a WHERE {where}").fetchone()
+            return {"files": files, "size_mb": round(size / 1024 / 1024, 1)}
+
+        owners = conn.execute(
+            "SELECT COALESCE(owner, ''), COUNT(*), SUM(size) FROM assets GROUP BY owner ORDER BY SUM(size) DESC LIMIT ?",
+            (top_owners,),
+        ).fetchall()
+        oldest, newest = conn.execute("SELECT MIN(last_accessed), MAX(created_at) FROM assets").fetchone()
+        return {
+            **totals(),
+            "images": totals("parent IS NULL"),
+            "renditions": totals("parent IS NOT NULL"),
+            "posted": totals("posted = 1"),
+            "scheduled": totals("scheduled = 1"),
+            "protected": totals(f"NOT ({_UNPROTECTED})"),
+            "owners": [
+                {"owner": owner or None, "files": files, "size_mb": round(size / 1024 / 1024, 1)}
+                for owner, files, size in owners
+            ],
+            "oldest_access": oldest,
+            "newest_created": newest,
+        }
+
+
+asset_index = AssetIndex()
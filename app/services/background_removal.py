@@ -0,0 +1,193 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from PIL import Image
+
+# Background removal configuration
+BG_REMOVAL_ENGINE = os.getenv("BG_REMOVAL_ENGINE", "rembg").lower()  # "rembg" or "none"
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_PROVIDERS = [p.strip() for p in os.getenv("REMBG_PROVIDERS", "").split(",") if p.strip()]  # empty = onnxruntime default
+REMBG_THREADS = int(os.getenv("REMBG_THREADS", "0"))  # 0 = onnxruntime default
+BG_MASK_CACHE_SIZE = int(os.getenv("BG_MASK_CACHE_SIZE", "64"))
+# First rembg release whose session classes take (model_name, sess_opts, providers=...)
+REMBG_MIN_VERSION_FOR_THREADS = (2, 0, 50)
+
+
+def _rembg_version() -> tuple:
+    from importlib.metadata import version
+
+    try:
+        return tuple(int(part) for part in version("rembg").split(".")[:3])
+    except ValueError:
+        # Pre-release or local version strings; assume a current release
+        return REMBG_MIN_VERSION_FOR_THREADS
+
+
+class RemovalEngine:
+    """Produces a foreground mask ("L", same size as the input) for an image"""
+
+    name = "none"
+
+    def load(self):
+        """Create expensive state up front; raise if the engine can't run here"""
+
+    def mask(self, image: Image.Image) -> Image.Image:
+        raise NotImplementedError
+
+
+class RembgEngine(RemovalEngine):
+    """rembg with one ONNX session kept for the life of the process"""
+
+    name = "rembg"
+
+    def __init__(self, model: str = REMBG_MODEL, providers=None, threads: int = REMBG_THREADS):
+        self.model = model
+        self.providers = providers if providers is not None else REMBG_PROVIDERS
+        self.threads = threads
+        self._session = None
+        self._remove = None
+
+    def load(self):
+        if self._session is not None:
+            return
+
+        from rembg import new_session, remove
+
+        threads = self.threads
+        if threads and _rembg_version() < REMBG_MIN_VERSION_FOR_THREADS:
+            print(f"⚠️ REMBG_THREADS needs rembg >= {'.'.join(map(str, REMBG_MIN_VERSION_FOR_THREADS))}; using onnxruntime's default threads")
+            threads = 0
+        if threads:
+            self._session = self._threaded_session()
+        else:
+            kwargs = {"providers": self.providers} if self.providers else {}
+            self._session = new_session(self.model, **kwargs)
+        self._remove = remove
+
+    def _threaded_session(self):
+        """new_session() with our own thread counts
+
+        new_session() only reads them from OMP_NUM_THREADS, which would also
+        change torch's threading, so build the session class it would pick.
+        Relies on the session constructor of rembg >= 2.0.50 (checked in load).
+        """
+        import onnxruntime as ort
+        from rembg.sessions import sessions_class
+        from rembg.sessions.u2net import U2netSession
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = self.threads
+        session_class = next((sc for sc in sessions_class if sc.name() == self.model), U2netSession)
+        return session_class(self.model, options, providers=self.providers or None)
+
+    def mask(self, image: Image.Image) -> Image.Image:
+        self.load()
+        return self._remove(image.convert("RGB"), session=self._session, only_mask=True).convert("L")
+
+
+ENGINES = {"rembg": RembgEngine, "none": RemovalEngine}
+
+
+class BackgroundRemover:
+    """Background removal with a persistent engine and a mask cache
+
+    Masks are computed on the already-downscaled product image and cached
+    by the hash of the uploaded bytes plus the working size, so re-running
+    the same upload skips inference. If the engine is unavailable or fails,
+    remove() returns None and callers keep the opaque product image.
+    """
+
+    def __init__(self, engine: Optional[RemovalEngine] = None, cache_size: int = BG_MASK_CACHE_SIZE):
+        self.engine = engine or ENGINES.get(BG_REMOVAL_ENGINE, RemovalEngine)()
+        self.cache_size = cache_size
+        self._masks: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._load_error: Optional[str] = None
+        self._loaded = False
+        self.load_seconds: Optional[float] = None
+        self.counters = {"hits": 0, "misses": 0, "failures": 0, "fallbacks": 0}
+        self.inference_seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.engine.name != "none" and self._load_error is None
+
+    def warm_up(self) -> bool:
+        """Create the engine's session now instead of on the first request"""
+        if self.engine.name == "none":
+            return False
+        with self._load_lock:
+            if self._loaded or self._load_error:
+                return self._loaded
+            start = time.perf_counter()
+            try:
+                self.engine.load()
+                self._loaded = True
+                self.load_seconds = time.perf_counter() - start
+                print(f"✅ Background removal ready ({self.engine.name}) in {self.load_seconds:.1f}s")
+            except Exception as e:
+                # Don't retry a missing dependency on every request
+                self._load_error = str(e)
+                print(f"⚠️ Background removal unavailable, using fallback: {e}")
+            return self._loaded
+
+    def remove(self, image: Image.Image, source_hash: Optional[str] = None) -> Optional[Image.Image]:
+        """RGBA copy of image with the background made transparent, or None on fallback"""
+        if not self.warm_up():
+            with self._lock:
+                self.counters["fallbacks"] += 1
+            return None
+
+        key = f"{source_hash or hashlib.sha256(image.tobytes()).hexdigest()}:{image.width}x{image.height}"
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                self.counters["hits"] += 1
+
+        if mask is None:
+            start = time.perf_counter()
+            try:
+                mask = self.engine.mask(image)
+            except Exception as e:
+                print(f"⚠️ Background removal failed, using fallback: {e}")
+                with self._lock:
+                    self.counters["failures"] += 1
+                    self.counters["fallbacks"] += 1
+                return None
+            if mask.size != image.size:
+                mask = mask.resize(image.size, Image.LANCZOS)
+            with self._lock:
+                self.inference_seconds += time.perf_counter() - start
+                self.counters["misses"] += 1
+                self._masks[key] = mask
+                while len(self._masks) > self.cache_size:
+                    self._masks.popitem(last=False)
+
+        fg = image.convert("RGBA")
+        fg.putalpha(mask)
+        return fg
+
+    def stats(self) -> Dict:
+        with self._lock:
+            misses = self.counters["misses"]
+            lookups = self.counters["hits"] + misses
+            return {
+                "engine": self.engine.name,
+                "available": self.available,
+                "error": self._load_error,
+                "load_seconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+                "avg_inference_ms": round(self.inference_seconds / misses * 1000, 1) if misses else None,
+                "cached_masks": len(self._masks),
+            }
+
+
+background_remover = BackgroundRemover()
@@ -0,0 +1,94 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+# Rendered backgrounds are cached per (preset, size, palette)
+BACKGROUND_CACHE_SIZE = int(os.getenv("BACKGROUND_CACHE_SIZE", "32"))
+
+# Default colours for each preset
+PRESETS = {
+    # soft vertical gradient with a white vignette (the original fallback look)
+    "studio": ("#ffffff", "#e9eef2", "#ffffff"),
+    # bright centre falling off to a cooler edge
+    "spotlight": ("#ffffff", "#cfd6de"),
+    # diagonal blend between two brand colours
+    "duotone": ("#1f3b73", "#f2a65a"),
+}
+
+Size = Tuple[int, int]
+
+
+def _radial(size: Size, reach: float = 1.0, blur: float = 0) -> Image.Image:
+    """Radial distance mask: 0 at the centre, 255 at `reach` x the half-width (clipped)
+
+    Built by cropping and resizing PIL's 256x256 radial gradient, so the work
+    is a single resample instead of a per-pixel loop.
+    """
+    src = Image.radial_gradient("L")  # 0 at centre, 255 at distance 128
+    if blur:
+        src = src.filter(ImageFilter.GaussianBlur(radius=blur))
+    half = 128 / reach
+    box = (128 - half, 128 - half, 128 + half, 128 + half)
+    return src.resize(size, Image.BILINEAR, box=box)
+
+
+def _vertical(size: Size) -> Image.Image:
+    """Vertical mask: 0 at the top row, 255 at the bottom"""
+    return Image.linear_gradient("L").resize(size, Image.BILINEAR)
+
+
+def _studio(size: Size, palette) -> Image.Image:
+    top, bottom, edge = palette
+    w, h = size
+    # mask 0 -> bottom colour, 255 -> top colour, as in the old composite
+    grad = ImageOps.colorize(_vertical(size), black=bottom, white=top)
+    # vignette: 255 * max(0, 1 - 0.8 * d), d = 1 at the edge midpoints
+    blur = 20 * 256 / max(w, h) / 1.25
+    vign = ImageOps.invert(_radial(size, reach=1.25, blur=blur))
+    return Image.composite(grad, Image.new("RGB", size, edge), vign)
+
+
+def _spotlight(size: Size, palette) -> Image.Image:
+    center, edge = palette
+    return ImageOps.colorize(_radial(size, reach=1.2), black=center, white=edge)
+
+
+def _duotone(size: Size, palette) -> Image.Image:
+    start, end = palette
+    vertical = _vertical(size)
+    horizontal = Image.linear_gradient("L").rotate(90).resize(size, Image.BILINEAR)
+    diagonal = ImageChops.add(vertical, horizontal, scale=2)
+    return ImageOps.colorize(diagonal, black=start, white=end)
+
+
+_RENDERERS = {
+    "studio": _studio,
+    "spotlight": _spotlight,
+    "duotone": _duotone,
+}
+
+
+@lru_cache(maxsize=BACKGROUND_CACHE_SIZE)
+def _render(preset: str, size: Size, palette: tuple) -> Image.Image:
+    return _RENDERERS[preset](size, palette)
+
+
+def make_background(size: Size, preset: str = "studio", palette: Optional[tuple] = None) -> Image.Image:
+    """Render a background preset as an RGB image
+
+    `palette` overrides the preset's colours (same number of entries as in
+    PRESETS). Results are cached, so a copy is returned for callers to edit.
+    """
+    if preset not in _RENDERERS:
+        raise ValueError(f"Unknown background preset: {preset}")
+    palette = tuple(palette) if palette else PRESETS[preset]
+    if len(palette) != len(PRESETS[preset]):
+        raise ValueError(f"Preset '{preset}' takes {len(PRESETS[preset])} colours")
+    return _render(preset, (int(size[0]), int(size[1])), palette).copy()
+
+
+def cache_info():
+    """lru_cache statistics for the rendered backgrounds"""
+    return _render.cache_info()._asdict()
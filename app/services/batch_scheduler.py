@@ -0,0 +1,247 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services.pipeline_registry import SD_MODEL_ID, get_pipeline
+from app.services.prompt_embeddings import prompt_embedding_cache
+from app.services.cpu_profile import cpu_inference_context
+
+# Micro-batching configuration
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "50"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))
+
+# Requests can only share a pipeline call when these match:
+# model id, kind, scheduler, height, width, steps, guidance, img2img strength
+BatchKey = Tuple[str, str, Optional[str], int, int, int, float, Optional[float]]
+
+
+class _Request:
+    def __init__(self, prompt: str, seed: Optional[int], progress: Optional[Callable], image=None):
+        self.prompt = prompt
+        self.seed = seed
+        self.progress = progress
+        self.image = image  # init image for img2img
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+        self.error: Optional[BaseException] = None
+
+
+class _BatchAbandoned(Exception):
+    """Every request in a running batch has failed or been cancelled"""
+
+
+class BatchScheduler:
+    """Collects diffusion requests for a short window and runs them as one batch
+
+    Requests with the same model, kind, scheduler, resolution, step count,
+    guidance scale and img2img strength
+    that arrive within `window_ms` of the first one are sent to the pipeline
+    together (up to `max_batch` prompts). Each caller gets back its own image.
+    Batches run one at a time on a single dispatcher thread.
+    """
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX_SIZE):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._pending: Dict[BatchKey, List[_Request]] = {}
+        self._deadlines: Dict[BatchKey, float] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        # metrics
+        self.batches = 0
+        self.requests = 0
+        self.failed_batches = 0
+        self.shared_encodes = 0  # text-encoder passes skipped for repeated prompts
+        self._recent = deque(maxlen=100)  # (size, latency_s, queue_wait_s)
+
+    def submit(self, prompt: str, height: int = 512, width: int = 512,
+               num_inference_steps: int = 50, guidance_scale: float = 7.5,
+               model_id: str = SD_MODEL_ID, seed: Optional[int] = None,
+               progress: Optional[Callable] = None, scheduler: Optional[str] = None,
+               image=None, strength: float = 0.75) -> Future:
+        """Queue a prompt; the future resolves to a PIL image
+
+        A seed makes the image reproducible regardless of which batch it
+        lands in (each prompt gets its own generator). Passing an init image
+        runs img2img at that image's size instead of txt2img.
+        """
+        if image is not None:
+            width, height = image.size
+            key = (model_id, "img2img", scheduler, height, width, num_inference_steps,
+                   float(guidance_scale), float(strength))
+        else:
+            key = (model_id, "txt2img", scheduler, height, width, num_inference_steps,
+                   float(guidance_scale), None)
+        request = _Request(prompt, seed, progress, image)
+        with self._cond:
+            self._ensure_started()
+            if key not in self._pending:
+                self._pending[key] = []
+                self._deadlines[key] = request.submitted_at + self.window
+            self._pending[key].append(request)
+            self._cond.notify()
+        return request.future
+
+    def generate(self, prompt: str, **kwargs):
+        """Blocking helper: submit and wait for the image"""
+        return self.submit(prompt, **kwargs).result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch_loop, name="sd-batcher", daemon=True)
+            self._thread.start()
+
+    def _dispatch_loop(self):
+        while True:
+            key, batch = self._next_batch()
+            self._execute(key, batch)
+
+    def _next_batch(self):
+        """Block until some bucket is full or its window has elapsed"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [
+                    k for k, reqs in self._pending.items()
+                    if len(reqs) >= self.max_batch or self._deadlines[k] <= now
+                ]
+                if ready:
+                    key = min(ready, key=self._deadlines.get)
+                    batch = self._pending[key][:self.max_batch]
+                    rest = self._pending[key][self.max_batch:]
+                    if rest:
+                        self._pending[key] = rest
+                        self._deadlines[key] = rest[0].submitted_at + self.window
+                    else:
+                        del self._pending[key]
+                        del self._deadlines[key]
+                    return key, batch
+
+                timeout = min(self._deadlines.values()) - now if self._deadlines else None
+                self._cond.wait(timeout)
+
+    def _execute(self, key: BatchKey, batch: List[_Request]):
+        model_id, kind, scheduler, height, width, steps, guidance, strength = key
+        started = time.monotonic()
+        # img2img only runs the last `strength` fraction of the schedule
+        total_steps = int(steps * strength) if strength is not None else steps
+
+        def on_step(pipe, step, timestep, callback_kwargs):
+            # A failing/cancelled caller must not abort the rest of the batch
+            for request in batch:
+                if request.progress and request.error is None:
+                    try:
+                        request.progress(step + 1, total_steps)
+                    except BaseException as e:
+                        request.error = e
+            # ...but once nobody is left, stop instead of holding the dispatcher
+            if all(request.error is not None for request in batch):
+                raise _BatchAbandoned()
+            return callback_kwargs
+
+        try:
+            pipe = get_pipeline(model_id, kind=kind, scheduler=scheduler)
+            if kind == "img2img":
+                inputs = {"image": [r.image for r in batch], "strength": strength}
+            else:
+                inputs = {"height": height, "width": width}
+            with cpu_inference_context(pipe):
+                out = pipe(
+                    **self._prompt_inputs(pipe, model_id, [r.prompt for r in batch], guidance),
+                    **inputs,
+                    num_inference_steps=steps,
+                    guidance_scale=guidance,
+                    generator=self._generators(pipe, batch),
+                    callback_on_step_end=on_step,
+                )
+            for request, image in zip(batch, out.images):
+                if request.error is not None:
+                    request.future.set_exception(request.error)
+                else:
+                    request.future.set_result(image)
+            print(f"🧮 SD {kind} batch of {len(batch)} ({width}x{height}, {steps} steps, "
+                  f"{scheduler or 'default'} scheduler) "
+                  f"in {time.monotonic() - started:.2f}s")
+        except _BatchAbandoned:
+            print(f"🛑 SD {kind} batch of {len(batch)} stopped: every request failed or was cancelled")
+            for request in batch:
+                request.future.set_exception(request.error)
+        except BaseException as e:
+            self.failed_batches += 1
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(request.error or e)
+        finally:
+            latency = time.monotonic() - started
+            wait = started - min(r.submitted_at for r in batch)
+            self.batches += 1
+            self.requests += len(batch)
+            self._recent.append((len(batch), latency, wait))
+
+    def _prompt_inputs(self, pipe, model_id: str, prompts: List[str], guidance: float) -> Dict:
+        """Prompt embeddings for the pipeline, from the embedding cache
+
+        Each distinct prompt is looked up once per batch, so rows repeating a
+        prompt (one text rendered with several seeds) share an encoding, and
+        templated prompts seen before skip the text encoder altogether.
+        """
+        if not hasattr(pipe, "encode_prompt"):
+            return {"prompt": prompts}
+
+        import torch
+
+        do_cfg = guidance > 1.0
+        encoded = {p: prompt_embedding_cache.get(pipe, model_id, p, do_cfg) for p in dict.fromkeys(prompts)}
+        self.shared_encodes += len(prompts) - len(encoded)
+        return {
+            "prompt_embeds": torch.cat([encoded[p][0] for p in prompts]),
+            "negative_prompt_embeds": torch.cat([encoded[p][1] for p in prompts]) if do_cfg else None,
+        }
+
+    @staticmethod
+    def _generators(pipe, batch: List[_Request]):
+        """One seeded generator per prompt, or None when nobody asked for a seed"""
+        if all(r.seed is None for r in batch):
+            return None
+
+        import torch
+
+        generators = []
+        for request in batch:
+            generator = torch.Generator(device=pipe.device)
+            if request.seed is None:
+                generator.seed()
+            else:
+                generator.manual_seed(request.seed)
+            generators.append(generator)
+        return generators
+
+    def stats(self) -> Dict:
+        recent = list(self._recent)
+        n = len(recent) or 1
+        with self._cond:
+            pending = sum(len(r) for r in self._pending.values())
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "requests": self.requests,
+            "failed_batches": self.failed_batches,
+            "shared_encodes": self.shared_encodes,
+            "pending": pending,
+            "avg_batch_size": round(sum(r[0] for r in recent) / n, 2),
+            "avg_occupancy": round(sum(r[0] for r in recent) / n / self.max_batch, 3),
+            "avg_batch_latency_s": round(sum(r[1] for r in recent) / n, 3),
+            "avg_queue_wait_s": round(sum(r[2] for r in recent) / n, 3),
+            "last_batches": [
+                {"size": size, "latency_s": round(lat, 3), "queue_wait_s": round(wait, 3)}
+                for size, lat, wait in recent[-10:]
+            ],
+        }
+
+
+batch_scheduler = BatchScheduler()
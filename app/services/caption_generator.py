@@ -1,17 +1,9 @@
-import requests
-import json
-from typing import Optional
+from app.services.llm_client import llm_client
 
 
-def generate_instagram_caption(ad_text: str, product_name: str, description: str) -> str:
-    """
-    Generate an Instagram-optimized caption using DeepSeek
-    Includes hashtags, emojis, and call-to-action
-    """
-    try:
-        payload = {
-            "model": "deepseek-r1:7b",
-            "prompt": f"""Create an engaging Instagram caption for this product ad.
+def build_caption_prompt(ad_text: str, product_name: str, description: str) -> str:
+    """Prompt asking DeepSeek for an Instagram caption"""
+    return f"""Create an engaging Instagram caption for this product ad.
 
 Product: {product_name}
 Description: {description}
@@ -32,39 +24,34 @@ Format:
 [Call-to-action]
 #hashtag1 #hashtag2 #hashtag3...
 
-Return ONLY the caption text, no explanations.""",
-            "stream": False
-        }
+Return ONLY the caption text, no explanations."""
+
+
+def finalize_caption(caption: str, ad_text: str, product_name: str) -> str:
+    """Fallback: if AI generation fails, create a simple caption"""
+    caption = (caption or ad_text).strip()
+    if not caption or len(caption) < 10:
+        caption = f"{ad_text}\n\n✨ {product_name}\n\n#marketing #advertising #product"
+    return caption
 
-        res = requests.post("http://127.0.0.1:11434/api/generate", json=payload)
-        res.raise_for_status()
 
-        text = res.text.strip()
-        if text.count('\n') > 0:
-            # Get the last line which usually contains the response
-            lines = text.split('\n')
-            for line in reversed(lines):
-                try:
-                    result = json.loads(line)
-                    if "response" in result:
-                        return result["response"].strip()
-                except:
-                    continue
-            # Fallback: use the last line
-            text = lines[-1]
+def fallback_caption(ad_text: str, product_name: str) -> str:
+    """Caption used when the LLM is unreachable"""
+    hashtags = " ".join([f"#{tag}" for tag in product_name.lower().replace(" ", "").split()[:5]])
+    return f"{ad_text}\n\n✨ {product_name}\n\n{hashtags} #marketing #advertising"
 
-        result = json.loads(text)
-        caption = result.get("response", ad_text).strip()
-        
-        # Fallback: if AI generation fails, create a simple caption
-        if not caption or len(caption) < 10:
-            caption = f"{ad_text}\n\n✨ {product_name}\n\n#marketing #advertising #product"
-        
-        return caption
+
+async def generate_instagram_caption(ad_text: str, product_name: str, description: str,
+                                     use_cache: bool = True) -> str:
+    """
+    Generate an Instagram-optimized caption using DeepSeek
+    Includes hashtags, emojis, and call-to-action
+    """
+    try:
+        prompt = build_caption_prompt(ad_text, product_name, description)
+        caption = await llm_client.generate(prompt, use_cache=use_cache)
+        return finalize_caption(caption, ad_text, product_name)
 
     except Exception as e:
         print(f"❌ Error generating Instagram caption: {e}")
-        # Fallback caption
-        hashtags = " ".join([f"#{tag}" for tag in product_name.lower().replace(" ", "").split()[:5]])
-        return f"{ad_text}\n\n✨ {product_name}\n\n{hashtags} #marketing #advertising"
-
+        return fallback_caption(ad_text, product_name)
@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.services import instagram_storage
+from app.services.instagram_service import InstagramService
+
+# Connection cache configuration
+CONNECTION_CACHE_SIZE = int(os.getenv("CONNECTION_CACHE_SIZE", "1024"))
+# Upper bound on staleness when another worker changes a connection
+CONNECTION_CACHE_TTL = float(os.getenv("CONNECTION_CACHE_TTL", "300"))
+
+
+class _Entry:
+    __slots__ = ("connection", "access_token", "expires_at")
+
+    def __init__(self, connection: Optional[Dict], expires_at: float):
+        self.connection = connection
+        self.access_token: Optional[str] = None  # decrypted lazily, memory only
+        self.expires_at = expires_at
+
+
+class ConnectionCache:
+    """Read-through cache of Instagram connections and decrypted tokens
+
+    Entries live for CONNECTION_CACHE_TTL seconds or until the token expires
+    (connected_at + expires_in), whichever comes first. Missing connections
+    are cached too, so status checks for disconnected users skip storage as
+    well. Writes through this cache invalidate the user's entry; decrypted
+    tokens are never written anywhere.
+    """
+
+    def __init__(self, max_entries: int = CONNECTION_CACHE_SIZE, ttl: float = CONNECTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "decrypts": 0}
+
+    def _expiry(self, connection: Optional[Dict], now: float) -> float:
+        expires_at = now + self.ttl
+        if connection and connection.get("connected_at") and connection.get("expires_in"):
+            expires_at = min(expires_at, connection["connected_at"] + connection["expires_in"])
+        return expires_at
+
+    def _entry(self, user_id: str) -> _Entry:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry.expires_at > now:
+                self._entries.move_to_end(user_id)
+                self.counters["hits"] += 1
+                return entry
+            self.counters["misses"] += 1
+
+        connection = instagram_storage.get_user_connection(user_id)
+        entry = _Entry(connection, self._expiry(connection, now))
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_connection(self, user_id: str) -> Optional[Dict]:
+        connection = self._entry(user_id).connection
+        return dict(connection) if connection else None
+
+    def get_access_token(self, user_id: str) -> Optional[str]:
+        """Decrypted access token, decrypting at most once per cache entry"""
+        entry = self._entry(user_id)
+        if not entry.connection or not entry.connection.get("encrypted_token"):
+            return None
+        if entry.access_token is None:
+            entry.access_token = InstagramService.decrypt_token(entry.connection["encrypted_token"])
+            with self._lock:
+                self.counters["decrypts"] += 1
+        return entry.access_token
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.counters["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+            }
+
+
+connection_cache = ConnectionCache()
+
+
+def get_user_connection(user_id: str) -> Optional[Dict]:
+    """Cached Instagram connection for a user"""
+    return connection_cache.get_connection(user_id)
+
+
+def get_access_token(user_id: str) -> Optional[str]:
+    """Cached, decrypted access token for a user"""
+    return connection_cache.get_access_token(user_id)
+
+
+def save_user_connection(user_id: str, connection_data: Dict):
+    """Save a connection and drop the stale cache entry"""
+    instagram_storage.save_user_connection(user_id, connection_data)
+    connection_cache.invalidate(user_id)
+
+
+def delete_user_connection(user_id: str):
+    """Delete a connection and drop the cache entry"""
+    instagram_storage.delete_user_connection(user_id)
+    connection_cache.invalidate(user_id)
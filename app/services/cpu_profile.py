@@ -0,0 +1,107 @@
+import os
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+from app.services.quality import QUALITY_TIERS
+
+# CPU inference profile (applied to pipelines loaded on device "cpu")
+SD_CPU_CHANNELS_LAST = os.getenv("SD_CPU_CHANNELS_LAST", "true").lower() in ("1", "true", "yes")
+SD_CPU_BF16 = os.getenv("SD_CPU_BF16", "false").lower() in ("1", "true", "yes")  # bfloat16 autocast
+SD_CPU_COMPILE = os.getenv("SD_CPU_COMPILE", "false").lower() in ("1", "true", "yes")  # torch.compile the UNet
+SD_CPU_THREADS = int(os.getenv("SD_CPU_THREADS", "0"))  # 0 = cores / worker processes
+SD_CPU_INTEROP_THREADS = int(os.getenv("SD_CPU_INTEROP_THREADS", "1"))
+# Memory savers trade speed for RAM, so only enable them when RAM is short
+SD_CPU_SLICING_BELOW_GB = float(os.getenv("SD_CPU_SLICING_BELOW_GB", "12"))
+SD_CPU_VAE_TILING_BELOW_GB = float(os.getenv("SD_CPU_VAE_TILING_BELOW_GB", "6"))
+
+# uvicorn/gunicorn worker processes sharing this machine's cores
+WORKER_PROCESSES = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+_threads_configured = False
+
+
+def available_ram_gb() -> Optional[float]:
+    """Currently available physical memory, None where sysconf can't tell"""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def intra_op_threads() -> int:
+    """SD_CPU_THREADS, or this process's share of the cores"""
+    if SD_CPU_THREADS:
+        return SD_CPU_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, WORKER_PROCESSES))
+
+
+def configure_threads():
+    """Set torch's thread pools once per process, before the first CPU pipeline runs"""
+    global _threads_configured
+    if _threads_configured:
+        return
+
+    import torch
+
+    torch.set_num_threads(intra_op_threads())
+    try:
+        torch.set_num_interop_threads(SD_CPU_INTEROP_THREADS)
+    except RuntimeError:
+        pass  # can only be set before any inter-op work has started
+    _threads_configured = True
+
+
+def apply_cpu_profile(pipe) -> Dict:
+    """Tune a freshly loaded CPU pipeline in place; returns what was applied"""
+    import torch
+
+    configure_threads()
+    ram_gb = available_ram_gb()
+    applied = {
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "available_ram_gb": round(ram_gb, 1) if ram_gb is not None else None,
+        "channels_last": SD_CPU_CHANNELS_LAST,
+        "bf16_autocast": SD_CPU_BF16,
+        "attention_slicing": ram_gb is not None and ram_gb < SD_CPU_SLICING_BELOW_GB,
+        "vae_tiling": ram_gb is not None and ram_gb < SD_CPU_VAE_TILING_BELOW_GB,
+        "compiled": False,
+    }
+
+    if SD_CPU_CHANNELS_LAST:
+        # oneDNN convolutions are fastest on NHWC tensors
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    if applied["attention_slicing"]:
+        pipe.enable_attention_slicing()
+    if applied["vae_tiling"] and hasattr(pipe, "enable_vae_tiling"):
+        pipe.enable_vae_tiling()
+
+    if SD_CPU_COMPILE:
+        eager_unet = pipe.unet
+        try:
+            # Product backgrounds follow each upload's aspect ratio, so compile
+            # with dynamic shapes rather than recompiling for every new size
+            pipe.unet = torch.compile(eager_unet, dynamic=True)
+            # Compilation happens on the first call; pay for it now, not on a request,
+            # at every tier's output size (plus a non-square canvas)
+            warmup_sizes = sorted({(t["size"], t["size"]) for t in QUALITY_TIERS.values()})
+            warmup_sizes.append((warmup_sizes[0][0], warmup_sizes[-1][1]))
+            with cpu_inference_context(pipe):
+                for height, width in warmup_sizes:
+                    pipe("warm-up", num_inference_steps=1, height=height, width=width, output_type="latent")
+            applied["compiled"] = True
+            applied["compile_warmup_sizes"] = warmup_sizes
+        except Exception as e:
+            pipe.unet = eager_unet
+            print(f"⚠️ torch.compile failed, running eager: {e}")
+    return applied
+
+
+def cpu_inference_context(pipe):
+    """bfloat16 autocast for CPU pipelines when enabled, otherwise a no-op"""
+    if SD_CPU_BF16 and str(getattr(pipe, "device", "")) == "cpu":
+        import torch
+
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Graph API HTTP configuration
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "30"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "20"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+GRAPH_RETRY_BASE_DELAY = float(os.getenv("GRAPH_RETRY_BASE_DELAY", "0.5"))
+GRAPH_RETRY_MAX_DELAY = float(os.getenv("GRAPH_RETRY_MAX_DELAY", "8"))
+# Token buckets: sustained calls per second and burst size
+GRAPH_APP_RATE = float(os.getenv("GRAPH_APP_RATE", "20"))
+GRAPH_APP_BURST = float(os.getenv("GRAPH_APP_BURST", "40"))
+GRAPH_ACCOUNT_RATE = float(os.getenv("GRAPH_ACCOUNT_RATE", "2"))
+GRAPH_ACCOUNT_BURST = float(os.getenv("GRAPH_ACCOUNT_BURST", "5"))
+# Usage (percent of quota) above which buckets start slowing down
+GRAPH_USAGE_THROTTLE_AT = float(os.getenv("GRAPH_USAGE_THROTTLE_AT", "50"))
+# Longest a call sleeps for a token; past this it fails as rate limited instead of
+# holding a threadpool thread (account pauses can last many minutes)
+GRAPH_MAX_THROTTLE_WAIT = float(os.getenv("GRAPH_MAX_THROTTLE_WAIT", "10"))
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Graph error codes for throttling and temporary failures
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80001, 80002, 80004, 80005, 80006, 80008, 80014}
+TRANSIENT_CODES = {1, 2} | RATE_LIMIT_CODES
+
+
+class GraphAPIError(requests.HTTPError):
+    """Graph API call failed; carries the Graph error code and message"""
+
+    def __init__(self, message: str, response: Optional[requests.Response] = None,
+                 code: Optional[int] = None, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, response=response)
+        self.code = code
+        self.status = status
+        self.retry_after = retry_after  # seconds, when we know when quota comes back
+
+    @property
+    def rate_limited(self) -> bool:
+        return self.status == 429 or self.code in RATE_LIMIT_CODES
+
+
+def request_not_sent(error: Exception) -> bool:
+    """Did the call fail before the request reached the server?"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and not isinstance(error, requests.Timeout):
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)  # refused / DNS, not a reset mid-response
+    return False
+
+
+def is_transient(error: Exception) -> bool:
+    """Worth retrying later: throttling, 5xx, temporary Graph errors, network trouble"""
+    if isinstance(error, GraphAPIError):
+        return error.rate_limited or error.status in RETRYABLE_STATUS or error.code in TRANSIENT_CODES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def outcome_unknown(error: Exception) -> bool:
+    """A non-idempotent call failed without telling us whether it took effect"""
+    if isinstance(error, GraphAPIError) and error.rate_limited:
+        return False  # rejected before doing anything
+    return is_transient(error) and not request_not_sent(error)
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate can be scaled down at runtime"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.factor = 1.0  # fraction of `rate` currently allowed
+        self.usage = 0.0  # last reported usage, percent
+        self.paused_until = 0.0
+        self.penalized = False  # slowed by a rate-limit error rather than by usage headers
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns seconds waited
+
+        Raises a rate-limited GraphAPIError (with retry_after) instead of
+        sleeping longer than GRAPH_MAX_THROTTLE_WAIT.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self.rate * self.factor
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self._tokens) / rate
+            if waited + wait > GRAPH_MAX_THROTTLE_WAIT:
+                raise GraphAPIError(f"Graph API rate limit reached, retry in {wait:.0f}s",
+                                    status=429, retry_after=wait)
+            time.sleep(wait)
+            waited += wait
+
+    def adapt(self, usage: float, pause_seconds: float = 0.0):
+        """Scale the rate to the reported quota usage
+
+        Below GRAPH_USAGE_THROTTLE_AT percent the full rate applies; above it
+        the rate falls linearly to 5% at 100% usage. pause_seconds stops the
+        bucket entirely (the API told us when access comes back).
+        """
+        with self._lock:
+            self.usage = usage
+            self.penalized = False
+            if usage <= GRAPH_USAGE_THROTTLE_AT:
+                self.factor = 1.0
+            else:
+                span = 100 - GRAPH_USAGE_THROTTLE_AT
+                self.factor = max(0.05, (100 - usage) / span)
+            if pause_seconds > 0:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause_seconds)
+                self._tokens = 0
+
+    def penalize(self):
+        """A call hit a rate limit: slow to the floor until headers or a success say otherwise"""
+        self.adapt(100)
+        with self._lock:
+            self.penalized = True
+
+    def recover(self):
+        """A call succeeded without usage headers: undo a rate-limit penalty"""
+        with self._lock:
+            if self.penalized:
+                self.penalized = False
+                self.usage = 0.0
+                self.factor = 1.0
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "usage_pct": self.usage,
+                "rate": round(self.rate * self.factor, 3),
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 1),
+                "penalized": self.penalized,
+            }
+
+
+def _usage_pct(entry: Dict) -> float:
+    return float(max(entry.get("call_count", 0), entry.get("total_time", 0), entry.get("total_cputime", 0)))
+
+
+def _parse_json_header(response: requests.Response, name: str):
+    raw = response.headers.get(name)
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+class GraphClient:
+    """Shared HTTP layer for Graph API calls
+
+    One pooled requests.Session with timeouts. Every call takes a token from
+    the app-wide bucket and, when it targets an Instagram account, from that
+    account's bucket. X-App-Usage and X-Business-Use-Case-Usage headers on
+    each response scale those buckets down as quota fills up. Transport
+    errors, 5xx/429 and transient Graph error codes are retried with capped,
+    jittered exponential backoff.
+    """
+
+    def __init__(self, max_retries: int = GRAPH_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=GRAPH_POOL_SIZE, pool_maxsize=GRAPH_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.app_bucket = TokenBucket(GRAPH_APP_RATE, GRAPH_APP_BURST)
+        self._accounts: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.error_codes = Counter()
+        self.throttle_wait_seconds = 0.0
+
+    def _account_bucket(self, account: str) -> TokenBucket:
+        with self._lock:
+            if account not in self._accounts:
+                self._accounts[account] = TokenBucket(GRAPH_ACCOUNT_RATE, GRAPH_ACCOUNT_BURST)
+            return self._accounts[account]
+
+    def _throttle(self, account: Optional[str]):
+        waited = self.app_bucket.acquire()
+        if account:
+            waited += self._account_bucket(account).acquire()
+        if waited:
+            with self._lock:
+                self.counters["throttle_waits"] += 1
+                self.throttle_wait_seconds += waited
+
+    def _observe(self, response: requests.Response, account: Optional[str]):
+        """Feed rate-limit headers back into the buckets
+
+        Many endpoints send no usage headers, so a successful call without
+        them lifts a penalty left by an earlier rate-limit error instead.
+        """
+        app_usage = _parse_json_header(response, "X-App-Usage")
+        if isinstance(app_usage, dict):
+            self.app_bucket.adapt(_usage_pct(app_usage))
+        elif response.ok:
+            self.app_bucket.recover()
+
+        buc_usage = _parse_json_header(response, "X-Business-Use-Case-Usage")
+        if account and isinstance(buc_usage, dict):
+            entries = [e for values in buc_usage.values() if isinstance(values, list) for e in values]
+            if entries:
+                usage = max(_usage_pct(e) for e in entries)
+                # estimated_time_to_regain_access is in minutes
+                regain = max(float(e.get("estimated_time_to_regain_access") or 0) for e in entries) * 60
+                self._account_bucket(account).adapt(usage, regain)
+                return
+        if account and response.ok:
+            self._account_bucket(account).recover()
+
+    @staticmethod
+    def _error(response: requests.Response) -> GraphAPIError:
+        code, message = None, f"Graph API returned {response.status_code}"
+        try:
+            error = response.json().get("error", {})
+            code = error.get("code")
+            message = error.get("message") or message
+        except ValueError:
+            pass
+        return GraphAPIError(message, response=response, code=code, status=response.status_code)
+
+    def request(self, method: str, url: str, account: Optional[str] = None,
+                retry: bool = True, idempotent: Optional[bool] = None, **kwargs) -> Dict:
+        """Make a throttled, retried Graph API call and return the JSON body
+
+        account is the Instagram user id the call acts on (per-account
+        throttling); retry=False for calls that must not be repeated, such
+        as exchanging a one-time OAuth code. Non-idempotent calls (POSTs by
+        default: container creation, media_publish) are only retried when
+        Graph rejected them for rate limiting or the request was never sent;
+        read timeouts and 5xx are raised, since the call may have taken
+        effect (see outcome_unknown).
+        """
+        kwargs.setdefault("timeout", (GRAPH_CONNECT_TIMEOUT, GRAPH_READ_TIMEOUT))
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+        attempts = self.max_retries + 1 if retry else 1
+        last_error: Optional[Exception] = None
+
+        for attempt in range(attempts):
+            if attempt:
+                self.counters["retries"] += 1
+                delay = min(GRAPH_RETRY_MAX_DELAY, GRAPH_RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+                time.sleep(random.uniform(delay / 2, delay))
+
+            self._throttle(account)
+            self.counters["calls"] += 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.error_codes["transport"] += 1
+                if not idempotent and not request_not_sent(e):
+                    raise
+                last_error = e
+                continue
+
+            self._observe(response, account)
+            if response.ok:
+                return response.json()
+
+            error = self._error(response)
+            self.error_codes[str(error.code or response.status_code)] += 1
+            if error.rate_limited:
+                self.counters["rate_limited"] += 1
+                # Back off the bucket that hit the limit even without usage headers
+                (self._account_bucket(account) if account else self.app_bucket).penalize()
+            if not idempotent and not error.rate_limited:
+                raise error
+            if response.status_code not in RETRYABLE_STATUS and error.code not in TRANSIENT_CODES:
+                raise error
+            last_error = error
+
+        self.counters["failures"] += 1
+        raise last_error
+
+    def get(self, url: str, account: Optional[str] = None, **kwargs) -> Dict:
+        return self.request("GET", url, account=account, **kwargs)
+
+    def post(self, url: str, account: Optional[str] = None, **kwargs) -> Dict:
+        return self.request("POST", url, account=account, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            accounts = dict(self._accounts)
+            waits = self.throttle_wait_seconds
+        return {
+            **{k: self.counters[k] for k in ("calls", "retries", "failures", "rate_limited", "throttle_waits")},
+            "throttle_wait_seconds": round(waits, 3),
+            "error_codes": dict(self.error_codes),
+            "app": self.app_bucket.to_dict(),
+            "accounts": {account: bucket.to_dict() for account, bucket in accounts.items()},
+        }
+
+
+graph_client = GraphClient()
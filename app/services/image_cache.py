@@ -0,0 +1,266 @@
+import os
+import io
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, Optional
+
+from PIL import Image
+
+from app.services.asset_index import AssetIndex, asset_index
+from app.services.job_queue import JobCancelled
+
+# Generated image cache configuration
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "generated_ads")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "2048"))
+
+HASH_LEN = 32  # hex chars kept in filenames
+
+
+def request_key(**params) -> str:
+    """Stable hash of every input that determines a generated image"""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:HASH_LEN]
+
+
+def _touch(path: str):
+    """Mark a file recently used; only atime changes, so mtime keeps identifying the content"""
+    st = os.stat(path)
+    os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+
+
+class _RenderAbandoned(Exception):
+    """The coalesced render was cancelled; a waiter should render it itself"""
+
+
+def seed_from_key(key: str) -> int:
+    """Deterministic diffusion seed for requests that did not pick one"""
+    return int(key[:8], 16)
+
+
+def shard_path(directory: str, name: str) -> str:
+    """directory/ab/cd/abcd....ext: two levels of 256 subdirectories keep every listing small"""
+    return os.path.join(directory, name[:2], name[2:4], name)
+
+
+def iter_sharded(directory: str) -> Iterator[str]:
+    """Paths of hash-named files in the shard directories under `directory`"""
+    for root, dirs, files in os.walk(directory):
+        level = 0 if root == directory else os.path.relpath(root, directory).count(os.sep) + 1
+        dirs[:] = [d for d in dirs if level < 2 and len(d) == 2]  # only descend into shard dirs
+        if level == 2:
+            yield from (os.path.join(root, name) for name in files if len(name.split(".")[0]) == HASH_LEN)
+
+
+class ImageCache:
+    """Disk cache of generated images named by request hash
+
+    Identical requests map to the same file, so a repeat is a file lookup.
+    Concurrent identical requests are coalesced: the first caller renders
+    and the others wait for its result (single-flight). Render errors are
+    shared with the waiters; if the renderer is cancelled instead, one
+    waiter takes the render over. Files are sharded into hashed
+    subdirectories.
+
+    With an AssetIndex attached, writes and accesses are recorded there and
+    deletion is left to the storage manager's sweeper (which knows which
+    files Instagram posts still use); without one, files are evicted
+    least-recently-used first once the directory exceeds max_mb.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_mb: int = IMAGE_CACHE_MAX_MB,
+                 index: Optional[AssetIndex] = None):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.index = index
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # filename -> size, LRU order
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._scanned = False
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "bypassed": 0}
+
+    def _scan(self):
+        """Index existing cache files, oldest access first (lock held; unindexed mode only)"""
+        if self._scanned or self.index is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for path in iter_sharded(self.directory):
+            st = os.stat(path)
+            entries.append((st.st_atime, os.path.basename(path), st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+        self._scanned = True
+
+    def path_for(self, key: str, ext: str) -> str:
+        return shard_path(self.directory, f"{key}.{ext}")
+
+    def _cached(self, name: str, path: str) -> bool:
+        """Is `name` on disk? (lock held) With an index the file system is the source of
+        truth, so files written by other worker processes are hits too."""
+        if self.index is not None:
+            return os.path.exists(path)
+        return name in self._index and os.path.exists(path)
+
+    def _accessed(self, name: str, path: str):
+        if self.index is not None:
+            self.index.touch(name)
+        else:
+            self._index.move_to_end(name)
+            _touch(path)
+
+    def get_or_create(self, key: str, render: Callable[[], Image.Image], ext: str = "png",
+                      use_cache: bool = True, **save_kwargs) -> str:
+        """Return the path for `key`, rendering and saving it at most once
+
+        use_cache=False always renders fresh: it neither reuses the file nor
+        waits on another caller's in-flight render, and is counted as bypassed.
+        """
+        name = f"{key}.{ext}"
+        path = self.path_for(key, ext)
+
+        if not use_cache:
+            with self._lock:
+                self.counters["bypassed"] += 1
+            # Atomic replace, so overlapping with a cached render of the same key is safe
+            self._write(path, render(), **save_kwargs)
+            return path
+
+        while True:
+            with self._lock:
+                self._scan()
+                if self._cached(name, path):
+                    self.counters["hits"] += 1
+                    self._accessed(name, path)
+                    return path
+
+                future = self._inflight.get(name)
+                if future is not None:
+                    self.counters["coalesced"] += 1
+                    owner = False
+                else:
+                    future = Future()
+                    self._inflight[name] = future
+                    owner = True
+                    self.counters["misses"] += 1
+
+            if not owner:
+                try:
+                    return future.result()
+                except _RenderAbandoned:
+                    continue  # the renderer's job was cancelled, not ours
+
+            try:
+                self._write(path, render(), **save_kwargs)
+            except BaseException as e:
+                self._release(name)
+                cancelled = isinstance(e, JobCancelled) or not isinstance(e, Exception)
+                future.set_exception(_RenderAbandoned() if cancelled else e)
+                raise
+            self._release(name)
+            future.set_result(path)
+            return path
+
+    def _release(self, name: str):
+        # Before resolving the future, so a waiter retrying finds no stale entry
+        with self._lock:
+            self._inflight.pop(name, None)
+
+    def lookup(self, key: str, ext: str) -> Optional[str]:
+        """Path of a cached file (counted as a hit and marked recently used), or None"""
+        name = f"{key}.{ext}"
+        path = self.path_for(key, ext)
+        with self._lock:
+            self._scan()
+            if not self._cached(name, path):
+                return None
+            self.counters["hits"] += 1
+            self._accessed(name, path)
+        return path
+
+    def put_bytes(self, key: str, ext: str, data: bytes, parent: Optional[str] = None) -> str:
+        """Store already-encoded bytes under `key`; `parent` names the file it was derived from"""
+        path = self.path_for(key, ext)
+        with self._lock:
+            self._scan()
+            self.counters["misses"] += 1
+        self._write_bytes(path, data, parent=parent)
+        return path
+
+    def save(self, image: Image.Image, ext: str = "png", **save_kwargs) -> str:
+        """Save an image under the hash of its encoded bytes"""
+        buf = io.BytesIO()
+        image.save(buf, format=_FORMATS.get(ext, ext.upper()), **save_kwargs)
+        data = buf.getvalue()
+        path = self.path_for(hashlib.sha256(data).hexdigest()[:HASH_LEN], ext)
+        with self._lock:
+            self._scan()
+        self._write_bytes(path, data)
+        return path
+
+    def _write(self, path: str, image: Image.Image, **save_kwargs):
+        buf = io.BytesIO()
+        image.save(buf, format=_FORMATS.get(path.rsplit(".", 1)[-1], None), **save_kwargs)
+        self._write_bytes(path, buf.getvalue())
+
+    def _write_bytes(self, path: str, data: bytes, parent: Optional[str] = None):
+        # Write then rename so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        name = os.path.basename(path)
+        if self.index is not None:
+            self.index.record(name, len(data), parent=parent)
+            return
+        with self._lock:
+            self._index[name] = len(data)
+            self._index.move_to_end(name)
+            self._evict(keep=name)
+
+    def forget(self, name: str):
+        """Drop a file deleted by someone else (the storage sweeper) from the in-memory index"""
+        with self._lock:
+            self._index.pop(name, None)
+
+    def _evict(self, keep: str):
+        """Remove least recently used files past the size budget (lock held)"""
+        total = sum(self._index.values())
+        for name in list(self._index):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._index.pop(name)
+            try:
+                os.remove(shard_path(self.directory, name))
+            except FileNotFoundError:
+                pass
+            self.counters["evictions"] += 1
+
+    def stats(self) -> Dict:
+        if self.index is not None:
+            files, size = self.index.count(), self.index.total_bytes()
+        with self._lock:
+            self._scan()
+            if self.index is None:
+                files, size = len(self._index), sum(self._index.values())
+            lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return {
+                **self.counters,
+                "hit_rate": round((self.counters["hits"] + self.counters["coalesced"]) / lookups, 3) if lookups else None,
+                "files": files,
+                "size_mb": round(size / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "inflight": len(self._inflight),
+            }
+
+
+_FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+
+image_cache = ImageCache(index=asset_index)
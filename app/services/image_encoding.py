@@ -0,0 +1,179 @@
+import os
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+from PIL import Image, ImageFilter, ImageOps
+
+from app.services.image_cache import image_cache, request_key
+
+# Output encoding configuration
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+THUMB_SIDE = int(os.getenv("THUMB_SIDE", "320"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "85"))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+
+FEED_WIDTH = 1080
+FEED_ASPECT = (4 / 5, 1.91)  # Instagram feed: portrait 4:5 to landscape 1.91:1
+STORY_SIZE = (1080, 1920)
+
+# ext -> PIL save options (PIL encoders release the GIL, so these run in parallel)
+FORMATS = {
+    "webp": {"quality": WEBP_QUALITY, "method": 4},
+    "jpg": {"quality": JPEG_QUALITY, "optimize": True, "progressive": True},
+}
+
+
+def _full(image: Image.Image) -> Image.Image:
+    return image
+
+
+def _thumb(image: Image.Image) -> Image.Image:
+    """Fits within THUMB_SIDE (never upscaled); for the Generator page grid"""
+    thumb = image.copy()
+    thumb.thumbnail((THUMB_SIDE, THUMB_SIDE), Image.LANCZOS, reducing_gap=2.0)
+    return thumb
+
+
+def _feed(image: Image.Image) -> Image.Image:
+    """FEED_WIDTH wide, centre-cropped into Instagram's allowed aspect range"""
+    w, h = image.size
+    lo, hi = FEED_ASPECT
+    if w / h < lo:
+        image = ImageOps.fit(image, (w, round(w / lo)))
+    elif w / h > hi:
+        image = ImageOps.fit(image, (round(h * hi), h))
+    w, h = image.size
+    return image.resize((FEED_WIDTH, round(h * FEED_WIDTH / w)), Image.LANCZOS)
+
+
+def _story(image: Image.Image) -> Image.Image:
+    """STORY_SIZE frame: the whole image over a blurred crop of itself
+
+    A plain centre crop of a square ad would cut off the caption band, so
+    the crop only fills the background.
+    """
+    small = (STORY_SIZE[0] // 8, STORY_SIZE[1] // 8)  # blur at 1/8 scale, then upsample
+    story = ImageOps.fit(image, small).filter(ImageFilter.GaussianBlur(4)).resize(STORY_SIZE, Image.BILINEAR)
+    fg = ImageOps.contain(image, STORY_SIZE, Image.LANCZOS)
+    story.paste(fg, ((STORY_SIZE[0] - fg.width) // 2, (STORY_SIZE[1] - fg.height) // 2))
+    return story
+
+
+RENDITIONS: Dict[str, Callable[[Image.Image], Image.Image]] = {
+    "full": _full,
+    "thumb": _thumb,
+    "feed": _feed,
+    "story": _story,
+}
+
+
+class EncodingStats:
+    """Encode time and output size per format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._formats: Dict[str, Dict] = {}
+        self.manifests = 0
+        self.cached = 0
+
+    def record(self, ext: str, size: int, seconds: float):
+        with self._lock:
+            s = self._formats.setdefault(ext, {"encodes": 0, "seconds": 0.0, "bytes": 0})
+            s["encodes"] += 1
+            s["seconds"] += seconds
+            s["bytes"] += size
+
+    def record_manifest(self, cached: int):
+        with self._lock:
+            self.manifests += 1
+            self.cached += cached
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": ENCODE_WORKERS,
+                "manifests": self.manifests,
+                "cached": self.cached,
+                "formats": {
+                    ext: {
+                        "encodes": s["encodes"],
+                        "avg_encode_ms": round(s["seconds"] / s["encodes"] * 1000, 1),
+                        "avg_kb": round(s["bytes"] / s["encodes"] / 1024, 1),
+                    }
+                    for ext, s in self._formats.items()
+                },
+            }
+
+
+encoding_stats = EncodingStats()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+        return _executor
+
+
+def _encode(image: Image.Image, ext: str, key: str, parent: str) -> Dict:
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    image.save(buf, format="WEBP" if ext == "webp" else "JPEG", **FORMATS[ext])
+    data = buf.getvalue()
+    seconds = time.perf_counter() - start
+    path = image_cache.put_bytes(key, ext, data, parent=parent)
+    encoding_stats.record(ext, len(data), seconds)
+    return {"path": path, "bytes": len(data), "encode_ms": round(seconds * 1000, 1), "cached": False}
+
+
+def build_renditions(source_path: str, renditions: Optional[Iterable[str]] = None, use_cache: bool = True,
+                     url_for: Callable[[str], str] = str) -> Dict:
+    """Encode every rendition of a generated image as WebP and progressive JPEG
+
+    Blocking; resizes and encodes fan out over the encode thread pool.
+    Outputs live in the image cache under a key derived from the source
+    file name, so a cached source serves its renditions without encoding.
+    Returns {rendition: {"width", "height", ext: {"url", "bytes", "encode_ms", "cached"}}}.
+    """
+    names = list(renditions or RENDITIONS)
+    source = os.path.basename(source_path)
+    keys = {(name, ext): request_key(source=source, rendition=name, format=ext, options=FORMATS[ext])
+            for name in names for ext in FORMATS}
+
+    manifest: Dict[str, Dict] = {name: {} for name in names}
+    missing = []
+    for (name, ext), key in keys.items():
+        path = image_cache.lookup(key, ext) if use_cache else None
+        if path is None:
+            missing.append((name, ext))
+            continue
+        with Image.open(path) as cached:  # header only
+            manifest[name].update(width=cached.width, height=cached.height)
+        manifest[name][ext] = {"path": path, "bytes": os.path.getsize(path), "encode_ms": 0.0, "cached": True}
+
+    if missing:
+        with Image.open(source_path) as src:
+            image = src.convert("RGB")
+        pool = _pool()
+        todo = sorted({name for name, _ in missing})
+        # Resizes first, then encodes; two rounds so no pool task waits on another
+        resized = dict(zip(todo, pool.map(lambda n: RENDITIONS[n](image), todo)))
+        for name, im in resized.items():
+            manifest[name].update(width=im.width, height=im.height)
+        futures = {(name, ext): pool.submit(_encode, resized[name], ext, keys[(name, ext)], source)
+                   for name, ext in missing}
+        for (name, ext), future in futures.items():
+            manifest[name][ext] = future.result()
+
+    for entry in manifest.values():
+        for ext in FORMATS:
+            entry[ext]["url"] = url_for(entry[ext].pop("path"))
+    encoding_stats.record_manifest(cached=len(keys) - len(missing))
+    return manifest
@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional
+
+from app.services.instagram_service import InstagramService
+from app.services.connection_cache import get_user_connection, get_access_token
+from app.services.instagram_storage import save_instagram_post
+from app.services.caption_generator import generate_instagram_caption
+
+# Per-account limits for container creation
+ACCOUNT_MAX_CONCURRENCY = int(os.getenv("INSTAGRAM_ACCOUNT_MAX_CONCURRENCY", "3"))
+ACCOUNT_MIN_INTERVAL = float(os.getenv("INSTAGRAM_ACCOUNT_MIN_INTERVAL", "0.2"))  # seconds between calls
+CAROUSEL_MAX_ITEMS = 10  # Graph API limit
+
+
+class AccountRateLimiter:
+    """Caps concurrent calls and spaces call starts for one Instagram account"""
+
+    def __init__(self, max_concurrency: int = ACCOUNT_MAX_CONCURRENCY, min_interval: float = ACCOUNT_MIN_INTERVAL):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._min_interval = min_interval
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def call(self, func, *args):
+        """Run a blocking Graph API call in a thread once the limiter allows it"""
+        async with self._semaphore:
+            async with self._lock:
+                now = time.monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self._min_interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return await asyncio.to_thread(func, *args)
+
+
+# Shared across batches so concurrent batches respect the same per-account limits
+_limiters: Dict[str, AccountRateLimiter] = {}
+
+
+class _Account:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.ig_user_id: Optional[str] = None
+        self.access_token: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def limiter(self) -> AccountRateLimiter:
+        if self.ig_user_id not in _limiters:
+            _limiters[self.ig_user_id] = AccountRateLimiter()
+        return _limiters[self.ig_user_id]
+
+
+def _error_message(e: Exception) -> str:
+    response = getattr(e, "response", None)
+    if response is not None:
+        try:
+            return response.json().get("error", {}).get("message") or str(e)
+        except Exception:
+            pass
+    return str(e)
+
+
+def _resolve_account(user_id: str) -> _Account:
+    account = _Account(user_id)
+    try:
+        connection = get_user_connection(user_id)
+        if not connection:
+            account.error = "Instagram not connected"
+        elif not connection.get("ig_business_account_id"):
+            account.error = "Instagram Business Account not found. Please connect a Business/Creator account."
+        else:
+            account.ig_user_id = connection["ig_business_account_id"]
+            account.access_token = get_access_token(user_id)
+    except Exception as e:
+        # e.g. a token that no longer decrypts; only this account's items fail
+        message = _error_message(e) or type(e).__name__
+        print(f"❌ Instagram batch: could not load account {user_id}: {message}")
+        account.error = f"Could not load Instagram connection: {message}"
+    return account
+
+
+async def _create_container(account: _Account, item: Dict) -> str:
+    """Create the media container for one item and return its creation id"""
+    post_type = item["post_type"]
+    if post_type == "story":
+        container = await account.limiter.call(
+            InstagramService.create_story_container, account.ig_user_id, item["image_urls"][0], account.access_token
+        )
+    elif post_type == "carousel":
+        children = await asyncio.gather(*[
+            account.limiter.call(InstagramService.create_carousel_item, account.ig_user_id, url, account.access_token)
+            for url in item["image_urls"]
+        ])
+        container = await account.limiter.call(
+            InstagramService.create_carousel_container,
+            account.ig_user_id, [c.get("id") for c in children], item["caption"], account.access_token
+        )
+    else:
+        container = await account.limiter.call(
+            InstagramService.create_media_container,
+            account.ig_user_id, item["image_urls"][0], item["caption"], account.access_token
+        )
+    return container.get("id")
+
+
+async def _fill_caption(item: Dict):
+    # Stories don't support captions
+    if item["post_type"] == "story":
+        item["caption"] = ""
+    elif not item.get("caption") and item.get("ad_text"):
+        item["caption"] = await generate_instagram_caption(
+            item["ad_text"], item.get("product_name") or "", item.get("description") or ""
+        )
+    item["caption"] = item.get("caption") or ""
+
+
+async def publish_batch(items: List[Dict]) -> List[Dict]:
+    """Publish many posts across accounts
+
+    Containers for all items are created concurrently (bounded per account),
+    then each account publishes its items sequentially in submission order;
+    different accounts publish in parallel. Returns one result per item, in
+    input order. An item that went live but could not be saved to history
+    keeps success and post_id and carries save_error instead of error.
+    """
+    results: List[Dict] = [{"index": i, "success": False} for i in range(len(items))]
+
+    accounts: Dict[str, _Account] = {}
+    for user_id in {item["user_id"] for item in items}:
+        accounts[user_id] = await asyncio.to_thread(_resolve_account, user_id)
+
+    for i, item in enumerate(items):
+        urls = item.get("image_urls") or ([item["image_url"]] if item.get("image_url") else [])
+        item["image_urls"] = urls
+        if accounts[item["user_id"]].error:
+            results[i]["error"] = accounts[item["user_id"]].error
+        elif not urls:
+            results[i]["error"] = "No image_url provided"
+        elif item["post_type"] == "carousel" and not 2 <= len(urls) <= CAROUSEL_MAX_ITEMS:
+            results[i]["error"] = f"Carousel needs 2-{CAROUSEL_MAX_ITEMS} images"
+        elif item["post_type"] not in ("feed", "story", "carousel"):
+            results[i]["error"] = f"Unknown post_type: {item['post_type']}"
+    pending = [i for i, r in enumerate(results) if "error" not in r]
+
+    await asyncio.gather(*[_fill_caption(items[i]) for i in pending])
+
+    # Phase 1: containers, concurrently
+    async def create(i: int):
+        try:
+            results[i]["creation_id"] = await _create_container(accounts[items[i]["user_id"]], items[i])
+        except Exception as e:
+            results[i].update(error=_error_message(e), stage="create_container")
+
+    await asyncio.gather(*[create(i) for i in pending])
+
+    # Phase 2: publish in submission order per account
+    async def publish_account(account: _Account, indexes: List[int]):
+        for i in indexes:
+            if "error" in results[i]:
+                continue
+            item = items[i]
+            try:
+                published = await account.limiter.call(
+                    InstagramService.publish_media, account.ig_user_id, results[i]["creation_id"], account.access_token
+                )
+            except Exception as e:
+                results[i].update(error=_error_message(e), stage="publish")
+                continue
+            results[i].update(success=True, post_id=published.get("id"))
+            try:
+                await asyncio.to_thread(save_instagram_post, account.user_id, {
+                    "post_id": published.get("id"),
+                    "image_url": item["image_urls"][0],
+                    "image_urls": item["image_urls"],
+                    "caption": item["caption"],
+                    "post_type": item["post_type"],
+                    "posted_at": time.time(),
+                    "product_name": item.get("product_name"),
+                })
+            except Exception as e:
+                # The post is live; only our history record is missing
+                print(f"⚠️ Instagram batch: published {published.get('id')} but could not save history: {e}")
+                results[i]["save_error"] = str(e)
+
+    by_account: Dict[str, List[int]] = {}
+    for i in pending:
+        by_account.setdefault(items[i]["user_id"], []).append(i)
+    await asyncio.gather(*[publish_account(accounts[u], idx) for u, idx in by_account.items()])
+
+    return results
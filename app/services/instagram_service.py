@@ -1,15 +1,18 @@
 import os
-import requests
 import json
 from typing import Optional, Dict
 from cryptography.fernet import Fernet
 import base64
 
+from app.services.graph_client import graph_client
+
 # Instagram API Configuration
 INSTAGRAM_APP_ID = os.getenv("INSTAGRAM_APP_ID", "")
 INSTAGRAM_APP_SECRET = os.getenv("INSTAGRAM_APP_SECRET", "")
 INSTAGRAM_REDIRECT_URI = os.getenv("INSTAGRAM_REDIRECT_URI", "http://localhost:8000/api/instagram/callback")
 FACEBOOK_API_VERSION = "v18.0"
+# Point at a local fake (scripts/fake_graph_api.py) for testing
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com").rstrip("/")
 
 # Encryption key for tokens (in production, use a secure key from env)
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
@@ -57,9 +60,8 @@ class InstagramService:
             "code": code
         }
         
-        response = requests.post(token_url, data=data)
-        response.raise_for_status()
-        return response.json()
+        # Authorization codes are single-use, so never retry this call
+        return graph_client.post(token_url, data=data, retry=False)
     
     @staticmethod
     def get_long_lived_token(short_token: str) -> Dict:
@@ -72,9 +74,7 @@ class InstagramService:
             "access_token": short_token
         }
         
-        response = requests.get(token_url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return graph_client.get(token_url, params=params)
     
     @staticmethod
     def get_user_info(access_token: str) -> Dict:
@@ -85,43 +85,36 @@ class InstagramService:
             "access_token": access_token
         }
         
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return graph_client.get(url, params=params)
     
     @staticmethod
     def get_facebook_pages(access_token: str) -> list:
         """Get Facebook pages connected to the user"""
-        url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/me/accounts"
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/me/accounts"
         params = {
             "access_token": access_token,
-            "fields": "id,name,instagram_business_account"
+            "fields": "id,name,access_token,instagram_business_account"
         }
         
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("data", [])
+        return graph_client.get(url, params=params).get("data", [])
     
     @staticmethod
     def get_instagram_business_account(page_id: str, page_access_token: str) -> Optional[str]:
         """Get Instagram Business Account ID from Facebook Page"""
-        url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{page_id}"
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{page_id}"
         params = {
             "fields": "instagram_business_account",
             "access_token": page_access_token
         }
         
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = graph_client.get(url, params=params)
         instagram_account = data.get("instagram_business_account")
         return instagram_account.get("id") if instagram_account else None
     
     @staticmethod
     def create_media_container(ig_user_id: str, image_url: str, caption: str, access_token: str) -> Dict:
         """Create a media container for posting to Instagram"""
-        url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
         
         params = {
             "image_url": image_url,
@@ -129,28 +122,39 @@ class InstagramService:
             "access_token": access_token
         }
         
-        response = requests.post(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return graph_client.post(url, account=ig_user_id, params=params)
     
     @staticmethod
-    def publish_media(ig_user_id: str, creation_id: str, access_token: str) -> Dict:
-        """Publish the media container to Instagram"""
-        url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{ig_user_id}/media_publish"
+    def create_carousel_item(ig_user_id: str, image_url: str, access_token: str) -> Dict:
+        """Create a child container for a carousel album"""
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
         
         params = {
-            "creation_id": creation_id,
+            "image_url": image_url,
+            "is_carousel_item": "true",
             "access_token": access_token
         }
         
-        response = requests.post(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return graph_client.post(url, account=ig_user_id, params=params)
     
     @staticmethod
-    def create_story(ig_user_id: str, image_url: str, access_token: str) -> Dict:
-        """Create an Instagram story"""
-        url = f"https://graph.facebook.com/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
+    def create_carousel_container(ig_user_id: str, children: list, caption: str, access_token: str) -> Dict:
+        """Create the parent container of a carousel album from child container ids"""
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
+        
+        params = {
+            "media_type": "CAROUSEL",
+            "children": ",".join(children),
+            "caption": caption,
+            "access_token": access_token
+        }
+        
+        return graph_client.post(url, account=ig_user_id, params=params)
+    
+    @staticmethod
+    def create_story_container(ig_user_id: str, image_url: str, access_token: str) -> Dict:
+        """Create a story media container (publish separately)"""
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{ig_user_id}/media"
         
         params = {
             "image_url": image_url,
@@ -158,9 +162,24 @@ class InstagramService:
             "access_token": access_token
         }
         
-        response = requests.post(url, params=params)
-        response.raise_for_status()
-        creation_id = response.json().get("id")
+        return graph_client.post(url, account=ig_user_id, params=params)
+    
+    @staticmethod
+    def publish_media(ig_user_id: str, creation_id: str, access_token: str) -> Dict:
+        """Publish the media container to Instagram"""
+        url = f"{FACEBOOK_GRAPH_URL}/{FACEBOOK_API_VERSION}/{ig_user_id}/media_publish"
+        
+        params = {
+            "creation_id": creation_id,
+            "access_token": access_token
+        }
+        
+        return graph_client.post(url, account=ig_user_id, params=params)
+    
+    @staticmethod
+    def create_story(ig_user_id: str, image_url: str, access_token: str) -> Dict:
+        """Create an Instagram story"""
+        creation_id = InstagramService.create_story_container(ig_user_id, image_url, access_token).get("id")
         
         # Publish the story
         return InstagramService.publish_media(ig_user_id, creation_id, access_token)
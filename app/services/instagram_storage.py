@@ -1,61 +1,298 @@
 import json
 import os
-from typing import Optional, Dict
+import sys
+import glob
+import time
+import sqlite3
+import threading
+from typing import Optional, Dict, Iterator, List, Tuple
 
 STORAGE_FILE = "instagram_connections.json"
+POSTS_FILE_PATTERN = "instagram_posts_{user_id}.json"
 
+# "sqlite" (default) or "json" (single-process dev setups)
+STORAGE_BACKEND = os.getenv("INSTAGRAM_STORAGE_BACKEND", "sqlite").lower()
+STORAGE_DB = os.getenv("INSTAGRAM_STORAGE_DB", "instagram.sqlite3")
 
-def load_connections() -> Dict:
-    """Load Instagram connections from file"""
-    if os.path.exists(STORAGE_FILE):
-        try:
-            with open(STORAGE_FILE, "r") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
 
+class StorageBackend:
+    """Interface for Instagram connection and post persistence"""
+
+    def get_connection(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def save_connection(self, user_id: str, connection_data: Dict):
+        raise NotImplementedError
+
+    def delete_connection(self, user_id: str):
+        raise NotImplementedError
+
+    def all_connections(self) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    def add_post(self, user_id: str, post_data: Dict):
+        raise NotImplementedError
+
+    def list_posts(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+        """Newest first"""
+        raise NotImplementedError
+
+    def count_posts(self, user_id: str) -> int:
+        raise NotImplementedError
+
+    def iter_posts(self, after_id: int = 0) -> Iterator[Tuple[int, Dict]]:
+        """(row id, post) for every user's posts with id > after_id; id 0 where there are no row ids"""
+        raise NotImplementedError
+
+
+class JsonStorageBackend(StorageBackend):
+    """Original file-per-collection storage; every call rewrites the whole file"""
+
+    def __init__(self, connections_file: str = STORAGE_FILE, posts_pattern: str = POSTS_FILE_PATTERN):
+        self.connections_file = connections_file
+        self.posts_pattern = posts_pattern
+
+    def load_connections(self) -> Dict:
+        """Load Instagram connections from file"""
+        if os.path.exists(self.connections_file):
+            try:
+                with open(self.connections_file, "r") as f:
+                    return json.load(f)
+            except:
+                return {}
+        return {}
+
+    def save_connections(self, connections: Dict):
+        """Save Instagram connections to file"""
+        with open(self.connections_file, "w") as f:
+            json.dump(connections, f, indent=2)
+
+    def get_connection(self, user_id: str) -> Optional[Dict]:
+        return self.load_connections().get(user_id)
+
+    def save_connection(self, user_id: str, connection_data: Dict):
+        connections = self.load_connections()
+        connections[user_id] = connection_data
+        self.save_connections(connections)
+
+    def delete_connection(self, user_id: str):
+        connections = self.load_connections()
+        if user_id in connections:
+            del connections[user_id]
+            self.save_connections(connections)
+
+    def all_connections(self) -> Dict[str, Dict]:
+        return self.load_connections()
+
+    def _load_posts(self, user_id: str) -> List[Dict]:
+        posts_file = self.posts_pattern.format(user_id=user_id)
+        if os.path.exists(posts_file):
+            try:
+                with open(posts_file, "r") as f:
+                    return json.load(f)
+            except:
+                return []
+        return []
+
+    def add_post(self, user_id: str, post_data: Dict):
+        posts = self._load_posts(user_id)
+        posts.append(post_data)
+        with open(self.posts_pattern.format(user_id=user_id), "w") as f:
+            json.dump(posts, f, indent=2)
+
+    def list_posts(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+        posts = self._load_posts(user_id)[::-1]
+        return posts[offset:offset + limit]
+
+    def count_posts(self, user_id: str) -> int:
+        return len(self._load_posts(user_id))
+
+    def iter_posts(self, after_id: int = 0) -> Iterator[Tuple[int, Dict]]:
+        for user_id in self.post_user_ids():
+            for post in self._load_posts(user_id):
+                yield 0, post
+
+    def post_user_ids(self) -> List[str]:
+        """User ids that have a posts file"""
+        prefix, suffix = self.posts_pattern.split("{user_id}")
+        return [
+            os.path.basename(path)[len(prefix):-len(suffix)]
+            for path in glob.glob(prefix + "*" + suffix)
+        ]
+
+
+class SqliteStorageBackend(StorageBackend):
+    """SQLite (WAL) storage: indexed lookups, append-only post inserts
+
+    WAL lets readers proceed while a writer commits, and SQLite's locking
+    makes concurrent writes from several workers safe. Each thread gets its
+    own connection.
+    """
 
-def save_connections(connections: Dict):
-    """Save Instagram connections to file"""
-    with open(STORAGE_FILE, "w") as f:
-        json.dump(connections, f, indent=2)
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS instagram_connections (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS instagram_posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        post_id TEXT,
+        posted_at REAL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_instagram_posts_user
+        ON instagram_posts (user_id, id DESC);
+    """
+
+    def __init__(self, db_path: str = STORAGE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.created = not os.path.exists(db_path)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_connection(self, user_id: str) -> Optional[Dict]:
+        row = self._conn().execute(
+            "SELECT data FROM instagram_connections WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_connection(self, user_id: str, connection_data: Dict):
+        self._conn().execute(
+            "INSERT INTO instagram_connections (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, json.dumps(connection_data), time.time()),
+        )
+
+    def delete_connection(self, user_id: str):
+        self._conn().execute("DELETE FROM instagram_connections WHERE user_id = ?", (user_id,))
+
+    def all_connections(self) -> Dict[str, Dict]:
+        rows = self._conn().execute("SELECT user_id, data FROM instagram_connections").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def add_post(self, user_id: str, post_data: Dict):
+        self.add_posts(user_id, [post_data])
+
+    def add_posts(self, user_id: str, posts: List[Dict]):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO instagram_posts (user_id, post_id, posted_at, data) VALUES (?, ?, ?, ?)",
+                [(user_id, p.get("post_id"), p.get("posted_at"), json.dumps(p)) for p in posts],
+            )
+
+    def list_posts(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT data FROM instagram_posts WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_posts(self, user_id: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM instagram_posts WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+
+    def iter_posts(self, after_id: int = 0) -> Iterator[Tuple[int, Dict]]:
+        rows = self._conn().execute(
+            "SELECT id, data FROM instagram_posts WHERE id > ? ORDER BY id", (after_id,)
+        )
+        for row_id, data in rows:
+            yield row_id, json.loads(data)
+
+
+def migrate_json_to_sqlite(source: JsonStorageBackend, target: SqliteStorageBackend) -> Dict:
+    """Import JSON connections and post histories into SQLite
+
+    Connections are upserted; posts are only imported for users that have
+    none in SQLite yet, so running the migration twice is harmless.
+    """
+    connections = source.all_connections()
+    for user_id, data in connections.items():
+        target.save_connection(user_id, data)
+
+    imported_posts = 0
+    for user_id in source.post_user_ids():
+        if target.count_posts(user_id):
+            continue
+        posts = source._load_posts(user_id)
+        if posts:
+            target.add_posts(user_id, posts)
+            imported_posts += len(posts)
+
+    return {"connections": len(connections), "posts": imported_posts}
+
+
+def _create_backend() -> StorageBackend:
+    if STORAGE_BACKEND == "json":
+        return JsonStorageBackend()
+    if STORAGE_BACKEND != "sqlite":
+        raise ValueError(f"Unknown INSTAGRAM_STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+    backend = SqliteStorageBackend()
+    # First start on SQLite: bring over anything the JSON backend stored
+    if backend.created and os.path.exists(STORAGE_FILE):
+        result = migrate_json_to_sqlite(JsonStorageBackend(), backend)
+        print(f"✅ Imported {result['connections']} Instagram connections and "
+              f"{result['posts']} posts from JSON into {STORAGE_DB}")
+    return backend
+
+
+backend: StorageBackend = _create_backend()
+
+
+def load_connections() -> Dict:
+    """Load all Instagram connections"""
+    return backend.all_connections()
 
 
 def get_user_connection(user_id: str) -> Optional[Dict]:
     """Get Instagram connection for a user"""
-    connections = load_connections()
-    return connections.get(user_id)
+    return backend.get_connection(user_id)
 
 
 def save_user_connection(user_id: str, connection_data: Dict):
     """Save Instagram connection for a user"""
-    connections = load_connections()
-    connections[user_id] = connection_data
-    save_connections(connections)
+    backend.save_connection(user_id, connection_data)
 
 
 def delete_user_connection(user_id: str):
     """Delete Instagram connection for a user"""
-    connections = load_connections()
-    if user_id in connections:
-        del connections[user_id]
-        save_connections(connections)
+    backend.delete_connection(user_id)
 
 
 def save_instagram_post(user_id: str, post_data: Dict):
     """Save Instagram post data"""
-    posts_file = f"instagram_posts_{user_id}.json"
-    posts = []
-    if os.path.exists(posts_file):
-        try:
-            with open(posts_file, "r") as f:
-                posts = json.load(f)
-        except:
-            posts = []
-    
-    posts.append(post_data)
-    
-    with open(posts_file, "w") as f:
-        json.dump(posts, f, indent=2)
+    backend.add_post(user_id, post_data)
+
+
+def get_instagram_posts(user_id: str, limit: int = 20, offset: int = 0) -> Dict:
+    """Page through a user's post history, newest first"""
+    return {
+        "posts": backend.list_posts(user_id, limit=limit, offset=offset),
+        "total": backend.count_posts(user_id),
+        "limit": limit,
+        "offset": offset,
+    }
+
 
+if __name__ == "__main__":
+    # python -m app.services.instagram_storage migrate [db_path]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("usage: python -m app.services.instagram_storage migrate [db_path]")
+        sys.exit(1)
+    target = SqliteStorageBackend(sys.argv[2] if len(sys.argv) > 2 else STORAGE_DB)
+    result = migrate_json_to_sqlite(JsonStorageBackend(), target)
+    print(f"✅ Migrated {result['connections']} connections and {result['posts']} posts into {target.db_path}")
@@ -0,0 +1,262 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Job queue configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # match BATCH_MAX_SIZE so jobs can share a batch
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "16"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "500"))
+
+TERMINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation was requested"""
+
+
+class QueueFull(Exception):
+    """Raised when the queue is at capacity; carries a Retry-After hint"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """A unit of background work with progress reporting and cancellation"""
+
+    def __init__(self, kind: str, func: Callable, args: tuple, kwargs: Dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.progress = 0.0
+        self.step = 0
+        self.total_steps = 0
+        self.message: Optional[str] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._cancel = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    # -- progress / cancellation (safe to call from worker threads) --
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def report(self, step: int = None, total_steps: int = None, message: str = None):
+        """Update progress and wake any SSE subscribers; raises JobCancelled if cancelled
+
+        Matches the progress(step, total_steps) callables taken by the generators.
+        """
+        if total_steps is not None:
+            self.total_steps = total_steps
+        if step is not None:
+            self.step = step
+            if self.total_steps:
+                self.progress = min(1.0, step / self.total_steps)
+        if message is not None:
+            self.message = message
+        self._notify()
+        self.check_cancelled()
+
+    def _notify(self):
+        self.version += 1
+        if self._loop:
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def _wake(self):
+        # Swap in a fresh event so every subscriber sees each change
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, since_version: int, timeout: float = 15.0) -> bool:
+        """Wait until the job moves past since_version; False on timeout"""
+        changed = self._changed
+        if self.version != since_version:
+            return True
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Bounded queue of jobs drained by a fixed pool of workers
+
+    Synchronous job functions run on a dedicated thread pool so blocking
+    inference never stalls the event loop; coroutine functions run on the
+    loop itself. Every job function receives the Job as its first argument.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE,
+                 history_limit: int = JOB_HISTORY_LIMIT):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.history_limit = history_limit
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = []
+        self._durations = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if job.status in ("queued", "running"):
+                job._cancel.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for j in self.jobs.values() if j.status == "queued")
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up, from recent job durations"""
+        avg = sum(self._durations) / len(self._durations) if self._durations else 10.0
+        return max(1, int(avg * (self.depth + 1) / self.workers))
+
+    def submit(self, kind: str, func: Callable, *args, **kwargs) -> Job:
+        if self._queue is None:
+            raise RuntimeError("Job queue not started")
+        if self.depth >= self.max_queue:
+            raise QueueFull(self.retry_after())
+
+        job = Job(kind, func, args, kwargs)
+        job._loop = self._loop
+        job._changed = asyncio.Event()
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self._trim_history()
+        return job
+
+    async def run_blocking(self, func: Callable, *args, **kwargs):
+        """Run blocking work from a coroutine job on the queue's thread pool"""
+        return await self._loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if not job or job.status in TERMINAL_STATES:
+            return job
+        job._cancel.set()
+        if job.status == "queued":
+            self._finish(job, "cancelled")
+        else:
+            job.message = "cancelling"
+            job._notify()
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != "queued":
+                    continue  # cancelled while waiting
+                job.status = "running"
+                job.started_at = time.time()
+                job._notify()
+                try:
+                    if asyncio.iscoroutinefunction(job.func):
+                        result = await job.func(job, *job.args, **job.kwargs)
+                    else:
+                        result = await self.run_blocking(job.func, job, *job.args, **job.kwargs)
+                    job.check_cancelled()
+                    job.result = result
+                    job.progress = 1.0
+                    self._finish(job, "succeeded")
+                except Exception as e:
+                    # Endpoints wrap errors in HTTPException, so trust the flag
+                    if job.cancel_requested:
+                        self._finish(job, "cancelled")
+                    else:
+                        job.error = getattr(e, "detail", None) or str(e)
+                        self._finish(job, "failed")
+                self._record_duration(job)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        job._notify()
+
+    def _record_duration(self, job: Job):
+        if job.started_at and job.finished_at:
+            self._durations.append(job.finished_at - job.started_at)
+            self._durations = self._durations[-50:]
+
+    def _trim_history(self):
+        """Forget the oldest finished jobs once past the history limit"""
+        excess = len(self.jobs) - self.history_limit
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self.jobs.values() if j.status in TERMINAL_STATES][:excess]:
+            del self.jobs[job_id]
+
+    def stats(self) -> Dict:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "depth": self.depth,
+            "jobs": counts,
+        }
+
+
+job_queue = JobQueue()
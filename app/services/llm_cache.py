@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# LLM response cache configuration
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.sqlite3")  # empty disables the disk tier
+LLM_CACHE_DISK_MAX_ROWS = int(os.getenv("LLM_CACHE_DISK_MAX_ROWS", "100000"))  # least recently used go first
+LLM_CACHE_PURGE_EVERY = int(os.getenv("LLM_CACHE_PURGE_EVERY", "500"))  # disk writes between cleanups
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(model: str, prompt: str, options: Optional[Dict] = None) -> str:
+    """sha256 of (model, normalized prompt, sampling params)"""
+    payload = json.dumps(
+        {"model": model, "prompt": normalize_prompt(prompt), "options": options or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """Two-tier cache of LLM responses: in-memory LRU in front of SQLite
+
+    Entries expire after their TTL in both tiers. Disk hits are promoted to
+    memory. The disk tier survives restarts and is shared by every worker
+    pointing at the same file; every LLM_CACHE_PURGE_EVERY writes it drops
+    expired rows and trims itself to max_disk_rows, least recently used first.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL,
+                 db_path: str = LLM_CACHE_DB, max_disk_rows: int = LLM_CACHE_DISK_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_disk_rows = max_disk_rows
+        self._writes = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()  # memory tier and counters; never held across I/O
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "expired": 0,
+                         "trimmed": 0}
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(llm_cache)")}
+            if "accessed_at" not in columns:  # created before the size cap
+                self._db.execute("ALTER TABLE llm_cache ADD COLUMN accessed_at REAL")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.get_memory(key)
+        return value if value is not None else self.get_disk(key)
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """Memory tier only; never blocks on I/O, so safe on the event loop"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                value, expires_at = entry
+                if expires_at > time.time():
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self.counters["expired"] += 1
+            return None
+
+    def get_disk(self, key: str) -> Optional[str]:
+        """Disk tier (promoting hits to memory); counts a miss if absent. Blocking"""
+        now = time.time()
+        row = None
+        with self._db_lock:
+            db = self._conn()
+            if db is not None:
+                row = db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row and row[1] <= now:
+                    db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                elif row:
+                    db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.counters["disk_hits"] += 1
+                return row[0]
+            if row:
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self.counters["stores"] += 1
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._writes += 1
+            maintain = self._writes % LLM_CACHE_PURGE_EVERY == 0
+        if maintain:
+            self.purge_expired()
+            self.trim()
+
+    def record_bypass(self):
+        with self._lock:
+            self.counters["bypassed"] += 1
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Drop expired rows from the disk tier"""
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return 0
+            purged = db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        with self._lock:
+            self.counters["expired"] += purged
+        return purged
+
+    def trim(self) -> int:
+        """Delete least recently used rows beyond max_disk_rows"""
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return 0
+            excess = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_disk_rows
+            if excess <= 0:
+                return 0
+            # rows from before the accessed_at column sort first (NULL)
+            trimmed = db.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+        with self._lock:
+            self.counters["trimmed"] += trimmed
+        return trimmed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk_tier": bool(self.db_path),
+                "max_disk_rows": self.max_disk_rows,
+            }
+
+
+llm_cache = LLMCache()
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import random
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from app.services.llm_cache import llm_cache, cache_key
+
+# Ollama configuration (comma-separated list of replicas)
+OLLAMA_BASE_URLS = [
+    u.strip().rstrip("/")
+    for u in os.getenv("OLLAMA_BASE_URLS", "http://127.0.0.1:11434").split(",")
+    if u.strip()
+]
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-r1:7b")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "180"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # per backend
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """Raised when every attempt against every backend failed"""
+
+
+class NDJSONParser:
+    """Incremental newline-delimited JSON parser for streamed Ollama responses
+
+    Chunks may split a JSON object anywhere; complete lines are decoded and
+    the trailing partial line is buffered until the next chunk.
+    """
+
+    def __init__(self):
+        self._buf = ""
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self._buf += chunk
+        *lines, self._buf = self._buf.split("\n")
+        return [json.loads(line) for line in lines if line.strip()]
+
+    def flush(self) -> List[Dict]:
+        rest, self._buf = self._buf, ""
+        return [json.loads(rest)] if rest.strip() else []
+
+
+class ThinkStripper:
+    """Removes <think>...</think> reasoning blocks from a token stream
+
+    Tags may arrive split across tokens, so a possible partial tag at the end
+    of the buffer is held back until the next feed(). Leading whitespace of
+    the visible text is dropped.
+    """
+
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self._buf = ""
+        self._in_think = False
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        self._buf += text
+        out = []
+        while self._buf:
+            tag = self.CLOSE if self._in_think else self.OPEN
+            idx = self._buf.find(tag)
+            if idx >= 0:
+                if not self._in_think:
+                    out.append(self._buf[:idx])
+                self._buf = self._buf[idx + len(tag):]
+                self._in_think = not self._in_think
+                continue
+
+            keep = self._partial_tag_len(tag)
+            if not self._in_think:
+                out.append(self._buf[:len(self._buf) - keep])
+            self._buf = self._buf[len(self._buf) - keep:]
+            break
+        return self._visible("".join(out))
+
+    def flush(self) -> str:
+        rest = "" if self._in_think else self._buf
+        self._buf = ""
+        return self._visible(rest)
+
+    def _partial_tag_len(self, tag: str) -> int:
+        for k in range(min(len(tag) - 1, len(self._buf)), 0, -1):
+            if self._buf.endswith(tag[:k]):
+                return k
+        return 0
+
+    def _visible(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+def strip_think(text: str) -> str:
+    """Drop reasoning blocks from a complete response"""
+    stripper = ThinkStripper()
+    return (stripper.feed(text) + stripper.flush()).strip()
+
+
+class _Backend:
+    def __init__(self, base_url: str, max_concurrency: int):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "base_url": self.base_url,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_seconds": round(self.total_seconds / self.requests, 3) if self.requests else None,
+        }
+
+
+class LLMClient:
+    """Pooled async client for one or more Ollama replicas
+
+    A single httpx.AsyncClient keeps connections alive across requests.
+    Each call goes to the backend with the fewest outstanding requests,
+    waits for a per-backend concurrency slot, and is retried on transport
+    errors or retryable status codes with jittered exponential backoff
+    (preferring a different backend on retry).
+    """
+
+    def __init__(self, base_urls: List[str] = None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.backends = [_Backend(u, max_concurrency) for u in (base_urls or OLLAMA_BASE_URLS)]
+        self.max_retries = max_retries
+        self.retries = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is not None:
+            return
+        for backend in self.backends:
+            backend.semaphore = asyncio.Semaphore(backend.max_concurrency)
+        pool_size = sum(b.max_concurrency for b in self.backends)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _pick_backend(self, tried: set) -> _Backend:
+        """Least outstanding requests, skipping backends that already failed this call"""
+        candidates = [b for b in self.backends if b.base_url not in tried] or self.backends
+        fewest = min(b.outstanding for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding == fewest])
+
+    async def _post(self, path: str, payload: Dict) -> httpx.Response:
+        if self._client is None:
+            raise RuntimeError("LLM client not started")
+
+        tried = set()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                delay = LLM_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(0, delay) + delay / 2)
+
+            backend = self._pick_backend(tried)
+            tried.add(backend.base_url)
+            backend.outstanding += 1
+            start = time.perf_counter()
+            try:
+                async with backend.semaphore:
+                    res = await self._client.post(f"{backend.base_url}{path}", json=payload)
+                backend.requests += 1
+                backend.total_seconds += time.perf_counter() - start
+                if res.status_code in RETRYABLE_STATUS:
+                    backend.failures += 1
+                    last_error = LLMError(f"{backend.base_url} returned {res.status_code}")
+                    continue
+                res.raise_for_status()
+                return res
+            except httpx.TransportError as e:
+                backend.failures += 1
+                last_error = e
+            finally:
+                backend.outstanding -= 1
+
+        raise LLMError(f"LLM request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    async def generate(self, prompt: str, model: str = LLM_MODEL, options: Optional[Dict] = None,
+                       use_cache: bool = True) -> str:
+        """Run a non-streaming /api/generate call and return the response text
+
+        Responses are cached by (model, normalized prompt, options);
+        use_cache=False skips the lookup but still refreshes the entry.
+        """
+        key = cache_key(model, prompt, options)
+        if use_cache:
+            # SQLite disk tier off the event loop
+            cached = llm_cache.get_memory(key)
+            if cached is None:
+                cached = await asyncio.to_thread(llm_cache.get_disk, key)
+            if cached is not None:
+                return cached
+        else:
+            llm_cache.record_bypass()
+
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        if options:
+            payload["options"] = options
+        res = await self._post("/api/generate", payload)
+        text = strip_think(res.json().get("response", ""))
+        if text:
+            await asyncio.to_thread(llm_cache.set, key, text)
+        return text
+
+    async def stream(self, prompt: str, model: str = LLM_MODEL,
+                     options: Optional[Dict] = None, use_cache: bool = True) -> AsyncIterator[str]:
+        """Yield raw response tokens as Ollama emits them (reasoning included)
+
+        Connection failures are retried on another backend only until the
+        first token has been yielded. A cached response is yielded as a
+        single token; completed streams are stored in the cache.
+        """
+        if self._client is None:
+            raise RuntimeError("LLM client not started")
+
+        key = cache_key(model, prompt, options)
+        if use_cache:
+            # SQLite disk tier off the event loop
+            cached = llm_cache.get_memory(key)
+            if cached is None:
+                cached = await asyncio.to_thread(llm_cache.get_disk, key)
+            if cached is not None:
+                yield cached
+                return
+        else:
+            llm_cache.record_bypass()
+
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        if options:
+            payload["options"] = options
+
+        tried = set()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                delay = LLM_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(0, delay) + delay / 2)
+
+            backend = self._pick_backend(tried)
+            tried.add(backend.base_url)
+            backend.outstanding += 1
+            start = time.perf_counter()
+            yielded = False
+            try:
+                async with backend.semaphore:
+                    async with self._client.stream(
+                        "POST", f"{backend.base_url}/api/generate", json=payload
+                    ) as res:
+                        if res.status_code in RETRYABLE_STATUS:
+                            backend.failures += 1
+                            last_error = LLMError(f"{backend.base_url} returned {res.status_code}")
+                            continue
+                        res.raise_for_status()
+
+                        parser = NDJSONParser()
+                        tokens = []
+                        async for chunk in res.aiter_text():
+                            for message in parser.feed(chunk):
+                                if message.get("error"):
+                                    raise LLMError(message["error"])
+                                if message.get("response"):
+                                    yielded = True
+                                    tokens.append(message["response"])
+                                    yield message["response"]
+                        for message in parser.flush():
+                            if message.get("response"):
+                                tokens.append(message["response"])
+                                yield message["response"]
+                backend.requests += 1
+                backend.total_seconds += time.perf_counter() - start
+                text = strip_think("".join(tokens))
+                if text:
+                    await asyncio.to_thread(llm_cache.set, key, text)
+                return
+            except httpx.TransportError as e:
+                backend.failures += 1
+                last_error = e
+                if yielded:
+                    raise LLMError(f"LLM stream interrupted: {e}")
+            finally:
+                backend.outstanding -= 1
+
+        raise LLMError(f"LLM request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def stats(self) -> Dict:
+        return {
+            "model": LLM_MODEL,
+            "retries": self.retries,
+            "backends": [b.to_dict() for b in self.backends],
+            "cache": llm_cache.stats(),
+        }
+
+
+# Shared client used by all LLM calls
+llm_client = LLMClient()
@@ -0,0 +1,178 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from PIL import Image
+
+from app.services.asset_index import AssetIndex, ASSET_NAME, LEGACY_NAME, asset_index
+from app.services.image_cache import ImageCache, IMAGE_CACHE_DIR, request_key, shard_path
+from app.services.image_encoding import FORMATS
+
+# Media serving configuration
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "http://localhost:8000")
+MEDIA_THUMB_DIR = os.getenv("MEDIA_THUMB_DIR", os.path.join(IMAGE_CACHE_DIR, "thumbs"))
+MEDIA_THUMB_CACHE_MB = int(os.getenv("MEDIA_THUMB_CACHE_MB", "256"))
+MEDIA_THUMB_WIDTHS = tuple(sorted(int(w) for w in os.getenv("MEDIA_THUMB_WIDTHS", "128,256,512,1080").split(",")))
+MEDIA_MEMORY_CACHE_MB = int(os.getenv("MEDIA_MEMORY_CACHE_MB", "64"))
+MEDIA_MEMORY_MAX_FILE_KB = int(os.getenv("MEDIA_MEMORY_MAX_FILE_KB", "512"))
+
+# Generated files are named by content or request hash, so a URL never changes meaning
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+ETAG_MEMO_SIZE = 4096
+
+
+def media_url(path: str) -> str:
+    """Public URL of a generated file"""
+    return f"{MEDIA_BASE_URL}/media/{os.path.basename(path)}"
+
+
+def snap_width(width: int) -> int:
+    """Smallest configured thumbnail width >= width, so ?w= can't mint unbounded variants"""
+    for allowed in MEDIA_THUMB_WIDTHS:
+        if allowed >= width:
+            return allowed
+    return MEDIA_THUMB_WIDTHS[-1]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 specifies for this header)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return etag in tags
+
+
+class MediaFile(NamedTuple):
+    path: str
+    etag: str  # strong: quoted prefix of the content's sha256
+    size: int
+    media_type: str
+    data: Optional[bytes]  # set when served from the small-file memory cache
+
+
+class MediaStore:
+    """Generated images for the /media route
+
+    Strong ETags are content hashes, computed once per file version
+    (mtime, size). Small files are kept in an LRU memory cache so hot
+    gallery images skip the disk; ?w= thumbnails are rendered once into a
+    separate size-capped ImageCache directory. Serving a file counts as an
+    access in the asset index (for the retention sweeper).
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, thumbs: Optional[ImageCache] = None,
+                 memory_mb: int = MEDIA_MEMORY_CACHE_MB, max_file_kb: int = MEDIA_MEMORY_MAX_FILE_KB,
+                 index: Optional[AssetIndex] = asset_index):
+        self.directory = directory
+        self.thumbs = thumbs or ImageCache(MEDIA_THUMB_DIR, MEDIA_THUMB_CACHE_MB)
+        self.index = index
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.max_file_bytes = max_file_kb * 1024
+        self._memory: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._etags: "OrderedDict[str, tuple]" = OrderedDict()  # path -> (mtime_ns, size, etag)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "memory_hits": 0, "disk_reads": 0, "thumbnails": 0, "not_found": 0}
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Path for a generated file name, None for anything else (no traversal)"""
+        flat = os.path.join(self.directory, name)
+        if ASSET_NAME.fullmatch(name):
+            # sharded layout; flat is where files lived before the storage manager adopted them
+            candidates = (shard_path(self.directory, name), flat)
+        elif LEGACY_NAME.fullmatch(name):
+            candidates = (flat,)  # pre-hash names are never sharded
+        else:
+            candidates = ()
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+        with self._lock:
+            self.counters["not_found"] += 1
+        return None
+
+    def open(self, path: str) -> MediaFile:
+        """Stat, strong ETag and (for small files) the bytes of a generated file"""
+        st = os.stat(path)
+        version = (path, st.st_mtime_ns, st.st_size)
+        if self.index is not None and not path.startswith(self.thumbs.directory):
+            self.index.touch(os.path.basename(path))
+        with self._lock:
+            self.counters["requests"] += 1
+            memo = self._etags.get(path)
+            etag = memo[2] if memo and memo[:2] == version[1:] else None
+            data = self._memory.get(version)
+            if data is not None:
+                self._memory.move_to_end(version)
+                self.counters["memory_hits"] += 1
+
+        small = st.st_size <= self.max_file_bytes
+        if etag is None or (small and data is None):
+            with open(path, "rb") as f:
+                content = f.read()
+            etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+            with self._lock:
+                self.counters["disk_reads"] += 1
+                self._etags[path] = (st.st_mtime_ns, st.st_size, etag)
+                self._etags.move_to_end(path)
+                while len(self._etags) > ETAG_MEMO_SIZE:
+                    self._etags.popitem(last=False)
+                if small:
+                    data = content
+                    self._remember(version, content)
+
+        ext = path.rsplit(".", 1)[-1].lower()
+        return MediaFile(path, etag, st.st_size, MEDIA_TYPES.get(ext, "application/octet-stream"), data)
+
+    def _remember(self, version: tuple, data: bytes):
+        """Add to the small-file LRU (lock held)"""
+        if version in self._memory:
+            return
+        self._memory[version] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, old = self._memory.popitem(last=False)
+            self._memory_used -= len(old)
+
+    def thumbnail(self, path: str, width: int) -> Optional[str]:
+        """Path of `path` scaled to a snapped width, or None when that wouldn't shrink it"""
+        width = snap_width(width)
+        if self.index is not None:
+            self.index.touch(os.path.basename(path))
+        with Image.open(path) as src:  # header only
+            if width >= src.width:
+                return None
+        st = os.stat(path)
+        # JPEG sources stay JPEG; PNG/WebP become WebP (keeps alpha, far smaller)
+        ext = "jpg" if path.lower().endswith((".jpg", ".jpeg")) else "webp"
+        key = request_key(source=os.path.basename(path), mtime_ns=st.st_mtime_ns, width=width, options=FORMATS[ext])
+
+        def render():
+            with self._lock:
+                self.counters["thumbnails"] += 1
+            with Image.open(path) as src:
+                height = max(1, round(src.height * width / src.width))
+                src.draft("RGB", (width, height))  # JPEG: decode at reduced scale
+                image = src.convert("RGBA" if ext == "webp" and "A" in src.getbands() else "RGB")
+                return image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+
+        return self.thumbs.get_or_create(key, render, ext=ext, **FORMATS[ext])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_files": len(self._memory),
+                "memory_mb": round(self._memory_used / 1024 / 1024, 1),
+                "memory_max_mb": round(self.memory_bytes / 1024 / 1024, 1),
+                "thumb_widths": list(MEDIA_THUMB_WIDTHS),
+                "thumb_cache": self.thumbs.stats(),
+            }
+
+
+media_store = MediaStore()
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+from app.services.pipeline_registry import (
+    SD_MODEL_ID, default_device, default_dtype, get_pipeline, pipeline_registry
+)
+from app.services.background_removal import background_remover
+
+# Warm-up configuration
+WARMUP_ENABLED = os.getenv("AUTOMARK_WARMUP", "true").lower() in ("1", "true", "yes")
+WARMUP_REMBG = os.getenv("AUTOMARK_WARMUP_REMBG", "true").lower() in ("1", "true", "yes")
+
+
+class WarmupState:
+    """Tracks background model loading so readiness can be reported"""
+
+    def __init__(self):
+        self.status = "idle"  # idle, warming, ready, failed
+        self.device: Optional[str] = None
+        self.dtype: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load models in a daemon thread so startup never waits on them"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.status = "warming"
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.device = default_device()
+            self.dtype = default_dtype(self.device)
+            get_pipeline(SD_MODEL_ID, dtype=self.dtype, device=self.device)
+
+            if WARMUP_REMBG:
+                # Creates the persistent ONNX session; falls back quietly if rembg is missing
+                background_remover.warm_up()
+
+            self.status = "ready"
+            print(f"✅ Models warmed up on {self.device} ({self.dtype}) "
+                  f"in {time.time() - self.started_at:.1f}s")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"❌ Model warm-up failed: {e}")
+        finally:
+            self.finished_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        # Without warm-up, models load lazily on first request
+        return self.status == "ready" or (not WARMUP_ENABLED and self.status == "idle")
+
+    def to_dict(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "status": self.status,
+            "warmup_enabled": WARMUP_ENABLED,
+            "device": self.device,
+            "dtype": self.dtype,
+            # False once the warmed pipeline has been evicted for memory; the next request reloads it
+            "pipeline_resident": bool(self.device) and pipeline_registry.is_loaded(
+                SD_MODEL_ID, dtype=self.dtype, device=self.device
+            ),
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+warmup_state = WarmupState()
+
+
+def start_warmup():
+    """Kick off background warm-up if enabled"""
+    if WARMUP_ENABLED:
+        warmup_state.start()
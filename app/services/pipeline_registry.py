@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.services.cpu_profile import apply_cpu_profile
+
+# Stable Diffusion configuration
+SD_MODEL_ID = os.getenv("SD_MODEL_ID", "runwayml/stable-diffusion-v1-5")
+SD_DEVICE = os.getenv("SD_DEVICE", "")  # empty = auto-detect
+SD_DTYPE = os.getenv("SD_DTYPE", "")    # empty = float16 on cuda, float32 otherwise
+PIPELINE_MEMORY_BUDGET_MB = int(os.getenv("PIPELINE_MEMORY_BUDGET_MB", "12288"))
+
+# Pipeline kinds we know how to build, mapped to diffusers class names
+PIPELINE_CLASSES = {
+    "txt2img": "StableDiffusionPipeline",
+    "img2img": "StableDiffusionImg2ImgPipeline",
+}
+
+# Alternative noise schedulers, mapped to diffusers class names
+SCHEDULERS = {
+    "dpmsolver": "DPMSolverMultistepScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+}
+
+
+def default_device() -> str:
+    """Pick the best available torch device (SD_DEVICE overrides)"""
+    if SD_DEVICE:
+        return SD_DEVICE
+
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def default_dtype(device: str) -> str:
+    """Half precision on GPU, full precision everywhere else (SD_DTYPE overrides)"""
+    if SD_DTYPE:
+        return SD_DTYPE
+    return "float16" if device == "cuda" else "float32"
+
+
+def _pipeline_memory_bytes(pipe) -> int:
+    """Sum parameter and buffer sizes of every torch module in the pipeline"""
+    total = 0
+    for component in getattr(pipe, "components", {}).values():
+        for attr in ("parameters", "buffers"):
+            tensors = getattr(component, attr, None)
+            if not callable(tensors):
+                continue
+            try:
+                total += sum(t.numel() * t.element_size() for t in tensors())
+            except Exception:
+                pass
+    return total
+
+
+class _Entry:
+    def __init__(self, pipe, load_seconds: float, memory_bytes: int, profile: Optional[Dict] = None):
+        self.pipe = pipe
+        self.profile = profile  # CPU tuning applied at load, if any
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.hits = 0
+
+
+class PipelineRegistry:
+    """Process-wide cache of diffusion pipelines keyed by (model id, dtype, device)
+
+    Each pipeline is loaded at most once and shared by every caller. When the
+    resident weights exceed the memory budget the least recently used
+    pipelines are evicted (the one just requested is never evicted).
+    """
+
+    def __init__(self, memory_budget_mb: int = PIPELINE_MEMORY_BUDGET_MB):
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._entries: "OrderedDict[Tuple[str, str, str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str, str, str], threading.Lock] = {}
+        # (txt2img key, kind, scheduler) -> pipeline sharing that entry's weights
+        self._views: Dict[Tuple, object] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, model_id: str = SD_MODEL_ID, dtype: Optional[str] = None,
+            device: Optional[str] = None, kind: str = "txt2img", scheduler: Optional[str] = None):
+        """Return a loaded pipeline, loading it on first use
+
+        Other kinds (img2img) and non-default schedulers are built on top of
+        the txt2img pipeline's modules, so they cost no extra weights.
+        """
+        device = device or default_device()
+        dtype = dtype or default_dtype(device)
+        if kind != "txt2img" or scheduler:
+            return self._view(model_id, dtype, device, kind, scheduler)
+        key = (kind, model_id, dtype, device)
+
+        entry = self._touch(key)
+        if entry:
+            return entry.pipe
+
+        # Serialise loads of the same key so concurrent requests share one load
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = self._touch(key)
+            if entry:
+                return entry.pipe
+
+            entry = self._load(kind, model_id, dtype, device)
+            with self._lock:
+                self._entries[key] = entry
+                self.loads += 1
+                self._evict(keep=key)
+            return entry.pipe
+
+    def _view(self, model_id: str, dtype: str, device: str, kind: str, scheduler: Optional[str]):
+        base = self.get(model_id, dtype=dtype, device=device)
+        view_key = (("txt2img", model_id, dtype, device), kind, scheduler)
+        with self._lock:
+            view = self._views.get(view_key)
+        if view is not None:
+            return view
+
+        import diffusers
+
+        if kind not in PIPELINE_CLASSES:
+            raise ValueError(f"Unknown pipeline kind: {kind}")
+        if scheduler and scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler: {scheduler}")
+        components = dict(base.components)
+        if scheduler:
+            scheduler_cls = getattr(diffusers, SCHEDULERS[scheduler])
+            components["scheduler"] = scheduler_cls.from_config(base.scheduler.config)
+        view = getattr(diffusers, PIPELINE_CLASSES[kind])(**components)
+        with self._lock:
+            self._views[view_key] = view
+        return view
+
+    def _touch(self, key) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                entry.last_used = time.time()
+                entry.hits += 1
+            return entry
+
+    def _load(self, kind: str, model_id: str, dtype: str, device: str) -> _Entry:
+        import torch
+        import diffusers
+
+        if kind not in PIPELINE_CLASSES:
+            raise ValueError(f"Unknown pipeline kind: {kind}")
+        pipeline_cls = getattr(diffusers, PIPELINE_CLASSES[kind])
+
+        start = time.perf_counter()
+        pipe = pipeline_cls.from_pretrained(model_id, torch_dtype=getattr(torch, dtype))
+        pipe = pipe.to(device)
+        profile = None
+        if device == "cpu":
+            profile = apply_cpu_profile(pipe)
+        else:
+            pipe.enable_attention_slicing()
+        load_seconds = time.perf_counter() - start
+
+        memory_bytes = _pipeline_memory_bytes(pipe)
+        print(f"✅ Loaded {kind} pipeline {model_id} ({dtype}, {device}) "
+              f"in {load_seconds:.1f}s, {memory_bytes / 1024 / 1024:.0f} MB resident")
+        return _Entry(pipe, load_seconds, memory_bytes, profile)
+
+    def _evict(self, keep):
+        """Drop least recently used pipelines until we fit in the budget (lock held)"""
+        evicted_cuda = False
+        while self._resident_bytes() > self.memory_budget_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                self._entries.move_to_end(key)
+                key = next(iter(self._entries))
+            self._entries.pop(key)
+            self._load_locks.pop(key, None)
+            for view_key in [k for k in self._views if k[0] == key]:
+                del self._views[view_key]
+            self.evictions += 1
+            evicted_cuda = evicted_cuda or key[3] == "cuda"
+            print(f"♻️ Evicted pipeline {key[0]} {key[1]} ({key[2]}, {key[3]})")
+
+        if evicted_cuda:
+            import torch
+            torch.cuda.empty_cache()
+
+    def _resident_bytes(self) -> int:
+        return sum(e.memory_bytes for e in self._entries.values())
+
+    def is_loaded(self, model_id: str = SD_MODEL_ID, dtype: Optional[str] = None,
+                  device: Optional[str] = None, kind: str = "txt2img") -> bool:
+        """Check whether a pipeline is resident without loading it"""
+        device = device or default_device()
+        dtype = dtype or default_dtype(device)
+        with self._lock:
+            return (kind, model_id, dtype, device) in self._entries
+
+    def stats(self) -> Dict:
+        """Load time, memory and usage for every resident pipeline"""
+        with self._lock:
+            pipelines = [
+                {
+                    "kind": kind,
+                    "model_id": model_id,
+                    "dtype": dtype,
+                    "device": device,
+                    "load_seconds": round(e.load_seconds, 3),
+                    "memory_mb": round(e.memory_bytes / 1024 / 1024, 1),
+                    "hits": e.hits,
+                    "loaded_at": e.loaded_at,
+                    "last_used": e.last_used,
+                    "cpu_profile": e.profile,
+                }
+                for (kind, model_id, dtype, device), e in self._entries.items()
+            ]
+            return {
+                "pipelines": pipelines,
+                "resident_mb": round(self._resident_bytes() / 1024 / 1024, 1),
+                "budget_mb": round(self.memory_budget_bytes / 1024 / 1024, 1),
+                "views": [
+                    {"kind": kind, "scheduler": scheduler or "default", "model_id": base[1]}
+                    for base, kind, scheduler in self._views
+                ],
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+# Shared registry used by all endpoints
+pipeline_registry = PipelineRegistry()
+
+
+def get_pipeline(model_id: str = SD_MODEL_ID, dtype: Optional[str] = None,
+                 device: Optional[str] = None, kind: str = "txt2img", scheduler: Optional[str] = None):
+    """Shortcut for pipeline_registry.get"""
+    return pipeline_registry.get(model_id, dtype=dtype, device=device, kind=kind, scheduler=scheduler)
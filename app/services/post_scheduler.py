@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from app.services.instagram_service import InstagramService
+from app.services.graph_client import is_transient, outcome_unknown
+from app.services.instagram_storage import STORAGE_DB, save_instagram_post
+from app.services.connection_cache import get_user_connection, get_access_token
+
+# Scheduler configuration
+SCHEDULER_DB = os.getenv("POST_SCHEDULER_DB", STORAGE_DB)
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("POST_SCHEDULER_MAX_ATTEMPTS", "5"))
+SCHEDULER_RETRY_BASE = float(os.getenv("POST_SCHEDULER_RETRY_BASE", "30"))  # seconds
+SCHEDULER_RETRY_CAP = float(os.getenv("POST_SCHEDULER_RETRY_CAP", "3600"))
+# Upper bound on sleep so rows added by other workers are picked up
+SCHEDULER_MAX_SLEEP = float(os.getenv("POST_SCHEDULER_MAX_SLEEP", "60"))
+# A row stuck in "publishing" this long (worker died) is flagged "unknown": it may
+# have gone out, so it is never re-published automatically
+SCHEDULER_CLAIM_TIMEOUT = float(os.getenv("POST_SCHEDULER_CLAIM_TIMEOUT", "600"))
+
+# "unknown": publishing may or may not have happened; check Instagram, then
+# reschedule (to publish again) or cancel
+STATUSES = ("pending", "publishing", "posted", "failed", "cancelled", "unknown")
+
+
+class ScheduledPostStore:
+    """SQLite table of scheduled posts, indexed by (status, due_at)
+
+    Inserts and the next-due lookup are O(log n) through the index; nothing
+    rewrites the whole queue.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS scheduled_posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        due_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        payload TEXT NOT NULL,
+        post_id TEXT,
+        last_error TEXT,
+        claimed_at REAL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_scheduled_posts_due ON scheduled_posts (status, due_at);
+    CREATE INDEX IF NOT EXISTS idx_scheduled_posts_user ON scheduled_posts (user_id, due_at);
+    """
+
+    def __init__(self, db_path: str = SCHEDULER_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        post = dict(row)
+        post.update(json.loads(post.pop("payload")))
+        post.pop("claimed_at", None)
+        return post
+
+    def add(self, user_id: str, due_at: float, payload: Dict) -> Dict:
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO scheduled_posts (user_id, due_at, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, due_at, json.dumps(payload), now, now),
+        )
+        return self.get(cur.lastrowid)
+
+    def get(self, post_id: int) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM scheduled_posts WHERE id = ?", (post_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, user_id: str, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict]:
+        query, args = "SELECT * FROM scheduled_posts WHERE user_id = ?", [user_id]
+        if status:
+            query += " AND status = ?"
+            args.append(status)
+        query += " ORDER BY due_at LIMIT ? OFFSET ?"
+        rows = self._conn().execute(query, (*args, limit, offset)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def reschedule(self, post_id: int, due_at: float) -> bool:
+        """Move a pending post, or requeue an unknown one after checking it didn't go out"""
+        cur = self._conn().execute(
+            "UPDATE scheduled_posts SET status = 'pending', due_at = ?, updated_at = ? "
+            "WHERE id = ? AND status IN ('pending', 'unknown') AND post_id IS NULL",
+            (due_at, time.time(), post_id),
+        )
+        return cur.rowcount == 1
+
+    def cancel(self, post_id: int) -> bool:
+        cur = self._conn().execute(
+            "UPDATE scheduled_posts SET status = 'cancelled', updated_at = ? "
+            "WHERE id = ? AND status IN ('pending', 'unknown')",
+            (time.time(), post_id),
+        )
+        return cur.rowcount == 1
+
+    def next_due_at(self) -> Optional[float]:
+        row = self._conn().execute(
+            "SELECT MIN(due_at) FROM scheduled_posts WHERE status = 'pending'"
+        ).fetchone()
+        return row[0]
+
+    def claim_due(self, now: float, limit: int = 10) -> List[Dict]:
+        """Atomically move due rows to 'publishing' so only one worker posts each"""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT id FROM scheduled_posts WHERE status = 'pending' AND due_at <= ? ORDER BY due_at LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            cur = conn.execute(
+                "UPDATE scheduled_posts SET status = 'publishing', claimed_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'pending'",
+                (now, now, row["id"]),
+            )
+            if cur.rowcount == 1:
+                claimed.append(self.get(row["id"]))
+        return claimed
+
+    def flag_stale_claims(self, older_than: float) -> int:
+        """Claims older than `older_than` may have published before the worker stopped"""
+        return self._conn().execute(
+            "UPDATE scheduled_posts SET status = 'unknown', last_error = ?, updated_at = ? "
+            "WHERE status = 'publishing' AND claimed_at < ?",
+            ("publishing did not finish; check Instagram before rescheduling", time.time(), older_than),
+        ).rowcount
+
+    def mark_posted(self, post_id: int, ig_post_id: str):
+        self._conn().execute(
+            "UPDATE scheduled_posts SET status = 'posted', post_id = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+            (ig_post_id, time.time(), post_id),
+        )
+
+    def mark_unknown(self, post_id: int, attempts: int, error: str):
+        self._conn().execute(
+            "UPDATE scheduled_posts SET status = 'unknown', attempts = ?, last_error = ?, updated_at = ? "
+            "WHERE id = ? AND post_id IS NULL",
+            (attempts, error, time.time(), post_id),
+        )
+
+    def note_error(self, post_id: int, error: str):
+        """Record a problem without changing the status"""
+        self._conn().execute(
+            "UPDATE scheduled_posts SET last_error = ?, updated_at = ? WHERE id = ?", (error, time.time(), post_id)
+        )
+
+    def mark_failed(self, post_id: int, attempts: int, error: str, retry_at: Optional[float]):
+        """Back to pending at retry_at, or failed for good when retry_at is None
+
+        Only touches rows still being published by us and without a media id,
+        so a post that went out is never queued again.
+        """
+        self._conn().execute(
+            "UPDATE scheduled_posts SET status = ?, attempts = ?, last_error = ?, due_at = COALESCE(?, due_at), "
+            "updated_at = ? WHERE id = ? AND status = 'publishing' AND post_id IS NULL",
+            ("pending" if retry_at else "failed", attempts, error, retry_at, time.time(), post_id),
+        )
+
+    def active_image_urls(self) -> List[str]:
+        """Image URLs of posts that are still to be published"""
+        rows = self._conn().execute(
+            "SELECT payload FROM scheduled_posts WHERE status IN ('pending', 'publishing', 'unknown')"
+        ).fetchall()
+        return [json.loads(row["payload"]).get("image_url") or "" for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM scheduled_posts GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff: base, 2x base, 4x base... capped"""
+    return min(SCHEDULER_RETRY_CAP, SCHEDULER_RETRY_BASE * (2 ** (attempts - 1)))
+
+
+class PostScheduler:
+    """Background worker that publishes scheduled posts when they fall due
+
+    The worker sleeps until the earliest pending due time and is woken early
+    whenever a post is added, rescheduled or cancelled in this process.
+    """
+
+    def __init__(self, store: Optional[ScheduledPostStore] = None):
+        self._store = store
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.retried = 0
+        self.failed = 0
+        self.unknown = 0
+
+    @property
+    def store(self) -> ScheduledPostStore:
+        if self._store is None:
+            self._store = ScheduledPostStore()
+        return self._store
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """Re-check due times now; safe to call from any thread"""
+        if self._loop is not None and self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    # -- API used by the routes --
+
+    def schedule(self, user_id: str, due_at: float, payload: Dict) -> Dict:
+        post = self.store.add(user_id, due_at, payload)
+        self.wake()
+        return post
+
+    def reschedule(self, post_id: int, due_at: float) -> bool:
+        ok = self.store.reschedule(post_id, due_at)
+        self.wake()
+        return ok
+
+    def cancel(self, post_id: int) -> bool:
+        ok = self.store.cancel(post_id)
+        self.wake()
+        return ok
+
+    # -- worker --
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.store.flag_stale_claims, time.time() - SCHEDULER_CLAIM_TIMEOUT)
+                due = await asyncio.to_thread(self.store.claim_due, time.time())
+                for post in due:
+                    await self._publish(post)
+                if due:
+                    continue
+
+                next_due = await asyncio.to_thread(self.store.next_due_at)
+                timeout = SCHEDULER_MAX_SLEEP if next_due is None else min(SCHEDULER_MAX_SLEEP, next_due - time.time())
+                self._wake.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Post scheduler error: {e}")
+                await asyncio.sleep(5)
+
+    async def _publish(self, post: Dict):
+        """Container, then media_publish, then the post history
+
+        Only transient errors are retried. A media_publish that fails without
+        saying whether it went out leaves the row "unknown" instead of
+        pending, and the media id is stored before anything else can fail.
+        """
+        attempts = post["attempts"] + 1
+        try:
+            ig_user_id, access_token, creation_id = await asyncio.to_thread(self._create_container, post)
+        except Exception as e:
+            await self._failed(post, attempts, e)
+            return
+        try:
+            result = await asyncio.to_thread(InstagramService.publish_media, ig_user_id, creation_id, access_token)
+        except Exception as e:
+            if outcome_unknown(e):
+                await asyncio.to_thread(self.store.mark_unknown, post["id"], attempts, f"media_publish: {e}")
+                self.unknown += 1
+                print(f"⚠️ Scheduled post {post['id']} may or may not have been published: {e}")
+            else:
+                await self._failed(post, attempts, e)
+            return
+
+        await asyncio.to_thread(self.store.mark_posted, post["id"], result.get("id"))
+        self.published += 1
+        print(f"✅ Published scheduled post {post['id']} for {post['user_id']}")
+        try:
+            await asyncio.to_thread(self._save_history, post, result)
+        except Exception as e:
+            print(f"⚠️ Scheduled post {post['id']} published but not saved to history: {e}")
+            await asyncio.to_thread(self.store.note_error, post["id"], f"post history save failed: {e}")
+
+    async def _failed(self, post: Dict, attempts: int, error: Exception):
+        retry = is_transient(error) and attempts < SCHEDULER_MAX_ATTEMPTS
+        retry_at = None
+        if retry:
+            retry_at = time.time() + max(retry_delay(attempts), getattr(error, "retry_after", None) or 0)
+        await asyncio.to_thread(self.store.mark_failed, post["id"], attempts, str(error), retry_at)
+        if retry_at:
+            self.retried += 1
+        else:
+            self.failed += 1
+        print(f"❌ Scheduled post {post['id']} failed (attempt {attempts}"
+              f"{', will retry' if retry_at else ''}): {error}")
+
+    @staticmethod
+    def _create_container(post: Dict):
+        """(ig_user_id, access_token, creation_id); safe to repeat, nothing is public yet"""
+        connection = get_user_connection(post["user_id"])
+        if not connection or not connection.get("ig_business_account_id"):
+            raise ValueError("Instagram Business Account not connected")
+        ig_user_id = connection["ig_business_account_id"]
+        access_token = get_access_token(post["user_id"])
+
+        if post["post_type"] == "story":
+            container = InstagramService.create_story_container(ig_user_id, post["image_url"], access_token)
+        else:
+            container = InstagramService.create_media_container(
+                ig_user_id, post["image_url"], post.get("caption") or "", access_token
+            )
+        return ig_user_id, access_token, container.get("id")
+
+    @staticmethod
+    def _save_history(post: Dict, result: Dict):
+        save_instagram_post(post["user_id"], {
+            "post_id": result.get("id"),
+            "image_url": post["image_url"],
+            "caption": post.get("caption"),
+            "post_type": post["post_type"],
+            "posted_at": time.time(),
+            "product_name": post.get("product_name"),
+            "scheduled_post_id": post["id"]
+        })
+
+    def stats(self) -> Dict:
+        return {
+            "published": self.published,
+            "retried": self.retried,
+            "failed": self.failed,
+            "unknown": self.unknown,
+            "next_due_at": self.store.next_due_at(),
+            "queue": self.store.counts(),
+        }
+
+
+post_scheduler = PostScheduler()
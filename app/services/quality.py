@@ -0,0 +1,22 @@
+import os
+
+# Per-request quality / latency tiers
+#   steps, size:       generate_visual_ad (square output)
+#   max_side, bg_steps: process_product_image (canvas cap, background steps)
+#   scheduler:         pipeline_registry.SCHEDULERS name, None = model default
+QUALITY_TIERS = {
+    # quick preview for iterating; refine it later with the same seed
+    "draft": {"steps": 12, "size": 384, "max_side": 512, "bg_steps": 8, "scheduler": "dpmsolver"},
+    # DPM-Solver++ reaches close to full quality in half the steps
+    "standard": {"steps": 25, "size": 512, "max_side": 768, "bg_steps": 15, "scheduler": "dpmsolver"},
+    # the original settings
+    "high": {"steps": 50, "size": 512, "max_side": 1024, "bg_steps": 20, "scheduler": None},
+}
+
+DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "high").strip().lower()
+if DEFAULT_QUALITY not in QUALITY_TIERS:
+    # A typo here would otherwise surface as a KeyError on every request without a quality
+    print(f"⚠️ Unknown DEFAULT_QUALITY '{DEFAULT_QUALITY}' (expected one of {', '.join(QUALITY_TIERS)}); using 'standard'")
+    DEFAULT_QUALITY = "standard"
+# How far img2img may move away from the upscaled draft when refining (0-1)
+REFINE_STRENGTH = float(os.getenv("REFINE_STRENGTH", "0.55"))
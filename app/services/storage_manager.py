@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.services.asset_index import AssetIndex, ASSET_NAME, LEGACY_NAME, asset_index, referenced_names
+from app.services.image_cache import ImageCache, image_cache, shard_path, iter_sharded, IMAGE_CACHE_MAX_MB
+from app.services.instagram_storage import backend as post_storage
+from app.services.post_scheduler import post_scheduler
+
+# Retention configuration
+STORAGE_QUOTA_MB = int(os.getenv("STORAGE_QUOTA_MB", str(IMAGE_CACHE_MAX_MB)))
+STORAGE_QUOTA_TARGET = float(os.getenv("STORAGE_QUOTA_TARGET", "0.9"))  # sweep down to this share of the quota
+STORAGE_MAX_AGE_DAYS = float(os.getenv("STORAGE_MAX_AGE_DAYS", "30"))  # since last access; 0 = keep forever
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "3600"))
+# Over-quota writes wake the sweeper early, but no more often than this
+STORAGE_MIN_SWEEP_GAP = float(os.getenv("STORAGE_MIN_SWEEP_GAP", "60"))
+STORAGE_SWEEP_BATCH = 500
+
+
+class StorageManager:
+    """Sharded layout, metadata index and retention for generated images
+
+    On start, untracked files are indexed (hash-named ones left in the old
+    flat layout are moved into shards first). A background worker then sweeps every STORAGE_SWEEP_INTERVAL
+    (sooner when writes push usage past the quota): assets not accessed for
+    STORAGE_MAX_AGE_DAYS are deleted, then least-recently-used ones until
+    usage is under STORAGE_QUOTA_TARGET x the quota. Assets referenced by
+    saved or scheduled Instagram posts, and the images their renditions
+    were made from, are never deleted.
+    """
+
+    def __init__(self, cache: ImageCache = image_cache, index: AssetIndex = asset_index,
+                 quota_mb: int = STORAGE_QUOTA_MB, max_age_days: float = STORAGE_MAX_AGE_DAYS):
+        self.cache = cache
+        self.index = index
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self.max_age = max_age_days * 86400
+        self._posts_cursor = 0  # instagram_posts row id already scanned for references
+        self._sweep_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.adopted = 0
+        self.sweeps = 0
+        self.deleted = 0
+        self.freed_bytes = 0
+        self.last_sweep: Optional[Dict] = None
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self.index.quota_bytes = self.quota_bytes
+            self.index.on_over_quota = self.wake
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self.index.on_over_quota = None
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """Sweep soon; safe to call from any thread"""
+        if self._loop is not None and self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    async def _run(self):
+        try:
+            adopted = await asyncio.to_thread(self.adopt_untracked)
+            if adopted:
+                print(f"✅ Indexed {adopted} untracked generated images")
+        except Exception as e:
+            print(f"❌ Storage adoption error: {e}")
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Storage sweep error: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), STORAGE_SWEEP_INTERVAL)
+                await asyncio.sleep(STORAGE_MIN_SWEEP_GAP)
+            except asyncio.TimeoutError:
+                pass
+
+    # -- layout --
+
+    def adopt_untracked(self) -> int:
+        """Index files the index doesn't know yet
+
+        Hash-named files in the flat layout are moved into shards (and every
+        shard is indexed if the index is empty). Pre-hash names stay where
+        old links expect them and are only indexed, so retention covers them.
+        """
+        directory = self.cache.directory
+        if not os.path.isdir(directory):
+            return 0
+        flat = [entry for entry in os.scandir(directory) if entry.is_file()]
+        paths = [entry.path for entry in flat if ASSET_NAME.fullmatch(entry.name)]
+        legacy = {entry.name: entry.path for entry in flat
+                  if not ASSET_NAME.fullmatch(entry.name) and LEGACY_NAME.fullmatch(entry.name)}
+        paths.extend(legacy[name] for name in self.index.untracked(legacy))
+        if self.index.count() == 0:
+            paths.extend(iter_sharded(directory))  # index lost or created after the files
+
+        for path in paths:
+            name = os.path.basename(path)
+            st = os.stat(path)
+            target = shard_path(directory, name) if ASSET_NAME.fullmatch(name) else path
+            if path != target:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+            self.index.record(name, st.st_size, created_at=st.st_mtime, accessed_at=st.st_atime)
+        self.adopted += len(paths)
+        return len(paths)
+
+    # -- retention --
+
+    def sync_references(self) -> Dict:
+        """Flag assets used by saved posts (new rows only) and by posts still to be published"""
+        posted = 0
+        for row_id, post in post_storage.iter_posts(after_id=self._posts_cursor):
+            posted += self.index.mark_posted(referenced_names(json.dumps(post, ensure_ascii=False)),
+                                             post.get("posted_at"))
+            self._posts_cursor = max(self._posts_cursor, row_id)
+        scheduled = {name for url in post_scheduler.store.active_image_urls() for name in referenced_names(url)}
+        self.index.set_scheduled(scheduled)
+        return {"newly_posted": posted, "scheduled": len(scheduled)}
+
+    def _delete(self, names: List[str]):
+        for name in names:
+            for path in (shard_path(self.cache.directory, name), os.path.join(self.cache.directory, name)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.cache.forget(name)
+        self.index.delete(names)
+
+    def sweep(self, dry_run: bool = False) -> Dict:
+        """Apply the age and quota policies; with dry_run, only report what would go"""
+        with self._sweep_lock:
+            started = time.perf_counter()
+            references = self.sync_references()
+            removed = {"expired": [0, 0], "quota": [0, 0]}  # files, bytes
+            planned = set()
+
+            def remove(rows: List[Tuple[str, int]], reason: str):
+                if not dry_run:
+                    self._delete([name for name, _ in rows])
+                planned.update(name for name, _ in rows)
+                removed[reason][0] += len(rows)
+                removed[reason][1] += sum(size for _, size in rows)
+
+            if self.max_age:
+                cutoff = time.time() - self.max_age
+                if dry_run:
+                    remove(self.index.expired(cutoff, limit=-1), "expired")
+                else:
+                    while True:
+                        batch = self.index.expired(cutoff, STORAGE_SWEEP_BATCH)
+                        remove(batch, "expired")
+                        if len(batch) < STORAGE_SWEEP_BATCH:
+                            break
+
+            total = self.index.total_bytes() - (removed["expired"][1] if dry_run else 0)
+            target = int(self.quota_bytes * STORAGE_QUOTA_TARGET)
+            if total > self.quota_bytes:
+                while total > target:
+                    batch = self.index.least_recently_used(limit=-1 if dry_run else STORAGE_SWEEP_BATCH)
+                    take = []
+                    for name, size in batch:
+                        if total <= target:
+                            break
+                        if name not in planned:
+                            take.append((name, size))
+                            total -= size
+                    remove(take, "quota")
+                    if dry_run or not take:
+                        break  # everything left is protected
+
+            result = {
+                "at": time.time(),
+                "dry_run": dry_run,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                "references": references,
+                **{reason: {"files": files, "mb": round(size / 1024 / 1024, 1)}
+                   for reason, (files, size) in removed.items()},
+                "size_mb_after": round(total / 1024 / 1024, 1),
+            }
+            if not dry_run:
+                self.sweeps += 1
+                self.deleted += removed["expired"][0] + removed["quota"][0]
+                self.freed_bytes += removed["expired"][1] + removed["quota"][1]
+                self.last_sweep = result
+                if removed["expired"][0] or removed["quota"][0]:
+                    print(f"🧹 Storage sweep removed {removed['expired'][0]} expired and "
+                          f"{removed['quota'][0]} over-quota files")
+            return result
+
+    def usage(self) -> Dict:
+        usage = self.index.usage()
+        return {
+            **usage,
+            "quota_mb": round(self.quota_bytes / 1024 / 1024, 1),
+            "quota_used": round(usage["size_mb"] * 1024 * 1024 / self.quota_bytes, 3) if self.quota_bytes else None,
+            "max_age_days": self.max_age / 86400 or None,
+            "sweep_interval_s": STORAGE_SWEEP_INTERVAL,
+            "adopted": self.adopted,
+            "sweeps": self.sweeps,
+            "deleted": self.deleted,
+            "freed_mb": round(self.freed_bytes / 1024 / 1024, 1),
+            "last_sweep": self.last_sweep,
+        }
+
+
+storage_manager = StorageManager()
@@ -0,0 +1,148 @@
+import os
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Caption overlay configuration
+OVERLAY_FONT = os.getenv("OVERLAY_FONT", "")  # font file or name; empty = first of FONT_CANDIDATES found
+OVERLAY_FONT_RATIO = float(os.getenv("OVERLAY_FONT_RATIO", "0.045"))  # largest font size, x image height
+OVERLAY_MIN_FONT_PX = int(os.getenv("OVERLAY_MIN_FONT_PX", "14"))
+OVERLAY_MAX_HEIGHT_RATIO = float(os.getenv("OVERLAY_MAX_HEIGHT_RATIO", "0.4"))  # text block cap, x image height
+OVERLAY_BAND_ALPHA = int(os.getenv("OVERLAY_BAND_ALPHA", "180"))
+
+# Searched in PIL's font directories (e.g. /usr/share/fonts on Linux)
+FONT_CANDIDATES = ("DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf", "Arial Bold.ttf", "arialbd.ttf", "arial.ttf")
+WORD_CACHE_SIZE = 4096
+TEXT_WIDTH_RATIO = 0.85
+BAND_PADDING = 20  # above and below the text block
+
+
+@lru_cache(maxsize=8)
+def resolve_font(family: str = OVERLAY_FONT) -> str:
+    """Font file to use for `family`, or "" when only PIL's built-in font is available"""
+    for candidate in ((family,) if family else ()) + FONT_CANDIDATES:
+        try:
+            ImageFont.truetype(candidate, size=12)
+            return candidate
+        except OSError:
+            continue
+    print(f"⚠️ No TrueType font found (tried {family or 'defaults'}), using PIL's default font")
+    return ""
+
+
+class Face:
+    """A loaded font at one size, with memoised word widths"""
+
+    def __init__(self, family: str, size: int):
+        path = resolve_font(family)
+        self.size = size
+        self.font = ImageFont.truetype(path, size=size) if path else ImageFont.load_default(size=size)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent + max(2, size // 5)
+        self.space = self.font.getlength(" ")
+        self._widths = {}
+
+    def width(self, word: str) -> float:
+        w = self._widths.get(word)
+        if w is None:
+            if len(self._widths) >= WORD_CACHE_SIZE:
+                self._widths.clear()
+            w = self._widths[word] = self.font.getlength(word)
+        return w
+
+    def wrap(self, words: List[str], max_width: float) -> Tuple[List[str], float]:
+        """Greedy wrap; line widths are summed from cached word widths, not re-measured"""
+        lines, line, line_w, widest = [], [], 0.0, 0.0
+        for word in words:
+            w = self.width(word)
+            candidate = line_w + self.space + w if line else w
+            if candidate <= max_width or not line:
+                line.append(word)
+                line_w = candidate
+            else:
+                lines.append(" ".join(line))
+                widest = max(widest, line_w)
+                line, line_w = [word], w
+        if line:
+            lines.append(" ".join(line))
+            widest = max(widest, line_w)
+        return lines, widest
+
+
+@lru_cache(maxsize=64)
+def get_face(family: str, size: int) -> Face:
+    """Fonts are loaded once per (family, size)"""
+    return Face(family, size)
+
+
+class Layout(NamedTuple):
+    size: int
+    lines: Tuple[str, ...]
+    line_height: int
+
+
+@lru_cache(maxsize=256)
+def layout_text(text: str, width: int, height: int, family: str = OVERLAY_FONT) -> Layout:
+    """Largest font size (up to OVERLAY_FONT_RATIO x height) whose wrapped text fits the block
+
+    Binary search over sizes; each probe is one wrap pass over cached word widths.
+    """
+    words = text.split()
+    max_width = width * TEXT_WIDTH_RATIO
+    max_block = height * OVERLAY_MAX_HEIGHT_RATIO
+    max_size = max(OVERLAY_MIN_FONT_PX, int(height * OVERLAY_FONT_RATIO))
+
+    def attempt(size):
+        face = get_face(family, size)
+        lines, widest = face.wrap(words, max_width)
+        return face, lines, widest <= max_width and len(lines) * face.line_height <= max_block
+
+    face, lines, fits = attempt(max_size)  # short captions: one probe
+    if not fits:
+        # if nothing fits, render at the minimum size and let the band grow
+        face, lines, _ = attempt(OVERLAY_MIN_FONT_PX)
+        lo, hi = OVERLAY_MIN_FONT_PX + 1, max_size - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            mid_face, mid_lines, mid_fits = attempt(mid)
+            if mid_fits:
+                face, lines = mid_face, mid_lines
+                lo = mid + 1
+            else:
+                hi = mid - 1
+    return Layout(face.size, tuple(lines), face.line_height)
+
+
+def overlay_text(image: Image.Image, text: str, family: str = OVERLAY_FONT) -> Image.Image:
+    """Copy of image with `text` centred on a semi-transparent band along the bottom
+
+    The band and text are drawn on an RGBA layer covering just the band and
+    alpha-composited onto that strip, so the band really is translucent on
+    RGB images.
+    """
+    if not text.split():
+        return image.copy()
+    width, height = image.size
+    layout = layout_text(text, width, height, family)
+    font = get_face(family, layout.size).font
+
+    band_h = min(height, len(layout.lines) * layout.line_height + 2 * BAND_PADDING)
+    top = height - band_h
+    layer = Image.new("RGBA", (width, band_h), (0, 0, 0, OVERLAY_BAND_ALPHA))
+    draw = ImageDraw.Draw(layer)
+    y = BAND_PADDING
+    for line in layout.lines:
+        x = (width - font.getlength(line)) / 2
+        draw.text((x, y), line, font=font, fill=(255, 255, 255, 255))
+        y += layout.line_height
+
+    strip = Image.alpha_composite(image.crop((0, top, width, height)).convert("RGBA"), layer)
+    result = image.copy()
+    result.paste(strip.convert(image.mode) if image.mode != "RGBA" else strip, (0, top))
+    return result
+
+
+def cache_info():
+    """lru_cache statistics for fonts and caption layouts"""
+    return {"fonts": get_face.cache_info()._asdict(), "layouts": layout_text.cache_info()._asdict()}
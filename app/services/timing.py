@@ -0,0 +1,66 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageStats:
+    """Running count / total / max per (operation, stage), for stats endpoints"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, stages: Dict[str, float]):
+        with self._lock:
+            op = self._stats.setdefault(operation, {})
+            for stage, ms in stages.items():
+                s = op.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+                s["count"] += 1
+                s["total_ms"] += ms
+                s["max_ms"] = max(s["max_ms"], ms)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                operation: {
+                    stage: {
+                        "count": s["count"],
+                        "avg_ms": round(s["total_ms"] / s["count"], 1),
+                        "max_ms": round(s["max_ms"], 1),
+                    }
+                    for stage, s in stages.items()
+                }
+                for operation, stages in self._stats.items()
+            }
+
+
+stage_stats = StageStats()
+
+
+class StageTimer:
+    """Wall-clock timings for the stages of one operation
+
+    Stages may overlap (concurrent work timed separately); "total" is the
+    elapsed time from creation to finish().
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def finish(self) -> Dict[str, float]:
+        """Record into stage_stats, log one line and return the timings in ms"""
+        timings = {**self.stages, "total": (time.perf_counter() - self._start) * 1000}
+        stage_stats.record(self.operation, timings)
+        print(f"⏱️ {self.operation}: " + ", ".join(f"{k}={v:.0f}ms" for k, v in timings.items()))
+        return timings
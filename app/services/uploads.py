@@ -0,0 +1,177 @@
+import io
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+# Upload limits
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024)
+UPLOAD_MAX_PIXELS = int(float(os.getenv("UPLOAD_MAX_MEGAPIXELS", "50")) * 1_000_000)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # EXIF orientations that swap width and height
+# ImageOps.exif_transpose per orientation, applied by hand because reduce() drops the EXIF
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+REDUCE_MODES = ("L", "LA", "I", "F", "RGB", "RGBA", "RGBa", "CMYK", "PA")
+
+
+class UploadRejected(ValueError):
+    """Upload refused before decoding; status_code is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def read_upload(upload, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    """Read an UploadFile in chunks, stopping as soon as it exceeds max_bytes"""
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadRejected(f"Upload is larger than {max_bytes // (1024 * 1024)} MB", 413)
+
+    await upload.seek(0)
+    chunks, total = [], 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadRejected(f"Upload is larger than {max_bytes // (1024 * 1024)} MB", 413)
+        chunks.append(chunk)
+    if not total:
+        raise UploadRejected("Uploaded file is empty")
+    return b"".join(chunks)
+
+
+def probe_image(data: bytes, max_pixels: int = UPLOAD_MAX_PIXELS) -> Tuple[str, Tuple[int, int]]:
+    """Format and size from the image header alone; rejects huge or unreadable images"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:  # lazy: parses the header only
+            fmt, size = image.format, image.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise UploadRejected(f"Not a supported image: {e}", 415)
+    if size[0] * size[1] > max_pixels:
+        raise UploadRejected(
+            f"Image is {size[0]}x{size[1]}; at most {max_pixels / 1_000_000:.0f} megapixels allowed", 413
+        )
+    return fmt, size
+
+
+def _div8(x: int) -> int:
+    # round up to a multiple of 8 (diffusers requirement)
+    return x if x % 8 == 0 else x + (8 - x % 8)
+
+
+def decode_product_image(data: bytes, max_side: int,
+                         max_pixels: int = UPLOAD_MAX_PIXELS) -> Tuple[Image.Image, Dict]:
+    """Decode an upload straight to the working size (RGBA, sides divisible by 8)
+
+    JPEGs are decoded with draft(), so libjpeg scales by 1/2, 1/4 or 1/8
+    while decoding and the full-resolution bitmap never exists; other
+    formats are shrunk with reduce() before anything else copies the
+    bitmap. EXIF orientation is applied, so the target size is computed on
+    the image as it should be displayed.
+    """
+    probe_image(data, max_pixels)
+    with Image.open(io.BytesIO(data)) as image:
+        original = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        rotated = orientation in ROTATED_ORIENTATIONS
+        w0, h0 = (original[1], original[0]) if rotated else original
+
+        scale = min(1.0, max_side / max(w0, h0))
+        new_w = _div8(max(8, int(w0 * scale)))
+        new_h = _div8(max(8, int(h0 * scale)))
+
+        # draft() and reduce() work on the stored (unrotated) orientation
+        stored_target = (new_h, new_w) if rotated else (new_w, new_h)
+        if image.format == "JPEG":
+            image.draft("RGB", stored_target)
+        image.load()
+        decoded = image.size
+        decoded_bytes = decoded[0] * decoded[1] * len(image.getbands())
+
+        # Shrink by an integer factor (keeping >= 2x the target for the final
+        # resample) before anything copies the full-resolution bitmap
+        factor = int(min(decoded[0] / stored_target[0], decoded[1] / stored_target[1]) / 2)
+        if factor > 1:
+            if image.mode not in REDUCE_MODES:
+                image = image.convert("RGBA")  # P / 1 / I;16 can't be reduced directly
+            image = image.reduce(factor)
+        if orientation in ORIENTATION_TRANSPOSE:
+            image = image.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+        product = image.convert("RGBA").resize((new_w, new_h), Image.LANCZOS, reducing_gap=2.0)
+
+    return product, {
+        "original_size": original,
+        "decoded_size": decoded,
+        "output_size": (new_w, new_h),
+        "orientation": orientation,
+        "decoded_mb": round(decoded_bytes / 1024 / 1024, 2),
+    }
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux), None elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class UploadStats:
+    """Accepted/rejected uploads and memory used per request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected: Dict[int, int] = {}
+        self._upload_bytes = []
+        self._decoded_mb = []
+        self._rss_delta_mb = []
+
+    def record(self, upload_bytes: int, info: Dict, rss_delta: Optional[int]):
+        with self._lock:
+            self.accepted += 1
+            self._upload_bytes = (self._upload_bytes + [upload_bytes])[-200:]
+            self._decoded_mb = (self._decoded_mb + [info["decoded_mb"]])[-200:]
+            if rss_delta is not None:
+                self._rss_delta_mb = (self._rss_delta_mb + [rss_delta / 1024 / 1024])[-200:]
+
+    def record_rejection(self, status_code: int):
+        with self._lock:
+            self.rejected[status_code] = self.rejected.get(status_code, 0) + 1
+
+    def stats(self) -> Dict:
+        def avg(values):
+            return round(sum(values) / len(values), 2) if values else None
+
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "rejected": {str(k): v for k, v in self.rejected.items()},
+                "max_upload_mb": round(UPLOAD_MAX_BYTES / 1024 / 1024, 1),
+                "max_megapixels": UPLOAD_MAX_PIXELS / 1_000_000,
+                "avg_upload_mb": avg([b / 1024 / 1024 for b in self._upload_bytes]),
+                # largest bitmap each request decoded (the old path decoded full resolution)
+                "avg_decoded_mb": avg(self._decoded_mb),
+                "max_decoded_mb": max(self._decoded_mb, default=None),
+                # process-wide, so concurrent requests blur it; still shows spikes
+                "avg_rss_delta_mb": avg(self._rss_delta_mb),
+                "max_rss_delta_mb": round(max(self._rss_delta_mb), 2) if self._rss_delta_mb else None,
+            }
+
+
+upload_stats = UploadStats()
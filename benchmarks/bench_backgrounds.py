@@ -0,0 +1,65 @@
+"""Compare the old putpixel studio background with app.services.backgrounds
+
+Run from the repo root:  python -m benchmarks.bench_backgrounds [size ...]
+"""
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from app.services.backgrounds import PRESETS, make_background, cache_info
+
+
+def legacy_studio_background(size):
+    """The per-pixel fallback previously inlined in process_product_image"""
+    w, h = size
+    top = Image.new("RGB", (w, h), "#ffffff")
+    bottom = Image.new("RGB", (w, h), "#e9eef2")
+    mask = Image.new("L", (w, h))
+    for y in range(h):
+        val = int(255 * (y / h))
+        for x in range(w):
+            mask.putpixel((x, y), val)
+    grad = Image.composite(top, bottom, mask)
+    grad = grad.filter(ImageFilter.GaussianBlur(radius=6))
+    vign = Image.new("L", (w, h), 0)
+    for y in range(h):
+        for x in range(w):
+            dx = (x - w / 2) / (w / 2)
+            dy = (y - h / 2) / (h / 2)
+            d = (dx * dx + dy * dy) ** 0.5
+            vign.putpixel((x, y), int(255 * max(0, 1 - d * 0.8)))
+    vign = vign.filter(ImageFilter.GaussianBlur(radius=20))
+    return Image.composite(grad, Image.new("RGB", (w, h), "#ffffff"), vign)
+
+
+def timed(fn, *args, repeat=1, **kwargs):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes):
+    for side in sizes:
+        size = (side, side)
+        legacy_s, legacy_img = timed(legacy_studio_background, size)
+        cold_s, new_img = timed(make_background, size, "studio")
+        warm_s, _ = timed(make_background, size, "studio", repeat=5)
+        diff = ImageStat.Stat(ImageChops.difference(legacy_img, new_img)).mean
+        print(f"{side}x{side} studio: legacy {legacy_s * 1000:8.1f} ms | "
+              f"new {cold_s * 1000:6.2f} ms ({legacy_s / cold_s:,.0f}x) | "
+              f"cached {warm_s * 1000:5.2f} ms | mean abs diff {max(diff):.2f}/255")
+
+        for preset in PRESETS:
+            if preset == "studio":
+                continue
+            t, _ = timed(make_background, (side + 8, side), preset)
+            print(f"    {preset:<9} {t * 1000:6.2f} ms")
+    print("cache:", cache_info())
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [512, 1024])
@@ -0,0 +1,94 @@
+"""Seconds per image and peak RSS of Stable Diffusion on CPU, per inference profile
+
+Run from the repo root:
+    python -m benchmarks.bench_cpu_inference [--steps 20] [--size 512] [--images 3] [config ...]
+
+Each configuration runs in its own subprocess (so peak RSS is per config)
+with the SD_CPU_* environment variables below; the model is loaded through
+the pipeline registry exactly as the API loads it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+CONFIGS = {
+    "baseline": {"SD_CPU_CHANNELS_LAST": "false", "SD_CPU_BF16": "false", "SD_CPU_COMPILE": "false",
+                 "SD_CPU_SLICING_BELOW_GB": "1e9"},  # the old behaviour: fp32, slicing always on
+    "channels_last": {"SD_CPU_CHANNELS_LAST": "true", "SD_CPU_BF16": "false", "SD_CPU_COMPILE": "false"},
+    "bf16": {"SD_CPU_CHANNELS_LAST": "true", "SD_CPU_BF16": "true", "SD_CPU_COMPILE": "false"},
+    "compile": {"SD_CPU_CHANNELS_LAST": "true", "SD_CPU_BF16": "false", "SD_CPU_COMPILE": "true"},
+    "bf16_compile": {"SD_CPU_CHANNELS_LAST": "true", "SD_CPU_BF16": "true", "SD_CPU_COMPILE": "true"},
+}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_one(steps: int, size: int, images: int) -> dict:
+    """Child process: load, warm up, then time `images` generations"""
+    import torch
+
+    from app.services.pipeline_registry import pipeline_registry
+    from app.services.cpu_profile import cpu_inference_context
+
+    start = time.perf_counter()
+    pipe = pipeline_registry.get(device="cpu", dtype="float32")
+    load_s = time.perf_counter() - start
+    prompt = "Advertising background for product: ceramic mug. soft studio lighting, minimal, professional"
+
+    timings = []
+    for i in range(images + 1):  # first run is warm-up
+        generator = torch.Generator(device="cpu").manual_seed(i)
+        start = time.perf_counter()
+        with cpu_inference_context(pipe):
+            pipe(prompt, height=size, width=size, num_inference_steps=steps, generator=generator)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "load_s": round(load_s, 1),
+        "first_image_s": round(timings[0], 2),
+        "s_per_image": round(sum(timings[1:]) / images, 2),
+        "peak_rss_mb": round(peak_rss_mb()),
+        "profile": pipeline_registry.stats()["pipelines"][0]["cpu_profile"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("configs", nargs="*", default=list(CONFIGS), help=f"any of {', '.join(CONFIGS)}")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--images", type=int, default=3, help="timed images after one warm-up image")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_one(args.steps, args.size, args.images)))
+        return
+
+    print(f"{args.steps} steps, {args.size}x{args.size}, {args.images} images after warm-up\n")
+    print(f"{'config':<15}{'load s':>8}{'1st img s':>11}{'s/image':>9}{'peak RSS MB':>13}")
+    baseline = None
+    for name in args.configs:
+        env = {**os.environ, **CONFIGS[name], "SD_DEVICE": "cpu", "AUTOMARK_WARMUP": "false"}
+        cmd = [sys.executable, "-m", "benchmarks.bench_cpu_inference", "--child",
+               "--steps", str(args.steps), "--size", str(args.size), "--images", str(args.images)]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{name:<15}failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        baseline = baseline or result["s_per_image"]  # speed-up is relative to the first config
+        print(f"{name:<15}{result['load_s']:>8}{result['first_image_s']:>11}{result['s_per_image']:>9}"
+              f"{result['peak_rss_mb']:>13}   x{baseline / result['s_per_image']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
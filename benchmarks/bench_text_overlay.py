@@ -0,0 +1,81 @@
+"""Compare the old inline overlay_text with app.services.text_overlay on long captions
+
+Run from the repo root:  python -m benchmarks.bench_text_overlay [words ...]
+"""
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.text_overlay import overlay_text, layout_text, cache_info
+
+SIDE = 1024
+VOCABULARY = ("Handcrafted ceramic mug with a glossy glaze that keeps your morning coffee hot, "
+              "dishwasher safe, microwave friendly and designed for everyday comfort. Order today!").split()
+
+
+def legacy_overlay_text(image, text):
+    """The implementation previously in main.py (textbbox per growing line)"""
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+    base_font_size = int(height * 0.045)
+    try:
+        font = ImageFont.truetype("arial.ttf", size=base_font_size)
+    except OSError:
+        font = ImageFont.load_default()
+    max_width = width * 0.85
+    lines, line = [], ""
+    for w in text.split():
+        test_line = (line + " " + w).strip()
+        if draw.textbbox((0, 0), test_line, font=font)[2] <= max_width:
+            line = test_line
+        else:
+            lines.append(line)
+            line = w
+    lines.append(line)
+    line_height = draw.textbbox((0, 0), "A", font=font)[3] + 10
+    rect_y0 = height - len(lines) * line_height - 40
+    draw.rectangle([(0, rect_y0), (width, height)], fill=(0, 0, 0, 180))
+    y = rect_y0 + 20
+    for l in lines:
+        x = (width - draw.textbbox((0, 0), l, font=font)[2]) // 2
+        draw.text((x, y), l, font=font, fill="white")
+        y += line_height
+    return image
+
+
+def caption(words):
+    return " ".join(VOCABULARY[i % len(VOCABULARY)] for i in range(words))
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(word_counts):
+    base = Image.new("RGB", (SIDE, SIDE), (40, 120, 200))
+    print(f"{SIDE}x{SIDE} RGB, best of 5\n")
+    print(f"{'words':>6}{'legacy ms':>11}{'cold ms':>9}{'warm ms':>9}{'font px':>9}{'lines':>7}"
+          f"{'legacy band':>15}{'new band':>15}")
+    for words in word_counts:
+        text = caption(words)
+        legacy_s = timed(lambda: legacy_overlay_text(base.copy(), text))
+        # cold: layout (wrap + size search) recomputed each call; warm: layout cached
+        cold_s = timed(lambda: (layout_text.cache_clear(), overlay_text(base, text)))
+        warm_s = timed(lambda: overlay_text(base, text))
+        layout = layout_text(text, SIDE, SIDE)
+        # a band pixel left of the text: base (40,120,200) under black at alpha 180 -> ~(12,35,59)
+        legacy_band = legacy_overlay_text(base.copy(), text).getpixel((2, SIDE - 3))
+        band = overlay_text(base, text).getpixel((2, SIDE - 3))
+        print(f"{words:>6}{legacy_s * 1000:>11.2f}{cold_s * 1000:>9.2f}{warm_s * 1000:>9.2f}"
+              f"{layout.size:>9}{len(layout.lines):>7}{str(legacy_band):>15}{str(band):>15}")
+    print("\ncache:", cache_info())
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [12, 40, 120, 300])
@@ -1,28 +1,64 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
-import requests
+from typing import Callable, Dict, List, Optional
 import json
-import torch
-from diffusers import StableDiffusionImg2ImgPipeline
-from diffusers import StableDiffusionPipeline
 import base64
-import io
-from PIL import Image, ImageDraw, ImageFont
+import hashlib
+from PIL import Image
 import time
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi import UploadFile, File, Form
-from PIL import Image, ImageFilter
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# torch / diffusers / rembg are imported lazily by these services
+from app.services.pipeline_registry import pipeline_registry
+from app.services.batch_scheduler import batch_scheduler
+from app.services.prompt_embeddings import prompt_embedding_cache
+from app.services.backgrounds import make_background, PRESETS as BACKGROUND_PRESETS
+from app.services.text_overlay import overlay_text
+from app.services.background_removal import background_remover
+from app.services.image_cache import image_cache, request_key, seed_from_key
+from app.services.image_encoding import build_renditions, encoding_stats
+from app.services.media import media_store, media_url, etag_matches, CACHE_CONTROL
+from app.services.asset_index import asset_index, ASSET_NAME
+from app.services.storage_manager import storage_manager
+from app.services.pipeline_registry import SD_MODEL_ID
+from app.services.model_warmup import warmup_state, start_warmup
+from app.services.job_queue import job_queue, JobCancelled, QueueFull, TERMINAL_STATES
+from app.services.llm_client import llm_client, ThinkStripper
+from app.services.post_scheduler import post_scheduler, STATUSES as SCHEDULED_STATUSES
+from app.services.timing import StageTimer, stage_stats
+from app.services.quality import QUALITY_TIERS, DEFAULT_QUALITY, REFINE_STRENGTH
+from app.services.ad_variants import generate_ad_variants, VARIANT_MAX_TEXTS, VARIANT_MAX_SEEDS
+from app.services.uploads import (
+    read_upload, probe_image, decode_product_image, current_rss_bytes, upload_stats, UploadRejected
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load in the background; /ready reports when they are resident
+    start_warmup()
+    await llm_client.start()
+    await job_queue.start()
+    await post_scheduler.start()
+    await storage_manager.start()
+    yield
+    await storage_manager.stop()
+    await post_scheduler.stop()
+    await job_queue.stop()
+    await llm_client.close()
 
 
-app = FastAPI(title="AutoMark - DeepSeek + Stable Diffusion Ad Generator")
+app = FastAPI(title="AutoMark - DeepSeek + Stable Diffusion Ad Generator", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,250 +72,251 @@ app.add_middleware(
 class TextAdRequest(BaseModel):
     product_name: str
     description: str
+    no_cache: bool = False  # skip the LLM and image caches for this request
+    seed: Optional[int] = None  # diffusion seed; derived from the request when omitted
+    quality: str = DEFAULT_QUALITY  # "draft", "standard" or "high"
+    user_id: Optional[str] = None  # recorded as the owner of the generated files
+
+class RefineRequest(BaseModel):
+    product_name: str
+    description: str
+    ad_text: str  # from the draft response
+    seed: int  # from the draft response
+    quality: str = "high"
+    no_cache: bool = False
+    user_id: Optional[str] = None
       
-class VisualAdRequest(BaseModel):
+class AdVariantsRequest(BaseModel):
     product_name: str
     description: str
-    ad_text: str
+    variants: int = 3  # N ad texts
+    seeds: Optional[List[int]] = None  # M seeds; derived from the product when omitted
+    num_seeds: int = 2  # M when seeds is not given
+    quality: str = DEFAULT_QUALITY
+    no_cache: bool = False
+    user_id: Optional[str] = None
 
-def overlay_text(image: Image.Image, text: str) -> Image.Image:
-    draw = ImageDraw.Draw(image)
-    width, height = image.size
+# ---- DeepSeek Ad Generation ----
+def build_ad_prompt(product_name: str, description: str) -> str:
+    return (f"Write a catchy, one line marketing ad for '{product_name}'. "
+            f"Product details: {description}")
 
-    # Dynamic font sizing
-    base_font_size = int(height * 0.045)  
-    try:
-        font = ImageFont.truetype("arial.ttf", size=base_font_size)
-    except:
-        font = ImageFont.load_default()
-
-    # Text wrapping
-    max_width = width * 0.85
-    words = text.split()
-    lines = []
-    line = ""
-
-    for w in words:
-        test_line = (line + " " + w).strip()
-        test_width = draw.textbbox((0, 0), test_line, font=font)[2]
-
-        if test_width <= max_width:
-            line = test_line
-        else:
-            lines.append(line)
-            line = w
 
-    lines.append(line)
+async def generate_ad_with_deepseek(product_name: str, description: str, use_cache: bool = True):
+    try:
+        prompt = build_ad_prompt(product_name, description)
 
-    # Line height + padding
-    line_height = draw.textbbox((0, 0), "A", font=font)[3] + 10
-    total_text_height = len(lines) * line_height
+        # Pooled, load-balanced, cached Ollama client (see app/services/llm_client.py)
+        response = await llm_client.generate(prompt, use_cache=use_cache)
+        return response or "No response generated"
 
-    # Add bigger rectangle for safer padding
-    padding = 40
-    rect_y0 = height - total_text_height - padding
-    rect_y1 = height
+    except Exception as e:
+        print("❌ Error generating ad:", e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-    # Semi-transparent rectangle
-    draw.rectangle(
-        [(0, rect_y0), (width, rect_y1)],
-        fill=(0, 0, 0, 180)
-    )
 
-    # Draw text with top padding
-    y = rect_y0 + 20
-    for l in lines:
-        line_width = draw.textbbox((0, 0), l, font=font)[2]
-        x = (width - line_width) // 2
-        draw.text((x, y), l, font=font, fill="white")
-        y += line_height
+# ---- Stable Diffusion Image Generation ----
+VISUAL_AD_GUIDANCE = 7.5  # diffusers default
 
-    return image
 
+def _check_quality(quality: str, allowed=QUALITY_TIERS):
+    if quality not in allowed:
+        raise HTTPException(status_code=400, detail=f"Unknown quality '{quality}'. Choose one of: {', '.join(allowed)}")
 
-# ---- DeepSeek Ad Generation ----
-def generate_ad_with_deepseek(product_name: str, description: str):
-    try:
-        payload = {
-            "model": "deepseek-r1:7b",
-            "prompt": f"Write a catchy, one line marketing ad for '{product_name}'. "
-                      f"Product details: {description}",
-            "stream": False
-        }
 
-        res = requests.post("http://127.0.0.1:11434/api/generate", json=payload)
-        res.raise_for_status()
+def visual_ad_spec(product_name: str, description: str, ad_text: str, seed: Optional[int] = None,
+                   quality: str = DEFAULT_QUALITY) -> Dict:
+    """Prompt, render settings, cache keys and resolved seed for one visual ad"""
+    tier = QUALITY_TIERS[quality]
+    prompt = (
+        f"A modern, realistic, professional marketing banner for {product_name}. "
+        f"Theme: {description}. Include readable overlay text: '{ad_text}'. "
+        f"Bright lighting, high quality, commercial photography."
+    )
+    params = dict(model_id=SD_MODEL_ID, prompt=prompt, size=tier["size"], steps=tier["steps"],
+                  guidance=VISUAL_AD_GUIDANCE)
+    if tier["scheduler"]:
+        params["scheduler"] = tier["scheduler"]
+
+    # Identical requests share one file (and one render, if concurrent)
+    key = request_key(**params, seed=seed, overlay_text=ad_text)
+    if seed is None:
+        seed = seed_from_key(key)
+    return {**tier, "quality": quality, "prompt": prompt, "seed": seed, "key": key,
+            "raw_key": request_key(**params, seed=seed, raw=True)}
+
+
+def _render_visual_base(spec: Dict, progress: Optional[Callable] = None, use_cache: bool = True) -> Image.Image:
+    """Diffusion output for a spec, before the text overlay"""
+    def render():
+        # Micro-batched with concurrent requests on the shared pipeline
+        return batch_scheduler.generate(
+            spec["prompt"],
+            height=spec["size"],
+            width=spec["size"],
+            num_inference_steps=spec["steps"],
+            guidance_scale=VISUAL_AD_GUIDANCE,
+            seed=spec["seed"],
+            scheduler=spec["scheduler"],
+            progress=progress
+        )
 
-        text = res.text.strip()
-        if text.count('\n') > 0:
-            text = text.split('\n')[-1]
+    if spec["quality"] != "draft":
+        return render()
+    # Drafts keep their raw render so a later refine can start from it
+    path = image_cache.get_or_create(spec["raw_key"], render, ext="png", use_cache=use_cache)
+    with Image.open(path) as image:
+        return image.convert("RGB")
 
-        result = json.loads(text)
-        return result.get("response", "No response generated")
 
-    except Exception as e:
-        print("❌ Error generating ad:", e)
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-# ---- Stable Diffusion Image Generation ----
-def generate_visual_ad(product_name: str, description: str, ad_text: str):
+def generate_visual_ad(product_name: str, description: str, ad_text: str,
+                       progress: Optional[Callable] = None, seed: Optional[int] = None,
+                       use_cache: bool = True, quality: str = DEFAULT_QUALITY):
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        spec = visual_ad_spec(product_name, description, ad_text, seed, quality)
 
-        # Load model (cached after first load)
-        model_id = "runwayml/stable-diffusion-v1-5"
-        pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float16 if device == "cuda" else torch.float32)
-        pipe = pipe.to(device)
+        def render():
+            # Overlay ad text
+            return overlay_text(_render_visual_base(spec, progress, use_cache), ad_text)
 
-        prompt = (
-            f"A modern, realistic, professional marketing banner for {product_name}. "
-            f"Theme: {description}. Include readable overlay text: '{ad_text}'. "
-            f"Bright lighting, high quality, commercial photography."
-        )
+        return image_cache.get_or_create(spec["key"], render, ext="png", use_cache=use_cache)
 
-        image = pipe(prompt).images[0]
-        # Overlay ad text
-        image = overlay_text(image, ad_text)
+    except Exception as e:
+        print("❌ Error generating image:", e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        
-        os.makedirs("generated_ads", exist_ok=True)
 
-        filename = f"{product_name.lower().replace(' ','_')}_{int(time.time())}.png"
+def refine_visual_ad(product_name: str, description: str, ad_text: str, seed: int,
+                     quality: str = "high", progress: Optional[Callable] = None, use_cache: bool = True):
+    """Full-quality version of a draft: img2img from the upscaled draft with the same seed
 
-        save_path = f"generated_ads/{filename}"
-        image.save(save_path)
+    The draft's raw render is reused from the image cache (re-rendered
+    deterministically if it was evicted), so the composition is kept.
+    """
+    try:
+        draft = visual_ad_spec(product_name, description, ad_text, seed, "draft")
+        target = visual_ad_spec(product_name, description, ad_text, seed, quality)
+        key = request_key(refined_from=draft["raw_key"], target=target["key"], strength=REFINE_STRENGTH)
+
+        def render():
+            base = _render_visual_base(draft, use_cache=use_cache)
+            base = base.resize((target["size"], target["size"]), Image.LANCZOS)
+            image = batch_scheduler.generate(
+                target["prompt"],
+                image=base,
+                strength=REFINE_STRENGTH,
+                num_inference_steps=target["steps"],
+                guidance_scale=VISUAL_AD_GUIDANCE,
+                seed=seed,
+                scheduler=target["scheduler"],
+                progress=progress
+            )
+            return overlay_text(image, ad_text)
 
-        return save_path
+        return image_cache.get_or_create(key, render, ext="png", use_cache=use_cache)
 
     except Exception as e:
-        print("❌ Error generating image:", e)
+        print("❌ Error refining image:", e)
         raise HTTPException(status_code=500, detail=str(e))
     
 # ---- Serve generated images ----
-app.mount("/generated_ads", StaticFiles(directory="generated_ads"), name="generated_ads")
-
-from diffusers import StableDiffusionPipeline
-import torch
-
-# load pipeline globally
-txt2img_pipe = StableDiffusionPipeline.from_pretrained(
-    "runwayml/stable-diffusion-v1-5",  # or another SD model
-    torch_dtype=torch.float16,          # optional, reduces memory
-)
-txt2img_pipe = txt2img_pipe.to("cuda")  # or "cpu" if no GPU
-txt2img_pipe.enable_attention_slicing()  # optional for low VRAM
+@app.api_route("/generated_ads/{name}", methods=["GET", "HEAD"])
+async def legacy_generated_ad(name: str, request: Request, w: Optional[int] = None):
+    """Old URLs: hash names redirect to /media; pre-hash names are served from the flat directory"""
+    if ASSET_NAME.fullmatch(name):
+        query = f"?{request.url.query}" if request.url.query else ""
+        return RedirectResponse(url=f"/media/{name}{query}", status_code=301)
+    return await get_media(name, request, w)
+
+@app.api_route("/media/{name}", methods=["GET", "HEAD"])
+async def get_media(name: str, request: Request, w: Optional[int] = None):
+    """Generated image by name; `w` returns a cached downscaled copy (snapped to MEDIA_THUMB_WIDTHS)"""
+    path = media_store.resolve(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    if w is not None:
+        if w <= 0:
+            raise HTTPException(status_code=400, detail="w must be a positive width")
+        path = await run_in_threadpool(media_store.thumbnail, path, w) or path
+
+    media = await run_in_threadpool(media_store.open, path)
+    headers = {"ETag": media.etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), media.etag):
+        return Response(status_code=304, headers=headers)
+    if media.data is not None and "range" not in request.headers:
+        return Response(media.data, media_type=media.media_type, headers={**headers, "Accept-Ranges": "bytes"})
+    # Large files and Range requests (incl. If-Range) stream from disk
+    return FileResponse(media.path, media_type=media.media_type, headers=headers)
 
 sr_model = None
 
-def process_product_image(uploaded_file, ad_text: str, description: str = "") -> str:
+def process_product_image(image_data: bytes, ad_text: str, description: str = "",
+                          progress: Optional[Callable] = None, background_preset: str = "studio",
+                          quality: str = DEFAULT_QUALITY) -> str:
     """
-    Read uploaded_file (FastAPI UploadFile), remove background if possible,
-    generate or fallback a background, composite the product centered,
-    optionally upscale if `sr_model` exists, overlay ad_text and save.
+    Decode the uploaded image bytes (already size-checked by read_upload),
+    remove background if possible, generate or fallback a background,
+    composite the product centered, optionally upscale if `sr_model` exists,
+    overlay ad_text and save.
+    `quality` picks the canvas size, background steps and scheduler.
     Returns saved file path (relative).
     """
+    timer = StageTimer("process_product_image")
+    rss_before = current_rss_bytes()
     try:
         # --- 0) ensure output dir
         GENERATED_DIR = "generated_ads"
         os.makedirs(GENERATED_DIR, exist_ok=True)
 
-        # --- 1) read bytes from UploadFile safely (use file handle, not await)
-        try:
-            uploaded_file.file.seek(0)
-        except Exception:
-            pass
-        data = uploaded_file.file.read()
-        if not data:
-            raise ValueError("Uploaded file is empty")
-
-        # --- 2) open product image, convert to RGBA
-        product = Image.open(io.BytesIO(data)).convert("RGBA")
-
-        # --- 3) resize to safe dimensions (max side 1024) and make dims divisible by 8
-        max_side = 1024
-        w0, h0 = product.width, product.height
-        scale = min(1.0, max_side / max(w0, h0))
-        new_w = max(8, int(w0 * scale))
-        new_h = max(8, int(h0 * scale))
-
-        # make divisible by 8 (diffusers requirement)
-        def _div8(x): return x - (x % 8) if x % 8 == 0 else (x + (8 - (x % 8)))
-        new_w = _div8(new_w)
-        new_h = _div8(new_h)
-
-        product = product.resize((new_w, new_h), Image.LANCZOS)
-
-        # --- 4) attempt background removal using rembg (best-effort)
-        fg = None
-        try:
-            from rembg import remove
-            no_bg = remove(data)  # returns bytes or PIL-like
-            if isinstance(no_bg, (bytes, bytearray)):
-                fg = Image.open(io.BytesIO(no_bg)).convert("RGBA")
-            else:
-                # rembg may return PIL image in some versions
-                fg = no_bg.convert("RGBA")
-            # ensure same size as product
-            fg = fg.resize((new_w, new_h), Image.LANCZOS)
-        except Exception as e:
+        # --- 1-3) header check, then decode straight to the tier's max side
+        # (JPEG draft decoding, EXIF orientation applied, dims divisible by 8)
+        tier = QUALITY_TIERS[quality]
+        with timer.stage("decode"):
+            product, decode_info = decode_product_image(image_data, tier["max_side"])
+        new_w, new_h = product.size
+
+        # --- 4) background removal on the resized image (persistent session, masks cached by upload hash)
+        with timer.stage("remove_background"):
+            fg = background_remover.remove(product, source_hash=hashlib.sha256(image_data).hexdigest())
+        if fg is None:
             # fallback: use the resized product as foreground (no alpha)
             fg = product
 
-        # --- 5) generate background via global txt2img_pipe if available, else programmatic studio bg
+        # --- 5) generate background through the micro-batch scheduler (shared pipeline registry entry),
+        # else programmatic studio bg
         bg = None
-        try:
-            prompt = f"Advertising background for product: {description or ad_text}. soft studio lighting, subtle vignette, minimal, professional, realistic, high quality"
-            # use global pipeline if available and loaded (StableDiffusionPipeline)
-            if "txt2img_pipe" in globals() and txt2img_pipe is not None:
+        with timer.stage("background"):
+            try:
+                prompt = f"Advertising background for product: {description or ad_text}. soft studio lighting, subtle vignette, minimal, professional, realistic, high quality"
+                # shared, micro-batched pipeline (same registry entry generate_visual_ad uses);
+                # raises if torch/diffusers are unavailable and we fall back below
                 # ensure height/width divisible by 8 (already done)
-                out = txt2img_pipe(prompt, height=new_h, width=new_w, guidance_scale=7.5, num_inference_steps=20)
-                bg = out.images[0].convert("RGBA")
-            else:
-                raise RuntimeError("txt2img_pipe not available")
-        except Exception:
-            # programmatic studio background (safe fallback)
-            def make_studio_background(size=(new_w, new_h)):
-                w, h = size
-                base = Image.new("RGB", (w, h), "#f5f6f8")
-                # simple vertical gradient
-                top = Image.new("RGB", (w, h), "#ffffff")
-                bottom = Image.new("RGB", (w, h), "#e9eef2")
-                mask = Image.new("L", (w, h))
-                for y in range(h):
-                    val = int(255 * (y / h))
-                    for x in range(w):
-                        mask.putpixel((x, y), val)
-                grad = Image.composite(top, bottom, mask)
-                grad = grad.filter(ImageFilter.GaussianBlur(radius=6))
-                # subtle vignette
-                vign = Image.new("L", (w, h), 0)
-                for y in range(h):
-                    for x in range(w):
-                        dx = (x - w / 2) / (w / 2)
-                        dy = (y - h / 2) / (h / 2)
-                        d = (dx * dx + dy * dy) ** 0.5
-                        vign.putpixel((x, y), int(255 * max(0, 1 - d * 0.8)))
-                vign = vign.filter(ImageFilter.GaussianBlur(radius=20))
-                bg = Image.composite(grad, Image.new("RGB", (w, h), "#ffffff"), vign)
-                return bg
-            bg = make_studio_background((new_w, new_h)).convert("RGBA")
+                out = batch_scheduler.generate(prompt, height=new_h, width=new_w, guidance_scale=7.5,
+                                               num_inference_steps=tier["bg_steps"], scheduler=tier["scheduler"],
+                                               progress=progress)
+                bg = out.convert("RGBA")
+            except JobCancelled:
+                raise  # not a reason to fall back and keep working
+            except Exception:
+                # programmatic studio background (safe fallback, cached per size/preset)
+                bg = make_background((new_w, new_h), preset=background_preset).convert("RGBA")
 
         # --- 6) composite foreground centered on background (handle alpha)
-        composed = Image.new("RGBA", (new_w, new_h))
-        composed.paste(bg, (0, 0))
-        # If fg has alpha channel, use alpha_composite; otherwise paste centered
-        if fg.mode == "RGBA":
-            # ensure fg size equals canvas
-            if fg.size != composed.size:
-                fg = fg.resize(composed.size, Image.LANCZOS)
-            composed = Image.alpha_composite(composed, fg)
-        else:
-            # fg has no alpha -> paste centered
-            fw, fh = fg.size
-            x = (new_w - fw) // 2
-            y = (new_h - fh) // 2
-            composed.paste(fg.convert("RGBA"), (x, y))
+        with timer.stage("composite"):
+            composed = Image.new("RGBA", (new_w, new_h))
+            composed.paste(bg, (0, 0))
+            # If fg has alpha channel, use alpha_composite; otherwise paste centered
+            if fg.mode == "RGBA":
+                # ensure fg size equals canvas
+                if fg.size != composed.size:
+                    fg = fg.resize(composed.size, Image.LANCZOS)
+                composed = Image.alpha_composite(composed, fg)
+            else:
+                # fg has no alpha -> paste centered
+                fw, fh = fg.size
+                x = (new_w - fw) // 2
+                y = (new_h - fh) // 2
+                composed.paste(fg.convert("RGBA"), (x, y))
 
         # --- 7) optional upscaling if sr_model present (best-effort)
         final_rgb = composed.convert("RGB")
@@ -293,72 +330,480 @@ def process_product_image(uploaded_file, ad_text: str, description: str = "") ->
             # ignore upscaling failures
             pass
 
-        # --- 8) overlay ad text (assumes overlay_text(image, text) exists)
-        final_with_text = overlay_text(final_rgb, ad_text)
+        # --- 8) overlay ad text (app.services.text_overlay)
+        with timer.stage("overlay_text"):
+            final_with_text = overlay_text(final_rgb, ad_text)
 
-        # --- 9) save
-        filename = f"product_enhanced_{int(time.time())}.jpg"
-        save_path = os.path.join(GENERATED_DIR, filename)
-        final_with_text.save(save_path, quality=92)
+        # --- 9) save under a content-hash filename (no same-second collisions)
+        with timer.stage("save"):
+            save_path = image_cache.save(final_with_text, ext="jpg", quality=92)
 
+        rss_after = current_rss_bytes()
+        upload_stats.record(len(image_data), decode_info,
+                            rss_after - rss_before if rss_before is not None and rss_after is not None else None)
         return save_path
 
+    except UploadRejected as e:
+        upload_stats.record_rejection(e.status_code)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         # propagate as HTTPException for FastAPI endpoints
         print("❌ process_product_image error:", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timer.finish()
 
 
-# app.mount("/uploaded_images", StaticFiles(directory="uploaded_images"), name="uploaded_images")
+# ---- Streaming helpers ----
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_llm_events(prompt: str, finalize: Optional[Callable] = None, fallback: Optional[Callable] = None,
+                             use_cache: bool = True):
+    """Forward visible tokens as SSE `token` events, then a `done` event with timings
+
+    <think> blocks are stripped as they stream; ttft_ms is measured to the
+    first visible token, first_token_ms to the first raw (reasoning) token.
+    """
+    started = time.perf_counter()
+    ms = lambda: round((time.perf_counter() - started) * 1000, 1)
+    stripper = ThinkStripper()
+    parts = []
+    first_token_ms = ttft_ms = None
+    try:
+        async for token in llm_client.stream(prompt, use_cache=use_cache):
+            if first_token_ms is None:
+                first_token_ms = ms()
+            visible = stripper.feed(token)
+            if visible:
+                if ttft_ms is None:
+                    ttft_ms = ms()
+                    yield _sse("ttft", {"ttft_ms": ttft_ms, "first_token_ms": first_token_ms})
+                parts.append(visible)
+                yield _sse("token", {"text": visible})
+        tail = stripper.flush()
+        if tail:
+            parts.append(tail)
+            yield _sse("token", {"text": tail})
+
+        text = "".join(parts).strip()
+        if finalize:
+            text = finalize(text)
+        yield _sse("done", {"text": text, "ttft_ms": ttft_ms, "first_token_ms": first_token_ms, "total_ms": ms()})
+    except Exception as e:
+        print(f"❌ LLM stream error: {e}")
+        if fallback:
+            yield _sse("done", {"text": fallback(), "fallback": True, "total_ms": ms()})
+        else:
+            yield _sse("error", {"detail": str(e)})
+
+
+def _event_stream(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 
 # ---- Routes ----
 @app.post("/generate-ad/")
 async def generate_text_ad(request: TextAdRequest):
-    ad_text = generate_ad_with_deepseek(request.product_name, request.description)
+    ad_text = await generate_ad_with_deepseek(
+        request.product_name, request.description, use_cache=not request.no_cache
+    )
     return {"ad_text": ad_text}
 
+@app.post("/generate-ad/stream")
+async def stream_text_ad(request: TextAdRequest):
+    """Stream ad text tokens as server-sent events"""
+    prompt = build_ad_prompt(request.product_name, request.description)
+    return _event_stream(_stream_llm_events(prompt, use_cache=not request.no_cache))
+
 @app.post("/generate-visual-ad/")
 async def generate_visual_ad_endpoint(request: TextAdRequest):
+    _check_quality(request.quality)
+    # Blocking work runs in the threadpool so the event loop stays responsive
     # Automatically generate ad text
-    ad_text = generate_ad_with_deepseek(request.product_name, request.description)
+    ad_text = await generate_ad_with_deepseek(
+        request.product_name, request.description, use_cache=not request.no_cache
+    )
     
     # Generate image with overlay
-    image_path = generate_visual_ad(request.product_name, request.description, ad_text)
-    os.makedirs("uploaded_images", exist_ok=True)
-  
+    image_path = await run_in_threadpool(
+        generate_visual_ad, request.product_name, request.description, ad_text,
+        seed=request.seed, use_cache=not request.no_cache, quality=request.quality
+    )
+
     return {
         "image_name": os.path.basename(image_path),
-        "ad_text": ad_text
+        "renditions": await _renditions(image_path, use_cache=not request.no_cache, owner=request.user_id),
+        "ad_text": ad_text,
+        # pass seed + ad_text to /refine-visual-ad/ to upgrade a draft
+        "seed": visual_ad_spec(request.product_name, request.description, ad_text, request.seed, request.quality)["seed"],
+        "quality": request.quality
+    }
+
+@app.post("/refine-visual-ad/")
+async def refine_visual_ad_endpoint(request: RefineRequest):
+    """Re-render a draft at standard/high quality, keeping its composition"""
+    _check_quality(request.quality, allowed=("standard", "high"))
+    image_path = await run_in_threadpool(
+        refine_visual_ad, request.product_name, request.description, request.ad_text, request.seed,
+        quality=request.quality, use_cache=not request.no_cache
+    )
+    return {
+        "image_name": os.path.basename(image_path),
+        "renditions": await _renditions(image_path, use_cache=not request.no_cache, owner=request.user_id),
+        "ad_text": request.ad_text,
+        "seed": request.seed,
+        "quality": request.quality
     }
 
 @app.get("/")
 async def root():
     return {"message": "AutoMark Backend (DeepSeek + Stable Diffusion) is running 🚀"}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 once models are resident, 503 while warming up"""
+    state = warmup_state.to_dict()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+@app.get("/api/models/stats")
+async def get_model_stats():
+    """Load time and resident memory of cached diffusion pipelines"""
+    return pipeline_registry.stats()
+
+@app.get("/api/models/batching")
+async def get_batching_stats():
+    """Micro-batch latency and occupancy for Stable Diffusion calls"""
+    return batch_scheduler.stats()
+
+@app.get("/api/models/prompt-cache")
+async def get_prompt_cache_stats():
+    """Prompt embedding cache hit rate and text-encoder time saved"""
+    return prompt_embedding_cache.stats()
+
+async def _renditions(path: str, use_cache: bool = True, owner: Optional[str] = None) -> Dict:
+    """WebP + progressive JPEG full/thumb/feed/story versions of a generated image"""
+    def build():
+        renditions = build_renditions(path, use_cache=use_cache, url_for=media_url)
+        if owner:
+            asset_index.set_owner(os.path.basename(path), owner)  # also tags the renditions
+        return renditions
+    return await run_in_threadpool(build)
+
+@app.get("/api/images/media")
+async def get_media_stats():
+    """/media memory-cache hits, disk reads and thumbnail cache usage"""
+    return media_store.stats()
+
+@app.get("/api/images/encoding")
+async def get_encoding_stats():
+    """Encode time and output size per format for generated-image renditions"""
+    return encoding_stats.stats()
+
+@app.get("/api/images/cache")
+async def get_image_cache_stats():
+    """Generated image cache hits, coalesced requests and disk usage"""
+    return image_cache.stats()
+
+@app.get("/api/admin/storage")
+async def get_storage_usage():
+    """Generated-image disk usage by kind and owner, quota, and retention sweep history"""
+    usage = await run_in_threadpool(storage_manager.usage)
+    return {**usage, "thumbnails": media_store.thumbs.stats()}
+
+@app.post("/api/admin/storage/sweep")
+async def sweep_storage(dry_run: bool = False):
+    """Run the retention sweep now; with dry_run, report what it would delete"""
+    return await run_in_threadpool(storage_manager.sweep, dry_run)
+
+def _check_background_preset(preset: str):
+    if preset not in BACKGROUND_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown background_preset '{preset}'. Choose one of: {', '.join(BACKGROUND_PRESETS)}"
+        )
+
+@app.get("/api/images/background-removal")
+async def get_background_removal_stats():
+    """Background-removal engine state, mask cache hits and per-stage enhancement timings"""
+    return {
+        **background_remover.stats(),
+        "stages": stage_stats.summary().get("process_product_image", {}),
+    }
+
+async def _read_image_upload(file: UploadFile) -> bytes:
+    """Bounded read plus header check, so oversized images are refused before any decoding"""
+    try:
+        data = await read_upload(file)
+        probe_image(data)
+    except UploadRejected as e:
+        upload_stats.record_rejection(e.status_code)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return data
+
+@app.get("/api/images/uploads")
+async def get_upload_stats():
+    """Upload limits, rejections and decoded-bitmap / RSS growth per enhancement request"""
+    return upload_stats.stats()
+
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """Per-backend request counts, failures, outstanding calls and cache hit rates"""
+    return llm_client.stats()
+
 @app.post("/process_image_enhancement/")
 async def process_image_enhancement_endpoint(
     product_name: str = Form(...),
     description: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    background_preset: str = Form("studio"),
+    no_cache: bool = Form(False),
+    quality: str = Form(DEFAULT_QUALITY),
+    user_id: Optional[str] = Form(None)
 ):
+    _check_background_preset(background_preset)
+    _check_quality(quality)
+    image_data = await _read_image_upload(file)
+
     # Step 1: Generate ad text
-    ad_text = generate_ad_with_deepseek(product_name, description)
+    ad_text = await generate_ad_with_deepseek(product_name, description, use_cache=not no_cache)
 
     # Step 2: Enhance image + overlay text (one function handles everything)
-    final_image_path = process_product_image(file, ad_text)
+    final_image_path = await run_in_threadpool(
+        process_product_image, image_data, ad_text, background_preset=background_preset, quality=quality
+    )
 
     return {
-        "image_url": f"http://localhost:8000/{final_image_path}",
+        "image_url": media_url(final_image_path),
+        "renditions": await _renditions(final_image_path, use_cache=not no_cache, owner=user_id),
         "ad_text": ad_text
     }
 
+# ---- Background Jobs ----
+async def _visual_ad_job(job, product_name: str, description: str, use_cache: bool = True,
+                         seed: Optional[int] = None, quality: str = DEFAULT_QUALITY, owner: Optional[str] = None):
+    job.report(message="generating ad text")
+    ad_text = await generate_ad_with_deepseek(product_name, description, use_cache=use_cache)
+    job.report(message="rendering image")
+    image_path = await job_queue.run_blocking(
+        generate_visual_ad, product_name, description, ad_text, progress=job.report,
+        seed=seed, use_cache=use_cache, quality=quality
+    )
+    job.report(message="encoding renditions")
+    return {
+        "image_name": os.path.basename(image_path),
+        "image_url": media_url(image_path),
+        "renditions": await _renditions(image_path, use_cache=use_cache, owner=owner),
+        "ad_text": ad_text,
+        "seed": visual_ad_spec(product_name, description, ad_text, seed, quality)["seed"],
+        "quality": quality
+    }
+
+async def _refine_visual_ad_job(job, request: RefineRequest):
+    job.report(message="refining draft")
+    image_path = await job_queue.run_blocking(
+        refine_visual_ad, request.product_name, request.description, request.ad_text, request.seed,
+        quality=request.quality, progress=job.report, use_cache=not request.no_cache
+    )
+    job.report(message="encoding renditions")
+    return {
+        "image_name": os.path.basename(image_path),
+        "image_url": media_url(image_path),
+        "renditions": await _renditions(image_path, use_cache=not request.no_cache, owner=request.user_id),
+        "ad_text": request.ad_text,
+        "seed": request.seed,
+        "quality": request.quality
+    }
+
+async def _image_enhancement_job(job, product_name: str, description: str, image_data: bytes,
+                                 background_preset: str = "studio", use_cache: bool = True,
+                                 quality: str = DEFAULT_QUALITY, owner: Optional[str] = None):
+    job.report(message="generating ad text")
+    ad_text = await generate_ad_with_deepseek(product_name, description, use_cache=use_cache)
+    job.report(message="enhancing image")
+    final_image_path = await job_queue.run_blocking(
+        process_product_image, image_data, ad_text, progress=job.report, background_preset=background_preset,
+        quality=quality
+    )
+    job.report(message="encoding renditions")
+    return {
+        "image_url": media_url(final_image_path),
+        "renditions": await _renditions(final_image_path, use_cache=use_cache, owner=owner),
+        "ad_text": ad_text
+    }
+
+async def _ad_variants_job(job, product_name: str, description: str, n: int, seeds: List[int],
+                          use_cache: bool = True, quality: str = DEFAULT_QUALITY, owner: Optional[str] = None):
+    """N ad texts from one LLM call, each rendered with M seeds; returns a manifest"""
+    started = time.perf_counter()
+    job.report(message="generating ad texts")
+    ad_texts = await generate_ad_variants(product_name, description, n, use_cache=use_cache)
+
+    total = len(ad_texts) * len(seeds)
+    steps_done = {}
+    tier = QUALITY_TIERS[quality]
+    job.report(step=0, total_steps=total * tier["steps"], message=f"rendering {total} images")
+
+    def progress_for(cell):
+        def progress(step, total_steps):
+            steps_done[cell] = step
+            job.report(step=sum(steps_done.values()))
+        return progress
+
+    # Enough renders in flight to keep the micro-batcher's batches full; images
+    # sharing a text share its prompt encoding, images sharing a seed its latents
+    in_flight = asyncio.Semaphore(batch_scheduler.max_batch * 2)
+
+    async def render(i: int, j: int):
+        async with in_flight:
+            path = await run_in_threadpool(
+                generate_visual_ad, product_name, description, ad_texts[i],
+                progress=progress_for((i, j)), seed=seeds[j], use_cache=use_cache, quality=quality
+            )
+        steps_done[(i, j)] = tier["steps"]  # cache hits report no steps
+        job.report(step=sum(steps_done.values()))
+        return path, await _renditions(path, use_cache=use_cache, owner=owner)
+
+    cells = [(i, j) for i in range(len(ad_texts)) for j in range(len(seeds))]
+    results = await asyncio.gather(*[render(i, j) for i, j in cells], return_exceptions=True)
+    job.check_cancelled()
+
+    variants = [{"index": i, "ad_text": text, "images": []} for i, text in enumerate(ad_texts)]
+    for (i, j), result in zip(cells, results):
+        if isinstance(result, BaseException):
+            image = {"seed": seeds[j], "error": getattr(result, "detail", None) or str(result)}
+        else:
+            path, renditions = result
+            image = {"seed": seeds[j], "image_name": os.path.basename(path),
+                     "image_url": media_url(path), "renditions": renditions}
+        variants[i]["images"].append(image)
+
+    return {
+        "product_name": product_name,
+        "description": description,
+        "model_id": SD_MODEL_ID,
+        "quality": quality,
+        "size": tier["size"],
+        "steps": tier["steps"],
+        "seeds": seeds,
+        "variants": variants,
+        "images": total,
+        "failed": sum(1 for r in results if isinstance(r, BaseException)),
+        "elapsed_s": round(time.perf_counter() - started, 2),
+    }
+
+def _submit_job(kind: str, func: Callable, *args) -> JSONResponse:
+    """Queue a job, answering 429 with Retry-After when the queue is full"""
+    try:
+        job = job_queue.submit(kind, func, *args)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    })
+
+def _get_job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/generate-visual-ad")
+async def submit_visual_ad_job(request: TextAdRequest):
+    """Queue a visual ad generation; poll /jobs/{id} or stream /jobs/{id}/events"""
+    _check_quality(request.quality)
+    return _submit_job("generate-visual-ad", _visual_ad_job, request.product_name, request.description,
+                       not request.no_cache, request.seed, request.quality, request.user_id)
+
+@app.post("/jobs/refine-visual-ad")
+async def submit_refine_visual_ad_job(request: RefineRequest):
+    """Queue a refine of a draft visual ad"""
+    _check_quality(request.quality, allowed=("standard", "high"))
+    return _submit_job("refine-visual-ad", _refine_visual_ad_job, request)
+
+@app.post("/jobs/process-image-enhancement")
+async def submit_image_enhancement_job(
+    product_name: str = Form(...),
+    description: str = Form(...),
+    file: UploadFile = File(...),
+    background_preset: str = Form("studio"),
+    no_cache: bool = Form(False),
+    quality: str = Form(DEFAULT_QUALITY),
+    user_id: Optional[str] = Form(None)
+):
+    """Queue a product image enhancement job"""
+    _check_background_preset(background_preset)
+    _check_quality(quality)
+    # The request's upload is closed once we respond, so keep the (size-checked) bytes
+    image_data = await _read_image_upload(file)
+    return _submit_job("process-image-enhancement", _image_enhancement_job, product_name, description, image_data,
+                       background_preset, not no_cache, quality, user_id)
+
+@app.post("/jobs/generate-ad-variants")
+async def submit_ad_variants_job(request: AdVariantsRequest):
+    """Queue N ad texts x M seeds renders for A/B testing; the job result is a manifest"""
+    seeds = request.seeds or [
+        seed_from_key(request_key(product_name=request.product_name, description=request.description, variant=j))
+        for j in range(request.num_seeds)
+    ]
+    if not 1 <= request.variants <= VARIANT_MAX_TEXTS:
+        raise HTTPException(status_code=400, detail=f"variants must be between 1 and {VARIANT_MAX_TEXTS}")
+    if not 1 <= len(seeds) <= VARIANT_MAX_SEEDS:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {VARIANT_MAX_SEEDS} seeds per request")
+    _check_quality(request.quality)
+    return _submit_job("generate-ad-variants", _ad_variants_job, request.product_name, request.description,
+                       request.variants, seeds, not request.no_cache, request.quality, request.user_id)
+
+@app.get("/jobs/stats")
+async def get_job_stats():
+    """Queue depth and job counts by status"""
+    return job_queue.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job's status, progress and result"""
+    return _get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events with job progress until it finishes"""
+    job = _get_job_or_404(job_id)
+
+    async def events():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield _sse("update", job.to_dict())
+                if job.status in TERMINAL_STATES:
+                    return
+            elif not await job.wait_for_change(version):
+                yield ": keep-alive\n\n"
+
+    return _event_stream(events())
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one at its next diffusion step"""
+    _get_job_or_404(job_id)
+    return job_queue.cancel(job_id).to_dict()
+
 # ---- Instagram Integration Routes ----
 from app.services.instagram_service import InstagramService
-from app.services.instagram_storage import (
-    get_user_connection, save_user_connection, delete_user_connection, save_instagram_post
+from app.services.graph_client import graph_client, GraphAPIError
+from app.services.instagram_storage import save_instagram_post, get_instagram_posts
+from app.services.connection_cache import (
+    connection_cache, get_user_connection, get_access_token, save_user_connection, delete_user_connection
+)
+from app.services.instagram_batch import publish_batch
+from app.services.caption_generator import (
+    generate_instagram_caption, build_caption_prompt, finalize_caption, fallback_caption
 )
-from app.services.caption_generator import generate_instagram_caption
-from fastapi.responses import RedirectResponse
 
 class InstagramConnectRequest(BaseModel):
     user_id: str = "default_user"  # In production, get from auth
@@ -372,6 +817,27 @@ class InstagramPostRequest(BaseModel):
     post_type: str = "feed"  # "feed" or "story"
     caption: Optional[str] = None
 
+class InstagramBatchItem(BaseModel):
+    user_id: str = "default_user"
+    image_url: Optional[str] = None
+    image_urls: Optional[List[str]] = None  # carousel albums (2-10 images)
+    post_type: str = "feed"  # "feed", "story" or "carousel"
+    caption: Optional[str] = None
+    ad_text: Optional[str] = None  # used to generate a caption when none is given
+    product_name: Optional[str] = None
+    description: Optional[str] = None
+
+class InstagramBatchPostRequest(BaseModel):
+    items: List[InstagramBatchItem]
+
+INSTAGRAM_BATCH_MAX_ITEMS = 100
+
+class InstagramScheduleRequest(InstagramPostRequest):
+    scheduled_at: float  # unix timestamp (seconds)
+
+class InstagramRescheduleRequest(BaseModel):
+    scheduled_at: float
+
 @app.get("/api/instagram/config-status")
 async def get_instagram_config_status():
     """Check Instagram configuration status"""
@@ -402,37 +868,61 @@ async def get_instagram_auth_url():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _find_business_account(pages: List[Dict], timer: StageTimer):
+    """First page (in page order) with a linked Instagram Business Account
+
+    me/accounts already returns instagram_business_account for each page;
+    only pages missing the field are looked up, concurrently.
+    """
+    async def lookup(page: Dict) -> Optional[str]:
+        linked = page.get("instagram_business_account")
+        if linked:
+            return linked.get("id")
+        if "instagram_business_account" in page:  # field present but empty: no account linked
+            return None
+        try:
+            return await run_in_threadpool(
+                InstagramService.get_instagram_business_account, page.get("id"), page.get("access_token")
+            )
+        except Exception as e:
+            print(f"⚠️ Business account lookup failed for page {page.get('id')}: {e}")
+            return None
+
+    with timer.stage("business_account_lookup"):
+        ig_account_ids = await asyncio.gather(*[lookup(page) for page in pages])
+    for page, ig_account_id in zip(pages, ig_account_ids):
+        if ig_account_id:
+            return ig_account_id, page.get("access_token")
+    return None, None
+
 @app.get("/api/instagram/callback")
 async def instagram_callback(code: str, user_id: str = "default_user"):
     """Handle Instagram OAuth callback"""
+    timer = StageTimer("instagram_callback")
     try:
         # Exchange code for token
-        token_data = InstagramService.exchange_code_for_token(code)
+        with timer.stage("exchange_code"):
+            token_data = await run_in_threadpool(InstagramService.exchange_code_for_token, code)
         access_token = token_data.get("access_token")
         
         # Get long-lived token
-        long_token_data = InstagramService.get_long_lived_token(access_token)
+        with timer.stage("long_lived_token"):
+            long_token_data = await run_in_threadpool(InstagramService.get_long_lived_token, access_token)
         long_token = long_token_data.get("access_token")
         expires_in = long_token_data.get("expires_in", 5184000)  # 60 days default
         
-        # Get user info
-        user_info = InstagramService.get_user_info(long_token)
-        
-        # Get Facebook pages
-        pages = InstagramService.get_facebook_pages(long_token)
+        # User info and Facebook pages only depend on the long-lived token
+        async def timed(stage: str, func, *args):
+            with timer.stage(stage):
+                return await run_in_threadpool(func, *args)
+
+        user_info, pages = await asyncio.gather(
+            timed("user_info", InstagramService.get_user_info, long_token),
+            timed("facebook_pages", InstagramService.get_facebook_pages, long_token),
+        )
         
         # Find Instagram Business Account
-        ig_user_id = None
-        page_access_token = None
-        for page in pages:
-            page_token = page.get("access_token")
-            ig_account_id = InstagramService.get_instagram_business_account(
-                page.get("id"), page_token
-            )
-            if ig_account_id:
-                ig_user_id = ig_account_id
-                page_access_token = page_token
-                break
+        ig_user_id, page_access_token = await _find_business_account(pages, timer)
         
         # Encrypt and save connection
         encrypted_token = InstagramService.encrypt_token(page_access_token or long_token)
@@ -447,18 +937,26 @@ async def instagram_callback(code: str, user_id: str = "default_user"):
             "connected_at": time.time()
         }
         
-        save_user_connection(user_id, connection_data)
+        with timer.stage("save_connection"):
+            await run_in_threadpool(save_user_connection, user_id, connection_data)
         
         # Redirect to frontend with success
         return RedirectResponse(url=f"http://localhost:5173/instagram-settings?connected=true")
     except Exception as e:
         print(f"❌ Instagram callback error: {e}")
         return RedirectResponse(url=f"http://localhost:5173/instagram-settings?error={str(e)}")
+    finally:
+        timer.finish()
+
+@app.get("/api/instagram/callback/timings")
+async def get_instagram_callback_timings():
+    """Average and max latency of each OAuth callback stage"""
+    return stage_stats.summary().get("instagram_callback", {})
 
 @app.get("/api/instagram/status")
 async def get_instagram_status(user_id: str = "default_user"):
     """Get Instagram connection status"""
-    connection = get_user_connection(user_id)
+    connection = await run_in_threadpool(get_user_connection, user_id)
     if not connection:
         return {"connected": False}
     
@@ -469,11 +967,27 @@ async def get_instagram_status(user_id: str = "default_user"):
         "connected_at": connection.get("connected_at")
     }
 
+@app.get("/api/instagram/cache")
+async def get_instagram_cache_stats():
+    """Connection cache hit rate and decrypt count"""
+    return connection_cache.stats()
+
+@app.get("/api/instagram/graph/stats")
+async def get_graph_api_stats():
+    """Graph API calls, retries, throttle waits, error codes and current quota usage"""
+    return graph_client.stats()
+
+@app.get("/api/instagram/posts")
+async def list_instagram_posts(user_id: str = "default_user", limit: int = 20, offset: int = 0):
+    """Paginated post history, newest first"""
+    limit = max(1, min(limit, 100))
+    return await run_in_threadpool(get_instagram_posts, user_id, limit=limit, offset=max(0, offset))
+
 @app.post("/api/instagram/disconnect")
 async def disconnect_instagram(request: InstagramConnectRequest):
     """Disconnect Instagram account"""
     try:
-        delete_user_connection(request.user_id)
+        await run_in_threadpool(delete_user_connection, request.user_id)
         return {"success": True, "message": "Instagram disconnected successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -482,14 +996,15 @@ async def disconnect_instagram(request: InstagramConnectRequest):
 async def post_to_instagram(request: InstagramPostRequest):
     """Post image to Instagram"""
     try:
+        # Graph calls throttle and back off with time.sleep, so everything
+        # blocking runs in the threadpool to keep the event loop free
         # Get user connection
-        connection = get_user_connection(request.user_id)
+        connection = await run_in_threadpool(get_user_connection, request.user_id)
         if not connection:
             raise HTTPException(status_code=400, detail="Instagram not connected")
         
-        # Decrypt token
-        encrypted_token = connection.get("encrypted_token")
-        access_token = InstagramService.decrypt_token(encrypted_token)
+        # Decrypted token (cached in memory only)
+        access_token = await run_in_threadpool(get_access_token, request.user_id)
         ig_user_id = connection.get("ig_business_account_id")
         
         if not ig_user_id:
@@ -498,14 +1013,15 @@ async def post_to_instagram(request: InstagramPostRequest):
         # Generate caption if not provided
         caption = request.caption
         if not caption:
-            caption = generate_instagram_caption(
+            caption = await generate_instagram_caption(
                 request.ad_text,
                 request.product_name,
                 request.description
             )
         
         # Post to Instagram
-        result = InstagramService.post_to_instagram(
+        result = await run_in_threadpool(
+            InstagramService.post_to_instagram,
             ig_user_id=ig_user_id,
             image_url=request.image_url,
             caption=caption if request.post_type == "feed" else "",  # Stories don't support captions
@@ -514,7 +1030,7 @@ async def post_to_instagram(request: InstagramPostRequest):
         )
         
         # Save post data
-        save_instagram_post(request.user_id, {
+        await run_in_threadpool(save_instagram_post, request.user_id, {
             "post_id": result.get("id"),
             "image_url": request.image_url,
             "caption": caption,
@@ -528,20 +1044,125 @@ async def post_to_instagram(request: InstagramPostRequest):
             "post_id": result.get("id"),
             "message": f"Successfully posted to Instagram {request.post_type}!"
         }
+    except HTTPException:
+        raise
+    except GraphAPIError as e:
+        # Surface Graph throttling as 429 and other Graph failures as upstream errors
+        print(f"❌ Instagram post error ({e.code}): {e}")
+        if e.rate_limited:
+            headers = {"Retry-After": str(max(1, int(e.retry_after)))} if e.retry_after else None
+            raise HTTPException(status_code=429, detail=str(e), headers=headers)
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         print(f"❌ Instagram post error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/instagram/batch-post")
+async def batch_post_to_instagram(request: InstagramBatchPostRequest):
+    """Publish many posts (feed, story or carousel) across accounts; per-item results"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to post")
+    if len(request.items) > INSTAGRAM_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {INSTAGRAM_BATCH_MAX_ITEMS} items per batch")
+
+    results = await publish_batch([item.model_dump() for item in request.items])
+    return {
+        "success": all(r["success"] for r in results),
+        "posted": sum(1 for r in results if r["success"]),
+        "failed": sum(1 for r in results if not r["success"]),
+        "results": results
+    }
+
+@app.post("/api/instagram/schedule", status_code=201)
+async def schedule_instagram_post(request: InstagramScheduleRequest):
+    """Queue a post for publishing at scheduled_at; failures are retried with backoff"""
+    if request.post_type not in ("feed", "story"):
+        raise HTTPException(status_code=400, detail=f"Unknown post_type: {request.post_type}")
+    if not await run_in_threadpool(get_user_connection, request.user_id):
+        raise HTTPException(status_code=400, detail="Instagram not connected")
+
+    # Generate the caption now so the user can review it before it goes out
+    caption = request.caption
+    if not caption and request.post_type == "feed":
+        caption = await generate_instagram_caption(request.ad_text, request.product_name, request.description)
+
+    return await run_in_threadpool(post_scheduler.schedule, request.user_id, request.scheduled_at, {
+        "image_url": request.image_url,
+        "caption": caption or "",
+        "post_type": request.post_type,
+        "product_name": request.product_name,
+    })
+
+@app.get("/api/instagram/scheduled")
+async def list_scheduled_posts(user_id: str = "default_user", status: Optional[str] = None,
+                               limit: int = 50, offset: int = 0):
+    """Scheduled posts for a user, soonest first"""
+    if status and status not in SCHEDULED_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of: {', '.join(SCHEDULED_STATUSES)}")
+    limit = max(1, min(limit, 200))
+    posts = await run_in_threadpool(
+        post_scheduler.store.list, user_id, status=status, limit=limit, offset=max(0, offset)
+    )
+    return {"posts": posts}
+
+@app.get("/api/instagram/scheduled/stats")
+async def get_scheduled_post_stats():
+    """Scheduler counters and queue size by status"""
+    return await run_in_threadpool(post_scheduler.stats)
+
+async def _get_scheduled_or_404(post_id: int):
+    post = await run_in_threadpool(post_scheduler.store.get, post_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Scheduled post not found")
+    return post
+
+@app.get("/api/instagram/scheduled/{post_id}")
+async def get_scheduled_post(post_id: int):
+    """Status, attempts and last error of one scheduled post"""
+    return await _get_scheduled_or_404(post_id)
+
+@app.patch("/api/instagram/scheduled/{post_id}")
+async def reschedule_instagram_post(post_id: int, request: InstagramRescheduleRequest):
+    """Move a pending post to a new time, or requeue an "unknown" one once you know it didn't go out"""
+    await _get_scheduled_or_404(post_id)
+    if not await run_in_threadpool(post_scheduler.reschedule, post_id, request.scheduled_at):
+        raise HTTPException(status_code=409, detail="Only pending or unknown posts can be rescheduled")
+    return await _get_scheduled_or_404(post_id)
+
+@app.delete("/api/instagram/scheduled/{post_id}")
+async def cancel_scheduled_post(post_id: int):
+    """Cancel a pending post"""
+    await _get_scheduled_or_404(post_id)
+    if not await run_in_threadpool(post_scheduler.cancel, post_id):
+        raise HTTPException(status_code=409, detail="Only pending or unknown posts can be cancelled")
+    return await _get_scheduled_or_404(post_id)
+
 @app.post("/api/instagram/generate-caption")
 async def generate_caption_for_instagram(
     ad_text: str = Form(...),
     product_name: str = Form(...),
-    description: str = Form(...)
+    description: str = Form(...),
+    no_cache: bool = Form(False)
 ):
     """Generate Instagram-optimized caption"""
     try:
-        caption = generate_instagram_caption(ad_text, product_name, description)
+        caption = await generate_instagram_caption(ad_text, product_name, description, use_cache=not no_cache)
         return {"caption": caption}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/instagram/generate-caption/stream")
+async def stream_caption_for_instagram(
+    ad_text: str = Form(...),
+    product_name: str = Form(...),
+    description: str = Form(...),
+    no_cache: bool = Form(False)
+):
+    """Stream an Instagram caption as server-sent events"""
+    prompt = build_caption_prompt(ad_text, product_name, description)
+    return _event_stream(_stream_llm_events(
+        prompt,
+        finalize=lambda caption: finalize_caption(caption, ad_text, product_name),
+        fallback=lambda: fallback_caption(ad_text, product_name),
+        use_cache=not no_cache
+    ))
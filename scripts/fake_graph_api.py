@@ -0,0 +1,128 @@
+"""Minimal local stand-in for the Facebook Graph API endpoints we call
+
+Run from the repo root:
+    python -m scripts.fake_graph_api --port 8765 [--latency 0.2] [--fail-rate 0.1]
+then start the backend with FACEBOOK_GRAPH_URL=http://127.0.0.1:8765.
+
+Media containers, carousels, stories and publishing are accepted and
+recorded; GET /debug/calls returns what was received. Responses carry
+X-App-Usage / X-Business-Use-Case-Usage headers that rise with load; with
+--limit N, calls beyond N per minute are rejected with Graph error code 4
+(application request limit reached).
+"""
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_ids = itertools.count(1000)
+_lock = threading.Lock()
+_calls = []
+_containers = {}
+
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    limit = 0  # calls per minute before code 4 errors; 0 = unlimited
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _params(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update({k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()})
+        return params
+
+    def _recent_calls(self):
+        with _lock:
+            return sum(1 for c in _calls if c["at"] > time.time() - 60)
+
+    def _send(self, status, body):
+        recent = self._recent_calls()
+        usage = min(100, recent * 100 // self.limit if self.limit else recent)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-App-Usage", json.dumps({"call_count": usage, "total_time": usage // 2, "total_cputime": usage // 2}))
+        account = self.path.strip("/").split("/")[1] if self.path.count("/") > 1 else "app"
+        self.send_header("X-Business-Use-Case-Usage", json.dumps({
+            account: [{"type": "instagram", "call_count": usage, "total_time": 0, "total_cputime": 0,
+                       "estimated_time_to_regain_access": 0}]
+        }))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        params = self._params()
+        path = urlparse(self.path).path.strip("/").split("/")
+        with _lock:
+            _calls.append({"method": method, "path": "/".join(path), "params": params, "at": time.time()})
+
+        if path == ["debug", "calls"]:
+            with _lock:
+                return self._send(200, {"calls": _calls})
+        if self.latency:
+            time.sleep(self.latency)
+        if self.limit and self._recent_calls() > self.limit:
+            return self._send(400, {"error": {"message": "Application request limit reached", "code": 4}})
+        if random.random() < self.fail_rate:
+            return self._send(500, {"error": {"message": "An unexpected error has occurred", "code": 2}})
+
+        if method == "GET" and path[-2:] == ["me", "accounts"]:
+            return self._send(200, {"data": [
+                {"id": "page_1", "name": "Page", "access_token": "page_token",
+                 "instagram_business_account": {"id": "ig_1"}}
+            ]})
+        if method == "GET" and len(path) == 2:
+            return self._send(200, {"id": path[1], "instagram_business_account": {"id": "ig_" + path[1]}})
+        if method == "POST" and path[-1] == "media":
+            container_id = f"container_{next(_ids)}"
+            with _lock:
+                _containers[container_id] = params
+            return self._send(200, {"id": container_id})
+        if method == "POST" and path[-1] == "media_publish":
+            with _lock:
+                known = params.get("creation_id") in _containers
+            if not known:
+                return self._send(400, {"error": {"message": "Invalid creation_id", "code": 100}})
+            return self._send(200, {"id": f"media_{next(_ids)}"})
+        return self._send(404, {"error": {"message": "Unknown path", "code": 803}})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def serve(port: int = 8765, latency: float = 0.0, fail_rate: float = 0.0, limit: int = 0) -> ThreadingHTTPServer:
+    """Start the fake in a background thread and return the server"""
+    FakeGraphHandler.latency = latency
+    FakeGraphHandler.fail_rate = fail_rate
+    FakeGraphHandler.limit = limit
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeGraphHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--limit", type=int, default=0, help="calls per minute before rate-limit errors")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.fail_rate, args.limit)
+    print(f"Fake Graph API on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,115 @@
+"""publish_batch against the local fake Graph API (scripts/fake_graph_api.py)
+
+Run from the repo root: python -m pytest tests
+"""
+import asyncio
+import threading
+
+import pytest
+
+from scripts import fake_graph_api
+from app.services import graph_client as graph_client_module
+from app.services import instagram_batch, instagram_service
+
+ACCOUNTS = {
+    "user_a": {"ig_business_account_id": "ig_a"},
+    "user_b": {"ig_business_account_id": "ig_b"},
+}
+
+
+@pytest.fixture
+def fake_graph(monkeypatch):
+    """Start the fake on a free port and point the services at it"""
+    server = fake_graph_api.serve(port=0, latency=0.02)
+    monkeypatch.setattr(instagram_service, "FACEBOOK_GRAPH_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    # Fresh buckets and counters per test; short backoff so retries don't slow the suite
+    monkeypatch.setattr(instagram_service, "graph_client", graph_client_module.GraphClient())
+    monkeypatch.setattr(graph_client_module, "GRAPH_RETRY_BASE_DELAY", 0.05)
+    monkeypatch.setattr(instagram_batch, "_limiters", {})
+
+    monkeypatch.setattr(instagram_batch, "get_user_connection", lambda user_id: ACCOUNTS.get(user_id))
+    monkeypatch.setattr(instagram_batch, "get_access_token", lambda user_id: f"token_{user_id}")
+    saved = []
+    monkeypatch.setattr(instagram_batch, "save_instagram_post", lambda user_id, post: saved.append((user_id, post)))
+
+    with fake_graph_api._lock:
+        fake_graph_api._calls.clear()
+        fake_graph_api._containers.clear()
+    yield saved
+    server.shutdown()
+    server.server_close()
+    fake_graph_api.FakeGraphHandler.limit = 0
+
+
+def _item(user_id: str, n: int) -> dict:
+    return {"user_id": user_id, "post_type": "feed", "image_url": f"https://img/{user_id}/{n}.png", "caption": f"#{n}"}
+
+
+def _published_images(ig_user_id: str) -> list:
+    """Image urls of the containers published for one account, in publish order"""
+    with fake_graph_api._lock:
+        return [
+            fake_graph_api._containers[c["params"]["creation_id"]]["image_url"]
+            for c in fake_graph_api._calls
+            if c["method"] == "POST" and c["path"].endswith(f"{ig_user_id}/media_publish")
+        ]
+
+
+def test_each_account_publishes_in_submission_order(fake_graph):
+    items = [_item(user_id, n) for n in range(4) for user_id in ("user_a", "user_b")]
+
+    results = asyncio.run(instagram_batch.publish_batch(items))
+
+    assert [r["index"] for r in results] == list(range(len(items)))
+    assert all(r["success"] and r["post_id"] for r in results)
+    assert _published_images("ig_a") == [f"https://img/user_a/{n}.png" for n in range(4)]
+    assert _published_images("ig_b") == [f"https://img/user_b/{n}.png" for n in range(4)]
+    assert len(fake_graph) == len(items)
+
+
+def test_rate_limited_calls_back_off_and_retry(fake_graph):
+    fake_graph_api.FakeGraphHandler.limit = 1
+    # Lift the limit shortly after the first rejections, like a real window rolling over
+    threading.Timer(0.3, setattr, (fake_graph_api.FakeGraphHandler, "limit", 0)).start()
+    items = [_item("user_a", n) for n in range(3)]
+
+    results = asyncio.run(instagram_batch.publish_batch(items))
+
+    assert all(r["success"] for r in results), results
+    stats = instagram_service.graph_client.stats()
+    assert stats["rate_limited"] > 0
+    assert stats["retries"] > 0
+    assert stats["error_codes"].get("4")
+    assert _published_images("ig_a") == [item["image_url"] for item in items]
+
+
+def test_failing_account_does_not_affect_others(fake_graph, monkeypatch):
+    def get_connection(user_id):
+        if user_id == "user_broken":
+            raise ValueError("token no longer decrypts")
+        return ACCOUNTS.get(user_id)
+
+    monkeypatch.setattr(instagram_batch, "get_user_connection", get_connection)
+    items = [_item("user_a", 0), _item("user_broken", 0), _item("user_missing", 0), _item("user_b", 0)]
+
+    results = asyncio.run(instagram_batch.publish_batch(items))
+
+    assert results[0]["success"] and results[3]["success"]
+    assert not results[1]["success"] and "token no longer decrypts" in results[1]["error"]
+    assert not results[2]["success"] and results[2]["error"] == "Instagram not connected"
+    with fake_graph_api._lock:
+        paths = {c["path"] for c in fake_graph_api._calls}
+    assert not any("user_broken" in p or "user_missing" in p for p in paths)
+
+
+def test_history_save_failure_is_reported_separately(fake_graph, monkeypatch):
+    def save(user_id, post):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(instagram_batch, "save_instagram_post", save)
+
+    [result] = asyncio.run(instagram_batch.publish_batch([_item("user_a", 0)]))
+
+    assert result["success"] and result["post_id"]
+    assert "error" not in result
+    assert result["save_error"] == "database unavailable"